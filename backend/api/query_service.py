@@ -1,11 +1,24 @@
-from typing import Any, Dict, List, Optional
+import json
+import os
+from typing import Any, Dict, List, Optional, Union
 import logging
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 
 from services import embedding_service
+from services.chunk_store import QUERY_SNIPPET_CHARS, hydrate_texts, open_chunk_store, snippet
+from services.health import HealthMonitor, query_service_checks
+from services.lexical_index import open_lexical_index, query_kind, rrf_fuse
+from services.metrics import QUERIES_TOTAL, QUERY_SECONDS, QUERY_STAGE_SECONDS, StageTimer, metrics_response
+from services.query_batcher import QueryBatcher
+from services.query_cache import QueryCache
+from services.warmup import QUERY_WARMUP, Warmup
 from vectorstore import pinecone as vs_pinecone
+from vectorstore import store as vs_store
+from vectorstore.base import QueryScopeError, build_filter, normalize_matches
 
 logger = logging.getLogger(__name__)
 
@@ -14,12 +27,32 @@ app = FastAPI(title="GitSense Query Service")
 # Globals populated on startup
 PC_CLIENT = None
 INDEX = None
+CHUNK_STORE = None
+LEXICAL = None
+HEALTH = None
+# Concurrent /query requests share batched forward passes of the embedding model.
+QUERY_BATCHER = QueryBatcher(lambda texts: embedding_service.embed_queries(texts))
+# Exact and near-duplicate query caches, invalidated when an ingest run changes the index.
+QUERY_CACHE = QueryCache(lambda: vs_store.index_generation(vs_pinecone.INDEX_NAME, INDEX))
+# Most queries accepted by one /query/batch request.
+QUERY_BATCH_LIMIT = int(os.getenv("QUERY_BATCH_LIMIT", "256"))
+# Startup stages and readiness of this process (see /readyz).
+WARMUP = Warmup("query")
 
 
 class QueryRequest(BaseModel):
     query: str
-    top_k: Optional[int] = 10
+    # null is rejected rather than defaulted: the lexical, fusion and rerank depths are multiples of it.
+    top_k: int = Field(10, ge=1)
     include_metadata: Optional[bool] = True
+    # Return per-stage timings (milliseconds) alongside query_time_ms.
+    include_timings: Optional[bool] = False
+    # Truncate each result's text to this many characters (QUERY_SNIPPET_CHARS by default, 0 = full chunk).
+    snippet_chars: Optional[int] = None
+    # Restrict the search to these repo ids (namespaces), file types ("code", "doc", "readme") and/or a path prefix.
+    repo: Optional[Union[str, List[str]]] = None
+    file_type: Optional[Union[str, List[str]]] = None
+    path_prefix: Optional[str] = None
 
 
 class QueryResult(BaseModel):
@@ -32,88 +65,347 @@ class QueryResult(BaseModel):
 class QueryResponse(BaseModel):
     results: List[QueryResult]
     query_time_ms: Optional[int] = None
+    timings_ms: Optional[Dict[str, float]] = None
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+
+
+class BatchQueryItem(BaseModel):
+    # Exactly one of results / error is set.
+    results: Optional[List[QueryResult]] = None
+    error: Optional[str] = None
+
+
+class BatchQueryResponse(BaseModel):
+    responses: List[BatchQueryItem]
+    query_time_ms: Optional[int] = None
+    timings_ms: Optional[Dict[str, float]] = None
 
 
 @app.on_event("startup")
 def startup_event():
-    global PC_CLIENT, INDEX
-    PC_CLIENT = vs_pinecone.init_pinecone()
-    # Ensure index exists (no-op if already present)
+    global PC_CLIENT, INDEX, CHUNK_STORE, LEXICAL, HEALTH
+    PC_CLIENT = vs_store.init_client()
+    if PC_CLIENT is not None:
+        # Ensure index exists (no-op if already present)
+        try:
+            vs_pinecone.ensure_index(PC_CLIENT)
+        except Exception as exc:
+            logger.warning("Could not ensure index on startup: %s", exc)
+    INDEX = vs_store.open_store(PC_CLIENT, vs_pinecone.INDEX_NAME)
+    CHUNK_STORE = open_chunk_store(vs_pinecone.INDEX_NAME)
+    LEXICAL = open_lexical_index(vs_pinecone.INDEX_NAME)
+    logger.info("Query service started with %s index '%s'", vs_store.VECTOR_BACKEND, vs_pinecone.INDEX_NAME)
+    steps = {}
+    if QUERY_WARMUP:
+        steps = {"model": embedding_service.load_model, "embed": embedding_service.warm_up, "index": INDEX.describe_index_stats}
+    WARMUP.run(steps)
+    HEALTH = HealthMonitor(query_service_checks(INDEX))
+    HEALTH.start()
+    # Generation checks can reach the vector store, so they stay off the request path.
+    QUERY_CACHE.watch()
+
+
+def preload() -> None:
+    """Load the models into this process; api.serve calls it once before forking workers."""
+    embedding_service.load_model()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await QUERY_BATCHER.close()
+    QUERY_CACHE.stop()
+    if HEALTH is not None:
+        HEALTH.stop()
+
+
+def _respond(req: QueryRequest, results: List[QueryResult], timer: StageTimer, outcome: str) -> QueryResponse:
+    QUERY_SECONDS.labels(service="query").observe(timer.elapsed())
+    WARMUP.observe_query(timer.elapsed())
+    QUERIES_TOTAL.labels(service="query", outcome=outcome).inc()
+    return QueryResponse(
+        results=results,
+        query_time_ms=timer.elapsed_ms(),
+        timings_ms=timer.breakdown_ms() if req.include_timings else None,
+    )
+
+
+def _lexical_search(query: str, depth: int, repo, search_filter, kind: str) -> Optional[List[Dict[str, Any]]]:
+    """BM25 matches, or None if the lexical index failed; callers then answer from the vector index alone."""
     try:
-        vs_pinecone.ensure_index(PC_CLIENT)
+        return LEXICAL.search(query, depth, namespace=repo, filter=search_filter, exact=kind == "identifier")
     except Exception as exc:
-        logger.warning("Could not ensure index on startup: %s", exc)
-    INDEX = PC_CLIENT.Index(vs_pinecone.INDEX_NAME)
-    logger.info("Query service started and connected to Pinecone index '%s'", vs_pinecone.INDEX_NAME)
+        logger.warning("Lexical search failed, using vector results only: %s", exc)
+        return None
+
+
+def _to_results(matches: List[Dict[str, Any]]) -> List[QueryResult]:
+    return [
+        QueryResult(
+            id=m.get("id", ""),
+            score=m.get("score") or 0.0,
+            metadata=m.get("metadata") or {},
+            # match may carry an optional text field
+            text=m.get("text"),
+        )
+        for m in matches
+    ]
 
 
 @app.post("/query", response_model=QueryResponse)
-def query_endpoint(req: QueryRequest):
-    """Embed the incoming query and run a nearest-neighbors search."""
+async def query_endpoint(req: QueryRequest):
+    """Embed the incoming query and run a nearest-neighbors search.
+
+    Queries made only of code identifiers are answered from the BM25 lexical
+    index without embedding (falling back to vector search when it finds
+    nothing); queries mixing identifiers and prose fuse both rankings with
+    reciprocal rank fusion.
+    """
     if not req.query:
         raise HTTPException(status_code=400, detail="query is required")
 
-    # 1) Embed the query text
-    try:
-        emb = embedding_service.embed_query(req.query)
-    except Exception as exc:
-        logger.exception("Embedding failed: %s", exc)
-        raise HTTPException(status_code=500, detail="embedding failed")
+    timer = StageTimer(QUERY_STAGE_SECONDS, service="query")
+    snippet_chars = QUERY_SNIPPET_CHARS if req.snippet_chars is None else req.snippet_chars
+    search_filter = build_filter(req.file_type, req.path_prefix)
+    params = (req.top_k, req.include_metadata, snippet_chars, json.dumps([req.repo, search_filter], sort_keys=True))
+    with timer.span("cache"):
+        cached = QUERY_CACHE.get_results(req.query, params)
+    if cached is not None:
+        return _respond(req, cached, timer, "cache_hit")
+
+    kind = query_kind(req.query) if LEXICAL is not None else "natural"
+    lexical = []
+    lexical_failed = False
+    if kind != "natural":
+        # Fused rankings get a deeper lexical list than the final top_k.
+        depth = req.top_k if kind == "identifier" else 2 * req.top_k
+        with timer.span("lexical"):
+            found = await run_in_threadpool(_lexical_search, req.query, depth, req.repo, search_filter, kind)
+        lexical_failed, lexical = found is None, found or []
+        if kind == "identifier" and lexical:
+            results = _to_results(lexical)
+            with timer.span("hydrate"):
+                hydrate_texts(CHUNK_STORE, results, snippet_chars)
+            QUERY_CACHE.put_results(req.query, params, None, results)
+            return _respond(req, results, timer, "lexical")
+
+    # 1) Embed the query text (batched with other in-flight queries)
+    with timer.span("cache"):
+        emb = QUERY_CACHE.get_embedding(req.query)
+    if emb is None:
+        try:
+            with timer.span("embed"):
+                emb = await QUERY_BATCHER.embed(req.query)
+        except Exception as exc:
+            logger.exception("Embedding failed: %s", exc)
+            QUERIES_TOTAL.labels(service="query", outcome="error").inc()
+            raise HTTPException(status_code=500, detail="embedding failed")
+        QUERY_CACHE.put_embedding(req.query, emb)
 
-    # 2) Query the Pinecone index
+    # Near-duplicate embeddings of different identifiers are different queries.
+    if kind == "natural":
+        with timer.span("cache"):
+            similar = QUERY_CACHE.get_similar_results(emb, params)
+        if similar is not None:
+            return _respond(req, similar, timer, "semantic_hit")
+
+    # 2) Query the vector index
     try:
-        resp = INDEX.query(vector=emb, top_k=req.top_k, include_metadata=req.include_metadata)
+        with timer.span("search"):
+            resp = await run_in_threadpool(INDEX.query, vector=emb, top_k=2 * req.top_k if lexical else req.top_k, include_metadata=req.include_metadata, namespace=req.repo, filter=search_filter)
+    except QueryScopeError as exc:
+        QUERIES_TOTAL.labels(service="query", outcome="error").inc()
+        raise HTTPException(status_code=400, detail=str(exc))
     except Exception as exc:
-        logger.exception("Pinecone query failed: %s", exc)
+        logger.exception("Vector query failed: %s", exc)
+        QUERIES_TOTAL.labels(service="query", outcome="error").inc()
         raise HTTPException(status_code=500, detail="vector query failed")
 
-    # 3) Normalize response
-    results = []
-    # Pinecone SDK response shapes differ; support common fields
-    matches = []
-    if isinstance(resp, dict):
-        matches = resp.get("matches", [])
-    else:
-        # object-like response (SDK Index.query returns object with .matches)
-        matches = getattr(resp, "matches", []) or []
-
-    for m in matches:
-        # match may have id, score, metadata, and optional text field
-        results.append(
-            QueryResult(
-                id=m.get("id") or getattr(m, "id", ""),
-                score=m.get("score") or getattr(m, "score", 0.0),
-                metadata=m.get("metadata") or getattr(m, "metadata", {}) or {},
-                text=m.get("text") or getattr(m, "text", None),
-            )
-        )
+    # 3) Normalize response (Pinecone SDK response shapes differ), fusing in lexical matches
+    with timer.span("normalize"):
+        matches = normalize_matches(resp)
+    if lexical:
+        with timer.span("fuse"):
+            matches = rrf_fuse([matches, lexical], req.top_k)
+    results = _to_results(matches)
 
-    return QueryResponse(results=results)
+    # 4) Fetch the texts of the final results from the chunk store in one lookup
+    with timer.span("hydrate"):
+        hydrate_texts(CHUNK_STORE, results, snippet_chars)
 
+    # Vector-only fallbacks are not cached, so a repeat gets the fused ranking once the lexical index recovers.
+    if not lexical_failed:
+        QUERY_CACHE.put_results(req.query, params, emb if kind == "natural" else None, results)
+    return _respond(req, results, timer, "ok")
 
-@app.get("/health")
-def health():
-    """Simple health check verifying connectivity to embedding provider and Pinecone."""
-    ok = True
-    messages = []
 
-    # Check embedding
-    try:
-        _ = embedding_service.embed_query("health check")
-    except Exception as exc:
-        ok = False
-        messages.append(f"embed_error: {exc}")
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch_endpoint(batch: BatchQueryRequest):
+    """Answer many queries in one request; responses keep the order of ``queries``.
 
-    # Check pinecone
-    try:
-        client = vs_pinecone.init_pinecone()
-        _ = client.list_indexes()
-    except Exception as exc:
-        ok = False
-        messages.append(f"pinecone_error: {exc}")
+    Each query behaves as it would on /query (caches, lexical fast path, rank
+    fusion), but all texts that need an embedding go through one batched
+    forward pass, and queries sharing repo/filter options are searched together
+    with ``query_many``: one matrix product per block of rows on the local
+    store, parallel index calls on Pinecone. A failing query gets an ``error``
+    instead of failing the whole batch.
+    """
+    if len(batch.queries) > QUERY_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"at most {QUERY_BATCH_LIMIT} queries per batch")
+
+    timer = StageTimer(QUERY_STAGE_SECONDS, service="query_batch")
+    items: List[BatchQueryItem] = [BatchQueryItem() for _ in batch.queries]
+    # Per pending query: index, request, cache params, filter, query kind, lexical matches, embedding.
+    pending: List[Dict[str, Any]] = []
+
+    def finish(i: int, outcome: str, results: Optional[List[QueryResult]] = None, error: Optional[str] = None) -> None:
+        items[i].results, items[i].error = results, error
+        QUERIES_TOTAL.labels(service="query_batch", outcome=outcome).inc()
+
+    for i, req in enumerate(batch.queries):
+        if not req.query:
+            finish(i, "error", error="query is required")
+            continue
+        snippet_chars = QUERY_SNIPPET_CHARS if req.snippet_chars is None else req.snippet_chars
+        search_filter = build_filter(req.file_type, req.path_prefix)
+        params = (req.top_k, req.include_metadata, snippet_chars, json.dumps([req.repo, search_filter], sort_keys=True))
+        with timer.span("cache"):
+            cached = QUERY_CACHE.get_results(req.query, params)
+        if cached is not None:
+            finish(i, "cache_hit", cached)
+            continue
+        kind = query_kind(req.query) if LEXICAL is not None else "natural"
+        pending.append({"i": i, "req": req, "params": params, "filter": search_filter, "snippet": snippet_chars, "kind": kind, "lexical": []})
+
+    fresh: List[Dict[str, Any]] = []
+    for item in pending:
+        req = item["req"]
+        if item["kind"] != "natural":
+            depth = req.top_k if item["kind"] == "identifier" else 2 * req.top_k
+            with timer.span("lexical"):
+                found = await run_in_threadpool(_lexical_search, req.query, depth, req.repo, item["filter"], item["kind"])
+            item["lexical"], item["lexical_failed"] = found or [], found is None
+            if item["kind"] == "identifier" and item["lexical"]:
+                item["results"], item["embedding"] = _to_results(item["lexical"]), None
+                fresh.append(item)
+                finish(item["i"], "lexical")
+                continue
+        with timer.span("cache"):
+            item["embedding"] = QUERY_CACHE.get_embedding(req.query)
+    pending = [item for item in pending if "results" not in item]
+
+    # One forward pass for every query that still needs an embedding.
+    to_embed = [item for item in pending if item["embedding"] is None]
+    if to_embed:
+        try:
+            with timer.span("embed"):
+                vectors = await run_in_threadpool(embedding_service.embed_queries, [item["req"].query for item in to_embed])
+        except Exception as exc:
+            logger.exception("Batch embedding failed: %s", exc)
+            for item in to_embed:
+                finish(item["i"], "error", error="embedding failed")
+            vectors = []
+        for item, vector in zip(to_embed, vectors):
+            item["embedding"] = vector
+            QUERY_CACHE.put_embedding(item["req"].query, vector)
+    pending = [item for item in pending if item["embedding"] is not None]
+
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for item in pending:
+        req = item["req"]
+        if item["kind"] == "natural":
+            with timer.span("cache"):
+                similar = QUERY_CACHE.get_similar_results(item["embedding"], item["params"])
+            if similar is not None:
+                finish(item["i"], "semantic_hit", similar)
+                continue
+        groups.setdefault(json.dumps([req.repo, item["filter"], bool(req.include_metadata)], sort_keys=True), []).append(item)
+
+    for group in groups.values():
+        first = group[0]["req"]
+        top_k = max(2 * item["req"].top_k if item["lexical"] else item["req"].top_k for item in group)
+        try:
+            with timer.span("search"):
+                responses = await run_in_threadpool(
+                    INDEX.query_many,
+                    [item["embedding"] for item in group],
+                    top_k=top_k,
+                    include_metadata=first.include_metadata,
+                    namespace=first.repo,
+                    filter=group[0]["filter"],
+                )
+        except QueryScopeError as exc:
+            for item in group:
+                finish(item["i"], "error", error=str(exc))
+            continue
+        except Exception as exc:
+            logger.exception("Batch vector query failed: %s", exc)
+            for item in group:
+                finish(item["i"], "error", error="vector query failed")
+            continue
+        with timer.span("normalize"):
+            for item, resp in zip(group, responses):
+                matches = normalize_matches(resp)
+                if item["lexical"]:
+                    matches = rrf_fuse([matches, item["lexical"]], item["req"].top_k)
+                item["results"] = _to_results(matches[: item["req"].top_k])
+                fresh.append(item)
+                finish(item["i"], "ok")
+
+    # Texts for every fresh result in one chunk-store lookup, then per-query snippets.
+    with timer.span("hydrate"):
+        hydrate_texts(CHUNK_STORE, [r for item in fresh for r in item["results"]], None)
+    for item in fresh:
+        for r in item["results"]:
+            r.text = snippet(r.text, item["snippet"])
+        vector = item["embedding"] if item["kind"] == "natural" else None
+        if not item.get("lexical_failed"):
+            QUERY_CACHE.put_results(item["req"].query, item["params"], vector, item["results"])
+        items[item["i"]].results = item["results"]
 
-    status = "ok" if ok else "fail"
-    return {"status": status, "messages": messages}
+    QUERY_SECONDS.labels(service="query_batch").observe(timer.elapsed())
+    WARMUP.observe_query(timer.elapsed())
+    return BatchQueryResponse(responses=items, query_time_ms=timer.elapsed_ms(), timings_ms=timer.breakdown_ms())
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit rates of the query caches and the on-disk embedding cache."""
+    return {"query": QUERY_CACHE.stats(), "embedding": embedding_service.cache_stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: per-stage query latency histograms and request counters."""
+    return metrics_response()
+
+
+@app.get("/livez")
+def livez():
+    """200 while the process is serving and its background health checks keep running."""
+    alive = HEALTH is not None and HEALTH.alive()
+    return JSONResponse({"status": "ok" if alive else "fail"}, status_code=200 if alive else 503)
+
+
+@app.get("/readyz")
+def readyz():
+    """200 once warm-up has finished and the last background checks of model and vector store passed.
+
+    Served from cached results, so probing never runs the model or calls the vector store.
+    """
+    health = HEALTH.status() if HEALTH is not None else {"ok": False, "checks": {}}
+    ready = WARMUP.ready and health["ok"]
+    return JSONResponse({**WARMUP.status(), "ready": ready, "checks": health["checks"]}, status_code=200 if ready else 503)
+
+
+@app.get("/health")
+def health():
+    """Cached status of the embedding model and the vector store (see /readyz)."""
+    checks = HEALTH.status()["checks"] if HEALTH is not None else {}
+    messages = [f"{name}_error: {c['error']}" for name, c in checks.items() if not c["ok"]]
+    return {"status": "fail" if messages or not checks else "ok", "messages": messages}
 
 
 if __name__ == "__main__":
@@ -1,19 +1,30 @@
-import os
-from typing import List, Dict, Any, Optional
+import json
+from typing import List, Dict, Any, Literal, Optional, Union
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 import logging
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import uvicorn
-from langchain_community.document_loaders import GithubFileLoader
-import cohere
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 
 
-from services.embedding_service import embed_query
+from services import embedding_service
+from services.chunk_store import QUERY_SNIPPET_CHARS, hydrate_texts, open_chunk_store, snippet
+from services.health import HealthMonitor, query_service_checks
+from services.lexical_index import open_lexical_index, query_kind, rrf_fuse
+from services.metrics import QUERIES_TOTAL, QUERY_SECONDS, QUERY_STAGE_SECONDS, StageTimer, metrics_response
+from services.query_batcher import QueryBatcher
+from services.query_cache import QueryCache
+from services import reranker
+from services.reranker import RERANK_MODEL, Reranker, candidate_count
+from services.snapshot_store import open_snapshot_store
+from services.warmup import QUERY_WARMUP, Warmup
 from vectorstore import pinecone as pc
+from vectorstore import store as vs_store
+from vectorstore.base import QueryScopeError, build_filter, normalize_matches
 
 logger = logging.getLogger(__name__)
-co = cohere.ClientV2(api_key=os.getenv("COHERE_TOKEN"))
 
 app = FastAPI(title='GitSense Semantic Search Service')
 app.add_middleware(
@@ -26,11 +37,35 @@ app.add_middleware(
 
 PC_CLIENT = None
 INDEX = None
+CHUNK_STORE = None
+LEXICAL = None
+SNAPSHOTS = None
+HEALTH = None
+# Concurrent /query requests share batched forward passes of the embedding model.
+QUERY_BATCHER = QueryBatcher(lambda texts: embedding_service.embed_queries(texts))
+# Exact and near-duplicate query caches, invalidated when an ingest run changes the index.
+QUERY_CACHE = QueryCache(lambda: vs_store.index_generation(pc.INDEX_NAME, INDEX))
+# Cross-encoder rescoring of oversampled candidates; the model loads on first use.
+RERANKER = Reranker() if RERANK_MODEL else None
+# Startup stages and readiness of this process (see /readyz).
+WARMUP = Warmup("scnd")
 
 class QueryRequest(BaseModel):
     query: str
-    top_k: Optional[int] = 5
+    # null is rejected rather than defaulted: the lexical, fusion and rerank depths are multiples of it.
+    top_k: int = Field(5, ge=1)
     include_metadata: Optional[bool] = True
+    include_timings: Optional[bool] = False
+    # Truncate each result's text to this many characters (QUERY_SNIPPET_CHARS by default, 0 = full chunk).
+    snippet_chars: Optional[int] = None
+    # Restrict the search to these repo ids (namespaces), file types ("code", "doc", "readme") and/or a path prefix.
+    repo: Optional[Union[str, List[str]]] = None
+    file_type: Optional[Union[str, List[str]]] = None
+    path_prefix: Optional[str] = None
+    # Attach the top result's source from the local snapshot: "range" (its chunk span) or "file".
+    include_file: Optional[Literal["range", "file"]] = None
+    # Rescore oversampled candidates with the local cross-encoder (within RERANK_BUDGET_MS).
+    rerank: Optional[bool] = True
 
 class IndexStats(BaseModel):
     vectorCount: int
@@ -47,18 +82,49 @@ class QueryResult(BaseModel):
 class QueryResponse(BaseModel):
     results: List[QueryResult]
     query_time_ms: Optional[int] = None
-    # file_content: Optional[str] = None
+    timings_ms: Optional[Dict[str, float]] = None
+    file_content: Optional[str] = None
 
 @app.on_event("startup")
 def startup_event():
-    global PC_CLIENT, INDEX
-    PC_CLIENT = pc.init_pinecone()
-    try:
-        pc.ensure_index(PC_CLIENT)
-    except Exception as exception:
-        logger.warning("Could not ensure index on startup: %s", exception)
-    INDEX = PC_CLIENT.Index(pc.INDEX_NAME)
-    logger.info("Query service started and connected to Pinecone index: %s", pc.INDEX_NAME)
+    global PC_CLIENT, INDEX, CHUNK_STORE, LEXICAL, SNAPSHOTS, HEALTH
+    PC_CLIENT = vs_store.init_client()
+    if PC_CLIENT is not None:
+        try:
+            pc.ensure_index(PC_CLIENT)
+        except Exception as exception:
+            logger.warning("Could not ensure index on startup: %s", exception)
+    INDEX = vs_store.open_store(PC_CLIENT, pc.INDEX_NAME)
+    CHUNK_STORE = open_chunk_store(pc.INDEX_NAME)
+    LEXICAL = open_lexical_index(pc.INDEX_NAME)
+    SNAPSHOTS = open_snapshot_store()
+    logger.info("Query service started with %s index: %s", vs_store.VECTOR_BACKEND, pc.INDEX_NAME)
+    steps = {}
+    if QUERY_WARMUP:
+        steps = {"model": embedding_service.load_model, "embed": embedding_service.warm_up, "index": INDEX.describe_index_stats}
+        if RERANKER is not None:
+            # Generous budget: this call also loads the cross-encoder if preload() did not.
+            steps["rerank"] = lambda: RERANKER.scores("warm up", [("warmup", "def warm_up(): pass")], budget_ms=600_000)
+    WARMUP.run(steps)
+    HEALTH = HealthMonitor(query_service_checks(INDEX))
+    HEALTH.start()
+    # Generation checks can reach the vector store, so they stay off the request path.
+    QUERY_CACHE.watch()
+
+def preload() -> None:
+    """Load the models into this process; api.serve calls it once before forking workers."""
+    embedding_service.load_model()
+    if RERANKER is not None:
+        reranker.load_model()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await QUERY_BATCHER.close()
+    if RERANKER is not None:
+        RERANKER.close()
+    QUERY_CACHE.stop()
+    if HEALTH is not None:
+        HEALTH.stop()
 
 @app.post("/stats", response_model=IndexStats)
 def get_index_stats():
@@ -75,76 +141,195 @@ def get_index_stats():
         raise HTTPException(status_code=500, detail="Failed to get index stats.")
 
 
-@app.post("/query", response_model=QueryResponse)
-def query_endpoint(req: QueryRequest):
-    if not req.query:
-        raise HTTPException(status_code = 400, detail="Please provide a query string.")
-    print(req.query)
-    try:
-        query_embedding = embed_query(req.query)
-    except Exception as exception:
-        logger.exception("Embedding failed: %s", exception)
-        raise HTTPException(status_code = 500, detail = "embedding failed")
-    
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "query": QUERY_CACHE.stats(),
+        "embedding": embedding_service.cache_stats(),
+        "rerank": RERANKER.stats() if RERANKER is not None else {},
+    }
+
+
+@app.get("/livez")
+def livez():
+    """200 while the process is serving and its background health checks keep running."""
+    alive = HEALTH is not None and HEALTH.alive()
+    return JSONResponse({"status": "ok" if alive else "fail"}, status_code=200 if alive else 503)
+
+
+@app.get("/readyz")
+def readyz():
+    """200 once warm-up has finished and the last background checks of model and vector store passed."""
+    health = HEALTH.status() if HEALTH is not None else {"ok": False, "checks": {}}
+    ready = WARMUP.ready and health["ok"]
+    return JSONResponse({**WARMUP.status(), "ready": ready, "checks": health["checks"]}, status_code=200 if ready else 503)
+
+
+@app.get("/metrics")
+def metrics():
+    return metrics_response()
+
+
+@app.get("/file/{sha}")
+def get_file(sha: str, start: Optional[int] = None, end: Optional[int] = None):
+    """Serve an ingested file (or the ``[start, end)`` character range of it) from the local snapshot."""
+    content = SNAPSHOTS.read(sha, start, end) if SNAPSHOTS is not None else None
+    if content is None:
+        raise HTTPException(status_code=404, detail="File not in the local snapshot.")
+    return {"sha": sha, "content": content}
+
+
+def _file_content(req: QueryRequest, results: List[QueryResult], timer: StageTimer) -> Optional[str]:
+    """Read the top result's file, or just its chunk's range, from the local snapshot."""
+    if not req.include_file or not results or SNAPSHOTS is None:
+        return None
+    meta = results[0].metadata or {}
+    sha = meta.get("sha")
+    if not sha:
+        logger.info("Top query result has no sha metadata; skipping file content.")
+        return None
+    start, end = (meta.get("start_index"), meta.get("end_index")) if req.include_file == "range" else (None, None)
+    with timer.span("snapshot"):
+        content = SNAPSHOTS.read(sha, start, end)
+    if content is None:
+        logger.warning("No local snapshot for %s (sha %s); re-ingest the repo to create it", meta.get("path"), sha)
+    return content
+
+
+def _respond(req: QueryRequest, results: List[QueryResult], timer: StageTimer, outcome: str) -> QueryResponse:
+    file_content = _file_content(req, results, timer)
+    QUERY_SECONDS.labels(service="scnd").observe(timer.elapsed())
+    WARMUP.observe_query(timer.elapsed())
+    QUERIES_TOTAL.labels(service="scnd", outcome=outcome).inc()
+    return QueryResponse(
+        results=results,
+        query_time_ms=timer.elapsed_ms(),
+        timings_ms=timer.breakdown_ms() if req.include_timings else None,
+        file_content=file_content,
+    )
+
+
+def _lexical_search(query: str, depth: int, repo, search_filter, kind: str) -> Optional[List[Dict[str, Any]]]:
+    """BM25 matches, or None if the lexical index failed; callers then answer from the vector index alone."""
     try:
-        response = INDEX.query(vector=query_embedding, top_k=req.top_k, include_metadata= req.include_metadata)
-    except Exception as exception:
-        logger.exception("Pinecone query failed: %s", exception)
-        raise HTTPException(status_code= 500, detail="Pinecone vector query failed.")
-    
-    query_results = []
-    document_matches = []
+        return LEXICAL.search(query, depth, namespace=repo, filter=search_filter, exact=kind == "identifier")
+    except Exception as exc:
+        logger.warning("Lexical search failed, using vector results only: %s", exc)
+        return None
 
-    if isinstance(response, dict):
-        document_matches = response.get("matches", [])
-    else:
-        document_matches = getattr(response, "matches", [])
-    
 
-    for match in document_matches:
-        importance = match.get("metadata").get("importance", 1.0)
-        match.score *= importance
+def _to_results(matches: List[Dict[str, Any]]) -> List[QueryResult]:
+    """Importance-weighted results, best first."""
+    query_results = []
+    for match in matches:
+        metadata = match.get("metadata") or {}
+        importance = metadata.get("importance", 1.0)
         query_results.append(
             QueryResult(
-                id=match.get("id") or getattr(match, "id", ""),
-                score = match.get("score") or getattr(match, "score", 0.0),
-                metadata = match.get("metadata") or getattr(match, "metadata", {}) or {},
-                text = match.get("page_content") or getattr(match, "page_content", None),
+                id=match.get("id", ""),
+                score = (match.get("score") or 0.0) * importance,
+                metadata = metadata,
+                text = None,
             )
         )
-    # sorted_results = sorted(query_results, key=lambda x: x.score, reverse=True)
+    query_results.sort(key=lambda r: r.score, reverse=True)
+    return query_results
+
+
+async def _rerank(req: QueryRequest, results: List[QueryResult], timer: StageTimer) -> bool:
+    """Reorder ``results`` by cross-encoder score; False (order untouched) if the budget ran out."""
+    with timer.span("rerank"):
+        scores = await run_in_threadpool(RERANKER.scores, req.query, [(r.id, r.text or "") for r in results])
+    if scores is None:
+        return False
+    for result, score in zip(results, scores):
+        result.score = score
+    results.sort(key=lambda r: r.score, reverse=True)
+    return True
+
 
-    # If there are no results just return early
-    if not query_results:
-        return QueryResponse(results=query_results)
+@app.post("/query", response_model=QueryResponse)
+async def query_endpoint(req: QueryRequest):
+    if not req.query:
+        raise HTTPException(status_code = 400, detail="Please provide a query string.")
+    print(req.query)
+    timer = StageTimer(QUERY_STAGE_SECONDS, service="scnd")
+    snippet_chars = QUERY_SNIPPET_CHARS if req.snippet_chars is None else req.snippet_chars
+    search_filter = build_filter(req.file_type, req.path_prefix)
+    reranking = bool(req.rerank) and RERANKER is not None
+    params = (req.top_k, req.include_metadata, snippet_chars, json.dumps([req.repo, search_filter], sort_keys=True), reranking)
+    with timer.span("cache"):
+        cached = QUERY_CACHE.get_results(req.query, params)
+    if cached is not None:
+        return _respond(req, cached, timer, "cache_hit")
 
-    # Try to load the actual file from GitHub only if repo_id and path are present
-    file_content = None
-    first_meta = query_results[0].metadata or {}
-    repo_id = first_meta.get("repo_id")
-    path = first_meta.get("path")
+    # Identifier-only queries are answered from the lexical index without embedding;
+    # identifiers mixed with prose fuse lexical and vector rankings.
+    kind = query_kind(req.query) if LEXICAL is not None else "natural"
+    lexical = []
+    lexical_failed = False
+    if kind != "natural":
+        depth = req.top_k if kind == "identifier" else 2 * req.top_k
+        with timer.span("lexical"):
+            found = await run_in_threadpool(_lexical_search, req.query, depth, req.repo, search_filter, kind)
+        lexical_failed, lexical = found is None, found or []
+        if kind == "identifier" and lexical:
+            query_results = _to_results(lexical)
+            with timer.span("hydrate"):
+                hydrate_texts(CHUNK_STORE, query_results, snippet_chars)
+            QUERY_CACHE.put_results(req.query, params, None, query_results)
+            return _respond(req, query_results, timer, "lexical")
 
-    if repo_id and path:
+    with timer.span("cache"):
+        query_embedding = QUERY_CACHE.get_embedding(req.query)
+    if query_embedding is None:
         try:
-            loader = GithubFileLoader(
-                repo=repo_id,
-                access_token=os.getenv("GITHUB_TOKEN"),
-                file_filter=lambda fp: fp == path,
-            )
-            content = loader.get_file_content_by_path(path)
-            if content is None:
-                logger.warning("Github loader returned no content for repo %s path %s", repo_id, path)
-            else:
-                file_content = content
-                logger.info("Successfully loaded file content from GitHub for repo %s path %s", repo_id, path)
-        except Exception as e:
-            logger.warning("Could not load file from GitHub for repo %s path %s: %s", repo_id, path, e)
-    else:
-        logger.info("Top query result missing repo_id or path metadata; skipping GitHub file load.")
-
-    return QueryResponse(results=query_results
-                        #  file_content=file_content
-                         )
+            with timer.span("embed"):
+                query_embedding = await QUERY_BATCHER.embed(req.query)
+        except Exception as exception:
+            logger.exception("Embedding failed: %s", exception)
+            QUERIES_TOTAL.labels(service="scnd", outcome="error").inc()
+            raise HTTPException(status_code = 500, detail = "embedding failed")
+        QUERY_CACHE.put_embedding(req.query, query_embedding)
+
+    if kind == "natural":
+        with timer.span("cache"):
+            similar = QUERY_CACHE.get_similar_results(query_embedding, params)
+        if similar is not None:
+            return _respond(req, similar, timer, "semantic_hit")
+    
+    # Oversample for the reranker (and for rank fusion), then cut back to top_k.
+    candidates = candidate_count(req.top_k) if reranking else req.top_k
+    try:
+        with timer.span("search"):
+            response = await run_in_threadpool(INDEX.query, vector=query_embedding, top_k=max(candidates, 2 * req.top_k if lexical else 0), include_metadata= req.include_metadata, namespace=req.repo, filter=search_filter)
+    except QueryScopeError as exception:
+        QUERIES_TOTAL.labels(service="scnd", outcome="error").inc()
+        raise HTTPException(status_code=400, detail=str(exception))
+    except Exception as exception:
+        logger.exception("Vector query failed: %s", exception)
+        QUERIES_TOTAL.labels(service="scnd", outcome="error").inc()
+        raise HTTPException(status_code= 500, detail="Vector query failed.")
+    
+    with timer.span("normalize"):
+        document_matches = normalize_matches(response)
+    if lexical:
+        with timer.span("fuse"):
+            document_matches = rrf_fuse([document_matches, lexical], candidates)
+    query_results = _to_results(document_matches)
+    with timer.span("hydrate"):
+        # Full texts for the cross-encoder; snippets are cut after the final top_k is known.
+        hydrate_texts(CHUNK_STORE, query_results, None if reranking else snippet_chars)
+    reranked = reranking and (len(query_results) < 2 or await _rerank(req, query_results, timer))
+    query_results = query_results[: req.top_k]
+    if reranking:
+        for result in query_results:
+            result.text = snippet(result.text, snippet_chars)
+    # Results that fell back to vector order (or lost the lexical ranking) are not cached, so a repeat can do better.
+    if (reranked or not reranking) and not lexical_failed:
+        QUERY_CACHE.put_results(req.query, params, query_embedding if kind == "natural" else None, query_results)
+
+    return _respond(req, query_results, timer, "ok")
 
 if __name__ == "__main__":
     uvicorn.run("api.query_service_scnd:app", host="0.0.0.0",port = 8000, reload=True)
@@ -1,20 +1,26 @@
 import os
-from pathlib import Path
+import logging
+import threading
+from concurrent.futures import Executor
+from contextlib import nullcontext
 from langchain_community.document_loaders import GithubFileLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import Dict
+from typing import Any, Callable, Dict, List, Optional
 
-from vectorstore.pinecone import index_chunked_documents
+from services.chunk_store import open_chunk_store
+from services.dedup import DEDUP_ENABLED, Deduplicator, duplicate_metadata
+from services.embedding_service import embed, make_chunk_id, to_records
+from services.lexical_index import open_lexical_index
+from services.local_loader import LocalRepoLoader
+from services.manifest import IngestCheckpoint, RepoManifest
+from services.metrics import INGEST_CHUNKS_TOTAL, INGEST_FILES_TOTAL, INGEST_STAGE_SECONDS, StageTimer
+from services.pipeline import run_pipeline
+from services.snapshot_store import open_snapshot_store
+from vectorstore.base import VectorStore, path_dirs
+from vectorstore.store import bump_generation, shared_store, text_in_metadata
 
-file_type_map = {
-    ".cbl": "cobol",
-    ".cpy": "copybook",
-    ".jcl": "jcl",
-    ".bms": "basic_mapping_support",
-    ".dcl": "declaration",
-    ".txt": "text",
-    ".md": "markdown",
-}
+logger = logging.getLogger(__name__)
 
 EXTENSIONS = [
     ".cbl",
@@ -30,88 +36,288 @@ SKIP_KEYWORDS = [
     "contributing",
     "license",
 ]
+# Embedded batches uploaded concurrently per repository; ids are deterministic, so retried or
+# reordered upserts converge on the same index contents.
+INGEST_UPSERT_WORKERS = int(os.getenv("INGEST_UPSERT_WORKERS", "4"))
 
 def should_skip(path: str) -> bool:
     p = path.lower()
     return any(k in p for k in SKIP_KEYWORDS)
 
-def load_documents(path, extensions):
-    files = []
-    for path in Path(path).rglob("*"):
-        if path.suffix in extensions and path.is_file():
-            files.append(path)
 
-    return files
-    
-def read_file(path: Path):
-    try:
-        return path.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        return None
-    
-def process_file(files: list[Path]):
-    raw_documents = []
-    for file in files:
-        if file.suffix in file_type_map:
-            file_type = file_type_map[file.suffix]
-        else:
-            continue
-        content = read_file(file)
-        if not content:
-            continue
-        raw_documents.append({
-            "text": content,
-            "metadata": {
-                "source": str(file),
-                "file_name": file.name,
-                "file_type": file_type,
-                "artifact_type": "code" if file_type in ["cobol", "copybook", "jcl", "basic_mapping_support", "declaration"] else "text",
-                }
-            }
-        )
-    return raw_documents
+def repo_name(repo_config: Dict) -> str:
+    """The repo id a config ingests under: "repo", else the base name of "path"."""
+    return repo_config.get("repo") or os.path.basename(os.path.normpath(repo_config["path"]))
 
-def load_and_chunk(repo_config: Dict, client, index_name) -> None:
-    """Load documents from a GitHub repo, chunk, and index into Pinecone.
 
-    Repo config must have "repo" (GitHub owner/repo). Optional "extensions" overrides
-    the default file type filter; e.g. [".ts", ".tsx", ".md"] for a TypeScript project.
-    """
-    repo = repo_config.get("repo")
+def make_loader(repo_config: Dict):
+    """Build the file loader for a repo config: a local checkout/tarball if it has "path", else GitHub."""
     extensions = repo_config.get("extensions", EXTENSIONS)
-    loader = GithubFileLoader(
-        repo=repo,
+
+    def file_filter(file_path: str) -> bool:
+        return any(file_path.endswith(ext) for ext in extensions) and not should_skip(file_path)
+
+    if repo_config.get("path"):
+        return LocalRepoLoader(repo_config["path"], file_filter=file_filter)
+    return GithubFileLoader(
+        repo=repo_config.get("repo"),
         access_token=os.getenv("GITHUB_TOKEN"),
-        file_filter=lambda file_path: any(file_path.endswith(ext) for ext in extensions) and not should_skip(file_path),
+        file_filter=file_filter,
+    )
+
+def _annotate_chunk(d: Document, repo: str) -> None:
+    d.metadata["repo_id"] = repo
+    # Every ancestor directory, so queries can filter on a path prefix.
+    d.metadata["dirs"] = path_dirs(d.metadata.get("path", ""))
+    path = d.metadata.get("path", "").lower()
+    d.metadata["end_index"] = d.metadata.get("start_index",0) + len(d.page_content)
+
+    if path.endswith("readme.md"):
+        d.metadata["file_type"] = "readme"
+        d.metadata["importance"] = 1.2
+    elif path.endswith(".md"):
+        d.metadata["file_type"] = "doc"
+        d.metadata["importance"] = 1.1
+    else:
+        d.metadata["file_type"] = "code"
+        d.metadata["importance"] = 1.0
+
+
+code_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100, add_start_index=True)
+readme_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200, add_start_index=True)
+
+
+def split_file(repo: str, path: str, sha: str, source: str, content: str) -> List[Dict]:
+    """Chunk one file and annotate its chunks.
+
+    Module-level (and free of closures) so the scheduler can run it in a worker process.
+    """
+    doc = Document(page_content=content, metadata={"path": path, "sha": sha, "source": source})
+    splitter = readme_splitter if path.lower().endswith("readme.md") else code_splitter
+    chunks = []
+    for d in splitter.split_documents([doc]):
+        _annotate_chunk(d, repo)
+        chunks.append({"page_content": d.page_content, "metadata": d.metadata})
+    return chunks
+
+
+def load_and_chunk(
+    repo_config: Dict,
+    client,
+    index_name,
+    executor: Optional[Executor] = None,
+    io_limiter=None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    embed_workers: int = 1,
+) -> Dict[str, Any]:
+    """Load documents from a repo, chunk, and index into the configured vector store.
+
+    Re-ingestion is incremental: the repo's manifest records each file's blob SHA
+    and the chunk ids it produced, so only added or modified files are fetched and
+    embedded, and vectors belonging to modified or deleted files are removed.
+
+    Repo config must have "repo" (GitHub owner/repo). With "path" (a local checkout
+    or a tarball of one) files are read from disk instead of the GitHub API; "repo"
+    then only names the repository and defaults to the path's base name. Optional
+    "extensions" overrides the default file type filter; e.g. [".ts", ".tsx", ".md"]
+    for a TypeScript project. Both sources apply the same skip rules, splitters
+    and importance weights.
+
+    When ``executor`` is given, chunking and embedding run there (the scheduler
+    passes a shared process pool); ``io_limiter`` is a context manager held around
+    every GitHub fetch and vector upsert; ``progress(files_done, files_total)`` is
+    called as files finish; ``embed_workers`` batches are embedded concurrently.
+    Returns the pipeline counters plus ``stage_seconds``, the time spent in each
+    stage (summed over threads, so overlapping stages can exceed ``total``).
+    """
+    repo = repo_name(repo_config)
+    loader = make_loader(repo_config)
+    try:
+        # Concurrent ingests into one index share its store, and with it the upsert concurrency bound.
+        with shared_store(client, index_name) as store:
+            return _ingest(repo, loader, store, index_name, executor, io_limiter, progress, embed_workers)
+    finally:
+        if hasattr(loader, "close"):
+            loader.close()
+
+
+def _ingest(
+    repo: str,
+    loader,
+    store: VectorStore,
+    index_name: str,
+    executor: Optional[Executor],
+    io_limiter,
+    progress: Optional[Callable[[int, int], None]],
+    embed_workers: int,
+) -> Dict[str, Any]:
+    io_limiter = io_limiter or nullcontext()
+    # Local reads do not count against the outbound request limit.
+    fetch_limiter = nullcontext() if isinstance(loader, LocalRepoLoader) else io_limiter
+    timer = StageTimer()
+
+    manifest = RepoManifest.load(repo, index_name)
+    with timer.span("list_files"):
+        tree = {f["path"]: f["sha"] for f in loader.get_file_paths() if f.get("type", "blob") == "blob"}
+    added, modified, deleted = manifest.diff(tree)
+    logger.info(
+        "%s: %d added, %d modified, %d deleted, %d unchanged files",
+        repo, len(added), len(modified), len(deleted), len(tree) - len(added) - len(modified),
+    )
+    # Files an interrupted run already committed show up as unchanged; its checkpoint still
+    # has their old chunk ids, so stale vectors are removed as if the run had never stopped.
+    checkpoint = IngestCheckpoint.load(repo, index_name)
+    if checkpoint is not None:
+        logger.info("%s: resuming interrupted run (%d files, %d batches already upserted)", repo, checkpoint.files, checkpoint.batches)
+    if not (added or modified or deleted) and checkpoint is None:
+        return _finish_stats(repo, {"files": 0, "skipped_files": 0, "chunks": 0, "duplicate_chunks": 0, "batches": 0}, timer)
+
+    # Texts go to the local chunk store; Pinecone vectors keep a copy unless PINECONE_SLIM_METADATA is set.
+    chunk_store = open_chunk_store(index_name)
+    include_text = text_in_metadata(chunk_store)
+    lexical = open_lexical_index(index_name)
+    # Full file contents, so the query service can show files without calling GitHub.
+    snapshots = open_snapshot_store()
+    previous = {path: manifest.chunk_ids(path) for path in modified}
+    # Canonicals that changed or deleted files pointed at; their duplicate lists may shrink.
+    earlier_canonicals = {chunk_id for path in modified + deleted for chunk_id in manifest.dup_of(path)}
+    if checkpoint is None:
+        checkpoint = IngestCheckpoint(repo, index_name)
+    for path, old_ids in checkpoint.previous.items():
+        previous[path] = sorted(set(previous.get(path, [])) | set(old_ids))
+    checkpoint.previous = previous
+    resumed_files = checkpoint.files
+    source_prefix = getattr(loader, "source_prefix", None) or f"{loader.github_api_url}/{repo}/blob/{loader.branch}/"
+
+    todo = added + modified
+    # Vendored, generated and copy-pasted chunks are embedded once; the copies point at that vector.
+    dedup = Deduplicator() if DEDUP_ENABLED else None
+
+    def fetch(path: str) -> str:
+        with fetch_limiter, timer.span("fetch"):
+            content = loader.get_file_content_by_path(path)
+        if content and snapshots is not None:
+            with timer.span("snapshot"):
+                snapshots.put(content, tree[path])
+        return content
+
+    def split(path: str, content: str) -> List[Dict]:
+        args = (repo, path, tree[path], source_prefix + path, content)
+        if executor is None:
+            return split_file(*args)
+        return executor.submit(split_file, *args).result()
+
+    def embed_batch(texts: List[str]) -> List[List[float]]:
+        if executor is None:
+            return embed(texts)
+        return executor.submit(embed, texts).result()
+
+    files_done = 0
+    # Upsert workers finish files concurrently.
+    files_lock = threading.Lock()
+
+    def upsert(chunks: List[Dict], vectors: List[List[float]]) -> None:
+        records = to_records(chunks, vectors, include_text=include_text)
+        if chunk_store is not None:
+            # Written first so a vector is never visible without its text.
+            with timer.span("chunk_store"):
+                chunk_store.put_many((r[0], c.get("page_content", "")) for r, c in zip(records, chunks))
+        if lexical is not None:
+            with timer.span("lexical"):
+                lexical.add(
+                    ((r[0], c.get("page_content", ""), {k: v for k, v in r[2].items() if k != "text"}) for r, c in zip(records, chunks)),
+                    namespace=repo,
+                )
+        with io_limiter, timer.span("upsert"):
+            store.upsert(records, namespace=repo)
+        with files_lock:
+            checkpoint.batch_done()
+
+    def file_done(path: str, chunk_ids: List[str]) -> None:
+        nonlocal files_done
+        dup_of = dedup.references.get(path, ()) if dedup is not None else ()
+        with files_lock:
+            manifest.record(path, tree[path], chunk_ids, dup_of)
+            files_done += 1
+            done = files_done
+            if checkpoint.due():
+                with timer.span("checkpoint"):
+                    checkpoint.commit(manifest, resumed_files + files_done)
+        if progress is not None:
+            progress(done, len(todo))
+
+    # Files stream through fetch -> split -> embed -> upsert; nothing holds the whole repo in memory.
+    try:
+        stats = run_pipeline(
+            todo,
+            fetch=fetch,
+            split=timer.wrap("split", split),
+            embed=timer.wrap("embed", embed_batch),
+            upsert=upsert,
+            chunk_id=make_chunk_id,
+            on_file_done=file_done,
+            dedup=timer.wrap("dedup", dedup.check) if dedup is not None else None,
+            embed_workers=embed_workers,
+            upsert_workers=INGEST_UPSERT_WORKERS,
+        )
+    except BaseException:
+        # Keep every file that did finish, so the next run picks up from here.
+        with files_lock:
+            checkpoint.commit(manifest, resumed_files + files_done)
+        raise
+    logger.info(
+        "%s: indexed %d chunks from %d files, skipped %d duplicate chunks",
+        repo, stats["chunks"], stats["files"], stats["duplicate_chunks"],
     )
-    code_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100, add_start_index=True)
-    readme_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200, add_start_index=True)
-
-    github_documents = loader.load()
-    docs = []
-    if github_documents:
-        for doc in github_documents:
-            if doc.metadata["path"].lower().endswith("readme.md"):
-                docs.extend(readme_splitter.split_documents([doc]))
-            else:
-                docs.extend(code_splitter.split_documents([doc]))
-    if docs:
-        # Convert to expected shape for indexing
-        for d in docs:
-            d.metadata["repo_id"] = repo
-            path = d.metadata.get("path", "").lower()
-            d.metadata["end_index"] = d.metadata.get("start_index",0) + len(d.page_content)
-
-            if path.endswith("readme.md"):
-                d.metadata["file_type"] = "readme"
-                d.metadata["importance"] = 1.2
-            elif path.endswith(".md"):
-                d.metadata["file_type"] = "doc"
-                d.metadata["importance"] = 1.1
-            else:
-                d.metadata["file_type"] = "code"
-                d.metadata["importance"] = 1.0
-        chunked = [
-            {"page_content": d.page_content, "metadata": d.metadata} for d in docs
-        ]
-        index_chunked_documents(client, index_name, chunked)
\ No newline at end of file
+    with timer.span("build_ann"):
+        store.maybe_build_ann()
+
+    # Chunk ids are deterministic, so unchanged offsets were overwritten in place above;
+    # only ids the new version of a file no longer produces are stale.
+    stale = set()
+    for path, old_ids in previous.items():
+        stale.update(set(old_ids) - set(manifest.chunk_ids(path)))
+    for path in deleted:
+        stale.update(manifest.chunk_ids(path))
+        manifest.forget(path)
+    # A stale canonical chunk that other files' duplicates still point at is kept
+    # and handed to one of those files, which is then re-ingested on the next run.
+    for path in list(manifest.files):
+        for chunk_id in manifest.dup_of(path):
+            if chunk_id in stale:
+                manifest.adopt(path, chunk_id)
+                stale.discard(chunk_id)
+    if dedup is not None:
+        # Rebuilt from the manifest, so a canonical keeps the duplicates earlier runs found.
+        canonicals = (set(dedup.duplicates) | earlier_canonicals) - stale
+        for canonical, metadata in duplicate_metadata(manifest.duplicates(canonicals)).items():
+            with io_limiter, timer.span("update_metadata"):
+                store.update_metadata(canonical, metadata, namespace=repo)
+    if stale:
+        with io_limiter, timer.span("delete"):
+            store.delete(sorted(stale), namespace=repo)
+        if chunk_store is not None:
+            chunk_store.delete(sorted(stale))
+        if lexical is not None:
+            lexical.delete(sorted(stale))
+        logger.info("%s: removed %d stale vectors", repo, len(stale))
+    # An interrupted run may have upserted vectors without bumping the generation.
+    if checkpoint.batches or stale:
+        bump_generation(index_name)
+
+    manifest.save()
+    checkpoint.clear()
+    stats["resumed_files"] = resumed_files
+    return _finish_stats(repo, stats, timer)
+
+
+def _finish_stats(repo: str, stats: Dict[str, Any], timer: StageTimer) -> Dict[str, Any]:
+    """Attach per-stage timings to a run's counters and export them as metrics."""
+    timer.add("total", timer.elapsed())
+    stats["stage_seconds"] = timer.breakdown_seconds()
+    for stage, seconds in timer.stages.items():
+        INGEST_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    INGEST_FILES_TOTAL.inc(stats["files"])
+    INGEST_CHUNKS_TOTAL.inc(stats["chunks"])
+    logger.info("%s: stage timings %s", repo, stats["stage_seconds"])
+    return stats
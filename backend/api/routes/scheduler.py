@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import api.routes.ingest as ingest
+
+logger = logging.getLogger(__name__)
+
+# Worker processes shared by every repository for chunking and embedding.
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(os.cpu_count() or 1)))
+# Repositories ingested at the same time.
+INGEST_PARALLEL_REPOS = int(os.getenv("INGEST_PARALLEL_REPOS", "4"))
+# Outbound GitHub fetches plus vector-store writes in flight across all repositories.
+INGEST_IO_CONCURRENCY = int(os.getenv("INGEST_IO_CONCURRENCY", "16"))
+# Minimum seconds between progress log lines for one repository.
+PROGRESS_INTERVAL = 10.0
+
+
+def _init_worker() -> None:
+    # Each worker embeds one batch at a time; letting torch spawn a thread per core
+    # in every process would oversubscribe the machine.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+class _Progress:
+    """Throttled per-repository progress logger."""
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.started = time.monotonic()
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, done: int, total: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if done < total and now - self._last < PROGRESS_INTERVAL:
+                return
+            self._last = now
+        logger.info("%s: %d/%d files indexed (%.0fs)", self.repo, done, total, now - self.started)
+
+
+def _ingest_one(repo_config: Dict, client, index_name: str, pool, limiter, embed_workers: int) -> Dict[str, Any]:
+    started = time.monotonic()
+    # Best-effort label for the result, in case the config is too broken to name a repo.
+    repo = str(repo_config.get("repo") or repo_config.get("path") or "<unnamed>") if isinstance(repo_config, dict) else repr(repo_config)
+    try:
+        repo = ingest.repo_name(repo_config)
+        progress = _Progress(repo)
+        logger.info("Ingesting repo: %s", repo)
+        stats = ingest.load_and_chunk(
+            repo_config,
+            client,
+            index_name,
+            executor=pool,
+            io_limiter=limiter,
+            progress=progress,
+            embed_workers=embed_workers,
+        )
+    except Exception as exc:
+        logger.exception("Ingestion failed for %s", repo)
+        return {"repo": repo, "status": "failed", "error": str(exc), "seconds": time.monotonic() - started}
+    return {"repo": repo, "status": "ok", "seconds": time.monotonic() - started, **stats}
+
+
+def run_ingestion(
+    repo_configs: List[Dict],
+    client,
+    index_name: str,
+    parallel_repos: int = INGEST_PARALLEL_REPOS,
+    processes: int = INGEST_PROCESSES,
+    io_concurrency: int = INGEST_IO_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """Ingest several repositories concurrently.
+
+    Up to ``parallel_repos`` repositories run their streaming pipelines at once.
+    All of them share one process pool (sized to the cores) for chunking and
+    embedding and one semaphore capping outbound fetch/upsert concurrency. A
+    failing repository is logged and reported without stopping the others.
+
+    Returns:
+        One result dict per repository, in input order, with "repo", "status" ("ok" or "failed"),
+        "seconds" and either the pipeline counters with per-stage "stage_seconds" or "error".
+    """
+    limiter = threading.BoundedSemaphore(io_concurrency)
+    # Enough concurrent batches per repository to keep every worker process busy.
+    embed_workers = max(1, -(-processes // max(1, min(parallel_repos, len(repo_configs)))))
+    # "spawn" because the parent already runs threads; forking it could copy held locks.
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+    ) as pool, ThreadPoolExecutor(max_workers=parallel_repos, thread_name_prefix="ingest-repo") as repo_pool:
+        futures = [
+            repo_pool.submit(_ingest_one, cfg, client, index_name, pool, limiter, embed_workers) for cfg in repo_configs
+        ]
+        results = [future.result() for future in futures]
+
+    failed = [r["repo"] for r in results if r["status"] != "ok"]
+    logger.info("Ingested %d/%d repositories", len(results) - len(failed), len(results))
+    if failed:
+        logger.warning("Failed repositories: %s", ", ".join(failed))
+    return results
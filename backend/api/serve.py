@@ -0,0 +1,94 @@
+"""Run a query service with several uvicorn workers that share one loaded model.
+
+``uvicorn --workers N`` starts N fresh interpreters, each importing the service
+and loading its models from scratch. This runner imports the service and calls
+its ``preload()`` once, then forks the workers: model weights are shared
+copy-on-write, and each worker only runs the service's startup warm-up (a
+couple of forward passes, no loading) before it reports ready on ``/readyz``::
+
+    python -m api.serve api.query_service_scnd:app --workers 4 --port 8000
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+from typing import List
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, log_level: str) -> None:
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(target: str, workers: int, host: str, port: int, log_level: str = "info") -> None:
+    module_name, _, attr = target.partition(":")
+    module = importlib.import_module(module_name)
+    app = getattr(module, attr or "app")
+    preload = getattr(module, "preload", None)
+    if preload is not None:
+        # Load only: running the model before fork would start thread pools the children cannot use.
+        preload()
+
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, log_level=log_level)
+        return
+
+    sock = _bind(host, port)
+    children: List[int] = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _run_worker(app, sock, log_level)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    logger.info("Serving %s on %s:%d with %d workers (pids %s)", target, host, port, workers, children)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    status = 0
+    for pid in children:
+        _, code = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(code) not in (0, -signal.SIGTERM, -signal.SIGINT):
+            status = 1
+    sock.close()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve a query service with pre-loaded, forked uvicorn workers.")
+    parser.add_argument("app", nargs="?", default="api.query_service_scnd:app", help="module:attribute of the FastAPI app")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("QUERY_WORKERS", "1")))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.app, args.workers, args.host, args.port, args.log_level)
@@ -0,0 +1,263 @@
+"""Offline ingestion and query benchmarks.
+
+Generates a synthetic repository and times the ingest and query paths
+against the embedded local vector store, with no GitHub or Pinecone access:
+
+* ``file_type_chunk`` over the COBOL, Markdown and text files (chunks/sec)
+* ``embed`` over those chunks (embeds/sec)
+* ``embed_and_upsert`` into a fresh local store (chunks/sec)
+* ``load_and_chunk`` of the checkout through the streaming pipeline (files/sec, chunks/sec)
+* ``/query`` through the FastAPI app (p50/p95/p99 latency)
+
+By default embeddings come from a deterministic hash model so the numbers
+isolate our own overhead; ``--model torch`` or ``--model onnx`` uses the real
+BGE model. Results (including peak RSS) are printed as JSON so runs can be
+compared across commits::
+
+    python -m benchmarks.run --files 500 --queries 200 --output bench.json
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+from unittest import mock
+
+import numpy as np
+
+# Extensions whose files go through the regex chunker in the file_type_chunk stage.
+_CHUNK_TYPES = {".cbl": "cobol", ".md": "markdown", ".txt": "text"}
+
+_WORDS = (
+    "account balance card customer transaction record update validate read write file status "
+    "widget render props state parse config request response handler cache index query vector"
+).split()
+
+
+class HashEmbeddings:
+    """Deterministic stand-in for the embedding model: one seeded random unit vector per text."""
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        v = np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+
+def _sentence(rng: np.random.Generator, n: int) -> str:
+    return " ".join(rng.choice(_WORDS, size=n))
+
+
+def synthetic_repo(files: int, lines_per_file: int = 60, duplicate_ratio: float = 0.1, seed: int = 0) -> Dict[str, str]:
+    """Return ``{path: content}`` for a mixed COBOL/TypeScript/Markdown repository.
+
+    ``duplicate_ratio`` of the files are verbatim copies under ``vendor/``, the
+    way real repositories carry vendored and generated code.
+    """
+    rng = np.random.default_rng(seed)
+    repo: Dict[str, str] = {}
+    originals = max(1, int(files * (1 - duplicate_ratio)))
+    for i in range(originals):
+        kind = i % 4
+        if kind == 0:
+            paras = [f"PARA-{j}.\n" + "\n".join(f"           MOVE {_sentence(rng, 4)}." for _ in range(6)) for j in range(lines_per_file // 7)]
+            repo[f"app/cbl/PROG{i:05d}.cbl"] = "       IDENTIFICATION DIVISION.\n" + "\n".join(paras) + "\n"
+        elif kind == 1:
+            body = "\n".join(f"  const v{j} = '{_sentence(rng, 6)}';" for j in range(lines_per_file))
+            repo[f"src/module{i:05d}.ts"] = f"export function f{i}() {{\n{body}\n}}\n"
+        elif kind == 2:
+            sections = [f"## Section {j}\n\n{_sentence(rng, 40)}\n" for j in range(lines_per_file // 10)]
+            repo[f"docs/page{i:05d}.md"] = f"# Page {i}\n\n" + "\n".join(sections)
+        else:
+            repo[f"notes/note{i:05d}.txt"] = "\n\n".join(_sentence(rng, 30) for _ in range(lines_per_file // 6))
+    for i, path in enumerate(list(repo)[: files - originals]):
+        repo[f"vendor/{i:05d}/{path}"] = repo[path]
+    return repo
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def percentiles(samples_ms: Sequence[float]) -> Dict[str, float]:
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    return {f"p{p}_ms": round(float(np.percentile(arr, p)), 3) for p in (50, 95, 99)}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_benchmarks(
+    files: int = 200,
+    lines_per_file: int = 60,
+    duplicate_ratio: float = 0.1,
+    queries: int = 100,
+    top_k: int = 10,
+    model: str = "fake",
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Run every stage against a fresh synthetic repository in a temporary directory."""
+    import api.routes.ingest as ingest
+    import services.chunk_store as chunk_store
+    import services.embedding_service as emb
+    import services.lexical_index as lexical_index
+    import services.manifest as manifest
+    import services.snapshot_store as snapshot_store
+    import vectorstore.store as vs_store
+    from services.chunking_service import file_type_chunk
+    from vectorstore import pinecone as vs_pinecone
+    from vectorstore.local import LocalVectorStore
+
+    embeddings = HashEmbeddings() if model == "fake" else emb.BGEEmbeddings(backend=model)
+    repo = synthetic_repo(files, lines_per_file, duplicate_ratio, seed)
+    report: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "params": {
+            "files": len(repo),
+            "lines_per_file": lines_per_file,
+            "duplicate_ratio": duplicate_ratio,
+            "queries": queries,
+            "top_k": top_k,
+            "model": model,
+        },
+        "stages": {},
+    }
+    stages = report["stages"]
+
+    with tempfile.TemporaryDirectory(prefix="gitsense-bench-") as tmp, ExitStack() as patches:
+        for target, name, value in [
+            (emb, "_model", lambda: embeddings),
+            (emb, "EMBEDDING_CACHE_PATH", ""),
+            (emb, "_cache", None),
+            (manifest, "INGEST_STATE_DIR", os.path.join(tmp, "manifests")),
+            (chunk_store, "CHUNK_STORE_DIR", os.path.join(tmp, "chunks")),
+            (lexical_index, "LEXICAL_INDEX_DIR", os.path.join(tmp, "lexical")),
+            (snapshot_store, "SNAPSHOT_DIR", os.path.join(tmp, "snapshots")),
+            (vs_store, "VECTOR_BACKEND", "local"),
+            (vs_store, "LOCAL_INDEX_DIR", os.path.join(tmp, "index")),
+            (vs_store, "INDEX_GENERATION_DIR", os.path.join(tmp, "generations")),
+        ]:
+            patches.enter_context(mock.patch.object(target, name, value))
+
+        checkout = Path(tmp, "checkout")
+        for path, content in repo.items():
+            Path(checkout, path).parent.mkdir(parents=True, exist_ok=True)
+            Path(checkout, path).write_text(content, encoding="utf-8")
+
+        documents = [
+            {"text": content, "metadata": {"source": path, "file_type": _CHUNK_TYPES[Path(path).suffix]}}
+            for path, content in repo.items()
+            if Path(path).suffix in _CHUNK_TYPES
+        ]
+        chunks, seconds = _timed(file_type_chunk, documents)
+        stages["file_type_chunk"] = {
+            "documents": len(documents),
+            "chunks": len(chunks),
+            "seconds": round(seconds, 4),
+            "chunks_per_sec": round(len(chunks) / seconds, 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        texts = [c.text for c in chunks]
+        _, seconds = _timed(emb.embed, texts)
+        stages["embed"] = {
+            "texts": len(texts),
+            "seconds": round(seconds, 4),
+            "embeds_per_sec": round(len(texts) / seconds, 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        store = LocalVectorStore(os.path.join(tmp, "upsert-store"), dimension=len(embeddings.embed_query("probe")))
+        docs = [{"page_content": c.text, "metadata": {**c.metadata, "path": c.metadata["source"]}} for c in chunks]
+        _, seconds = _timed(emb.embed_and_upsert, store, docs)
+        store.close()
+        stages["embed_and_upsert"] = {
+            "chunks": len(docs),
+            "seconds": round(seconds, 4),
+            "chunks_per_sec": round(len(docs) / seconds, 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        config = {"repo": "bench/synthetic", "path": str(checkout), "extensions": sorted({Path(p).suffix for p in repo})}
+        stats, seconds = _timed(ingest.load_and_chunk, config, None, vs_pinecone.INDEX_NAME)
+        stages["load_and_chunk"] = {
+            **stats,
+            "seconds": round(seconds, 4),
+            "files_per_sec": round(stats["files"] / seconds, 1),
+            "chunks_per_sec": round(stats["chunks"] / seconds, 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        from fastapi.testclient import TestClient
+
+        from api.query_service import app
+
+        rng = np.random.default_rng(seed + 1)
+        latencies = []
+        with TestClient(app) as client:
+            for i in range(queries):
+                # Distinct texts so the query caches never answer for the index.
+                body = {"query": f"{_sentence(rng, 6)} #{i}", "top_k": top_k}
+                start = time.perf_counter()
+                resp = client.post("/query", json=body)
+                latencies.append((time.perf_counter() - start) * 1000)
+                resp.raise_for_status()
+        stages["query"] = {
+            "queries": queries,
+            "index_size": vs_store.open_store(None, vs_pinecone.INDEX_NAME).describe_index_stats()["total_vector_count"],
+            **percentiles(latencies),
+            "qps": round(queries / (sum(latencies) / 1000), 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and query throughput on a synthetic repository.")
+    parser.add_argument("--files", type=int, default=200, help="Number of files in the synthetic repository")
+    parser.add_argument("--lines", type=int, default=60, help="Approximate lines per file")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="Fraction of files copied under vendor/")
+    parser.add_argument("--queries", type=int, default=100, help="Number of /query requests")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--model", choices=["fake", "torch", "onnx"], default="fake", help="Embedding model to use")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmarks(args.files, args.lines, args.duplicate_ratio, args.queries, args.top_k, args.model, args.seed)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
@@ -6,33 +6,35 @@ from langchain_text_splitters import TextSplitter
 
 
 import api.routes.ingest as ingest
+from api.routes.scheduler import run_ingestion
 import services.chunking_service as chunking_service
 import services.embedding_service as embedding_service
-from vectorstore.pinecone import index_chunked_documents, init_pinecone, ensure_index, INDEX_NAME
+from vectorstore.pinecone import ensure_index, INDEX_NAME
+from vectorstore.store import index_chunked_documents, init_client
 from langchain_community.document_loaders import GithubFileLoader
 from services.search_service import search_relevant_documents
+from prometheus_client import start_http_server
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# When set, ingest stage histograms and counters are served on this port for Prometheus to scrape.
+INGEST_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", "0"))
 
 
 if __name__ == "__main__":
-    pc = init_pinecone()
-    ensure_index(pc)
-    index = pc.Index(INDEX_NAME)
+    if INGEST_METRICS_PORT:
+        start_http_server(INGEST_METRICS_PORT)
 
-    # Local ingest -> chunk -> index
-    # manual_documents = ingest.load_documents(repos[0], EXTENSIONS)
-    # manual_raw_documents = ingest.process_file(manual_documents)
-    # manual_chunked_documents = chunking_service.file_type_chunk(manual_raw_documents)
-    # if manual_chunked_documents:
-    #     index_chunked_documents(pc, INDEX_NAME, manual_chunked_documents)
-    # else:
-    #     logger.info("No manual chunked documents found to index")
+    # None when VECTOR_BACKEND=local; the ingest path then writes to the embedded index
+    pc = init_client()
+    if pc is not None:
+        ensure_index(pc)
 
+    # A "path" entry (local checkout or tarball) is read from disk instead of the GitHub API:
+    # {"repo": "aws-samples/aws-mainframe-modernization-carddemo", "path": "/src/carddemo"}
     repos = [
         # {
         #     "repo": "aws-samples/aws-mainframe-modernization-carddemo",
@@ -52,9 +54,9 @@ if __name__ == "__main__":
         },
     ]
 
-    for repo_config in repos:
-        logger.info("Ingesting repo: %s", repo_config["repo"])
-        ingest.load_and_chunk(repo_config, pc, INDEX_NAME)
+    results = run_ingestion(repos, pc, INDEX_NAME)
+    for result in results:
+        logger.info("%s", result)
     logger.info("Finished indexing run")
 
 
@@ -0,0 +1,100 @@
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Chunk texts live here (one SQLite file per index) so vector metadata can stay slim; see
+# vectorstore.store.PINECONE_SLIM_METADATA for the Pinecone backend. Empty disables it.
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", os.path.join(".gitsense", "chunks"))
+# Default maximum characters of text per query result; 0 returns whole chunks.
+QUERY_SNIPPET_CHARS = int(os.getenv("QUERY_SNIPPET_CHARS", "0"))
+
+# SQLite's default limit on bound parameters per statement.
+_SQL_VARS = 900
+
+_stores: Dict[str, "ChunkStore"] = {}
+_stores_lock = threading.Lock()
+
+
+class ChunkStore:
+    """Side-car store of chunk texts keyed by vector id.
+
+    Ingest writes each chunk's text here (zlib-compressed) next to its vector,
+    so the vector index only carries slim metadata; the query services fetch
+    the texts of their final top-k results in a single lookup.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text BLOB NOT NULL)")
+        self._db.commit()
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        rows = [(id_, zlib.compress(text.encode("utf-8"), 1)) for id_, text in items]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO chunks (id, text) VALUES (?, ?)", rows)
+            self._db.commit()
+
+    def get_many(self, ids: Sequence[str]) -> Dict[str, str]:
+        """Return ``{id: text}`` for the ids that are present."""
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQL_VARS):
+                chunk = list(ids[i : i + _SQL_VARS])
+                placeholders = ",".join("?" * len(chunk))
+                for id_, blob in self._db.execute(f"SELECT id, text FROM chunks WHERE id IN ({placeholders})", chunk):
+                    found[id_] = zlib.decompress(blob).decode("utf-8")
+        return found
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            self._db.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_chunk_store(index_name: str) -> Optional[ChunkStore]:
+    """Return the shared chunk store for ``index_name``, or None if CHUNK_STORE_DIR is empty."""
+    if not CHUNK_STORE_DIR:
+        return None
+    path = os.path.join(CHUNK_STORE_DIR, f"{index_name}.sqlite")
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ChunkStore(path)
+            _stores[path] = store
+            logger.info("Opened chunk store at '%s'", path)
+    return store
+
+
+def snippet(text: Optional[str], max_chars: Optional[int]) -> Optional[str]:
+    """Truncate ``text`` to ``max_chars`` characters (no-op when ``max_chars`` is falsy)."""
+    if text is None or not max_chars or len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
+
+
+def hydrate_texts(store: Optional[ChunkStore], results: List, max_chars: Optional[int] = None) -> None:
+    """Fill ``result.text`` for query results in one store lookup.
+
+    Falls back to text carried in the result itself or its metadata (indexes
+    written before the chunk store existed keep text under ``metadata["text"]``).
+    """
+    texts = store.get_many([r.id for r in results]) if store is not None and results else {}
+    for r in results:
+        text = texts.get(r.id) or r.text or (r.metadata or {}).get("text")
+        r.text = snippet(text, max_chars)
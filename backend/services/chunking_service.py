@@ -1,19 +1,6 @@
 import re
-
-def chunk_text(doc, file_type, overlap):
-        chunks = []
-
-        pattern = file_chunk_map[file_type]
-        raw_chunks = [s.strip() for s in re.split(pattern, doc["text"]) if s.strip()]
-
-        for i in range(len(raw_chunks)):
-            current_chunk = raw_chunks[i]
-            if i > 0:
-                 overlap = raw_chunks[i-1][-overlap:]
-                 current_chunk = overlap + " " + current_chunk
-            chunks.append(current_chunk)
-
-        return chunks
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Tuple
 
 file_chunk_map = {
     "copybook": r'\n(?=[A-Z0-9\-]+\.\s*\n)',
@@ -24,23 +11,105 @@ file_chunk_map = {
     "text": r'\n\s*\n',
     "markdown": r'\n(?=#{1,6}\s)',
 }
-    
-def file_type_chunk(documents):
+
+_compiled_chunk_map = {file_type: re.compile(pattern) for file_type, pattern in file_chunk_map.items()}
+
+
+class Chunk(Mapping):
+    """A chunk as ``(start, end)`` offsets into its source text.
+
+    Behaves like the ``{"text": ..., "metadata": ...}`` dicts the rest of the
+    code expects (``page_content`` is an alias of ``text``), but the text is
+    only sliced out of the source when it is read.
+    """
+
+    __slots__ = ("source", "start", "end", "metadata")
+    _keys = ("text", "page_content", "metadata")
+
+    def __init__(self, source: str, start: int, end: int, metadata: Dict[str, Any]):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.metadata = metadata
+
+    @property
+    def text(self) -> str:
+        return self.source[self.start : self.end]
+
+    def __getitem__(self, key: str) -> Any:
+        if key in ("text", "page_content"):
+            return self.text
+        if key == "metadata":
+            return self.metadata
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.start}:{self.end}, {self.metadata!r})"
+
+
+def _strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def chunk_spans(text: str, file_type: str, overlap: int) -> List[Tuple[int, int]]:
+    """Return ``(start, end)`` offsets of the chunks of ``text``.
+
+    The text is split at the file type's boundary pattern and each piece is
+    trimmed of surrounding whitespace. Every chunk after the first also starts
+    up to ``overlap`` characters before its piece, inside the previous piece.
+    """
+    pieces = []
+    pos = 0
+    for match in _compiled_chunk_map[file_type].finditer(text):
+        pieces.append(_strip_span(text, pos, match.start()))
+        pos = match.end()
+    pieces.append(_strip_span(text, pos, len(text)))
+    pieces = [(s, e) for s, e in pieces if s < e]
+
+    spans = []
+    for i, (start, end) in enumerate(pieces):
+        if i > 0 and overlap > 0:
+            prev_start, prev_end = pieces[i - 1]
+            start = max(prev_start, prev_end - overlap)
+        spans.append((start, end))
+    return spans
+
+
+def chunk_text(doc, file_type, overlap):
+    return [doc["text"][start:end] for start, end in chunk_spans(doc["text"], file_type, overlap)]
+
+
+def file_type_chunk(documents, overlap: int = 200) -> List[Chunk]:
     chunked_documents = []
     for doc in documents:
         file_type = doc["metadata"]["file_type"]
 
-        if file_chunk_map.get(file_type):
-            chunks = chunk_text(doc, file_type=file_type, overlap=200)  
-        else:
+        if file_type not in _compiled_chunk_map:
             continue
 
-        for i, chunk in enumerate(chunks):
-            chunked_documents.append({
-                "text": chunk,
-                "metadata": {
-                    **doc["metadata"],
-                    "chunk_index": i
-                }
-            })
-    return chunked_documents
\ No newline at end of file
+        text = doc["text"]
+        for i, (start, end) in enumerate(chunk_spans(text, file_type, overlap)):
+            chunked_documents.append(
+                Chunk(
+                    text,
+                    start,
+                    end,
+                    {
+                        **doc["metadata"],
+                        "chunk_index": i,
+                        "start_index": start,
+                        "end_index": end,
+                    },
+                )
+            )
+    return chunked_documents
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+# Estimated Jaccard similarity of word shingles above which two chunks count as duplicates.
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+# Set to 0 to embed every chunk.
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
+# Canonical metadata keeps at most this many duplicate paths (Pinecone caps metadata size).
+MAX_DUPLICATE_PATHS = 100
+
+_WORDS = re.compile(r"\w+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class Deduplicator:
+    """Detect exact and near-duplicate chunks within one ingest run.
+
+    Exact duplicates are found by hashing whitespace-normalized text. Near
+    duplicates use MinHash signatures over word shingles, bucketed with
+    locality-sensitive hashing (``bands`` bands of ``num_perm / bands`` rows)
+    and confirmed by signature agreement of at least ``threshold``. The first
+    chunk seen with some content becomes canonical; later ones map to it.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5,
+        min_words: int = 8,
+        seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: uint64 products wrap mod 2**64 and the top 32 bits are kept.
+        self._a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.min_words = min_words
+
+        self._exact: Dict[bytes, str] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [defaultdict(list) for _ in range(bands)]
+        # canonical id -> paths of the chunks folded into it
+        self.duplicates: Dict[str, List[str]] = defaultdict(list)
+        # path -> canonical ids its duplicate chunks point at
+        self.references: Dict[str, Set[str]] = defaultdict(set)
+        self.exact_hits = 0
+        self.near_hits = 0
+
+    def _signature(self, words: List[str]) -> np.ndarray:
+        k = self.shingle_size
+        shingles = {hash(tuple(words[i : i + k])) for i in range(len(words) - k + 1)}
+        x = np.fromiter(shingles, dtype=np.int64, count=len(shingles)).view(np.uint64)
+        with np.errstate(over="ignore"):
+            hashed = (x[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return hashed.min(axis=0).astype(np.uint32)
+
+    def check(self, chunk_id: str, path: str, text: str) -> Optional[str]:
+        """Return the canonical chunk id if ``text`` duplicates an earlier chunk, else register it and return None."""
+        normalized = _WHITESPACE.sub(" ", text).strip()
+        digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+        canonical = self._exact.get(digest)
+        if canonical is not None and canonical != chunk_id:
+            self.exact_hits += 1
+            return self._fold(canonical, path)
+        self._exact[digest] = chunk_id
+        if chunk_id in self._signatures:
+            return None
+
+        words = _WORDS.findall(normalized.lower())
+        if len(words) < max(self.min_words, self.shingle_size):
+            return None
+        signature = self._signature(words)
+        keys = [signature[b * self.rows : (b + 1) * self.rows].tobytes() for b in range(self.bands)]
+        candidates = {c for band, key in zip(self._buckets, keys) for c in band.get(key, ())}
+        candidates.discard(chunk_id)
+        for candidate in candidates:
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                self.near_hits += 1
+                return self._fold(candidate, path)
+
+        self._signatures[chunk_id] = signature
+        for band, key in zip(self._buckets, keys):
+            band[key].append(chunk_id)
+        return None
+
+    def _fold(self, canonical: str, path: str) -> str:
+        paths = self.duplicates[canonical]
+        if path not in paths:
+            paths.append(path)
+        self.references[path].add(canonical)
+        return canonical
+
+    def duplicate_metadata(self) -> Dict[str, Dict]:
+        """Metadata updates for the canonical chunks of this run's duplicates."""
+        return duplicate_metadata(self.duplicates)
+
+
+def duplicate_metadata(duplicates: Dict[str, List[str]]) -> Dict[str, Dict]:
+    """Metadata updates for canonical chunks: the paths (and count) of their duplicates."""
+    return {
+        canonical: {"duplicate_paths": paths[:MAX_DUPLICATE_PATHS], "duplicate_count": len(paths)}
+        for canonical, paths in duplicates.items()
+    }
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".gitsense", "embedding_cache.sqlite"))
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "2048"))
+
+# SQLite's default limit on bound parameters per statement.
+_SQL_VARS = 900
+# After eviction the cache is trimmed to this fraction of its budget so we do not evict on every put.
+_EVICT_TARGET = 0.9
+
+
+def cache_key(model_name: str, instruction: str, text: str) -> bytes:
+    """Content address for an embedding: sha256 over model, instruction prefix and text."""
+    h = hashlib.sha256()
+    for part in (model_name, instruction, text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.digest()
+
+
+class EmbeddingCache:
+    """Size-bounded, least-recently-used on-disk cache of float32 embedding vectors.
+
+    Entries are keyed by :func:`cache_key` and stored as raw float32 bytes in a
+    single SQLite table, so the cache survives across ingest runs and is shared
+    by every process on the machine.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Ingest worker processes share the file, so wait for writers instead of failing fast.
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[List[float]]]:
+        """Return the cached vector for each key, or None on a miss."""
+        found: Dict[bytes, bytes] = {}
+        now = time.time_ns()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_VARS):
+                chunk = list(keys[i : i + _SQL_VARS])
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                )
+            if found:
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self._db.commit()
+            results = [np.frombuffer(found[k], dtype=np.float32).tolist() if k in found else None for k in keys]
+            hits = sum(v is not None for v in results)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return results
+
+    def put_many(self, items: Iterable[Tuple[bytes, Sequence[float]]]) -> None:
+        """Store vectors, evicting least recently used entries when over budget."""
+        now = time.time_ns()
+        rows = [(k, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in items]
+        if not rows:
+            return
+        with self._lock:
+            for i in range(0, len(rows), _SQL_VARS):
+                chunk = rows[i : i + _SQL_VARS]
+                placeholders = ",".join("?" * len(chunk))
+                existing = self._db.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({placeholders})",
+                    [r[0] for r in chunk],
+                ).fetchone()[0]
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", chunk)
+                self._bytes += sum(len(r[1]) for r in chunk) - existing
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        # Other processes may have written to the same file; count from the source of truth.
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        if self._bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * _EVICT_TARGET
+        row_bytes = self._db.execute("SELECT LENGTH(vector) FROM embeddings LIMIT 1").fetchone()[0] or 1
+        count = max(1, int((self._bytes - target) // row_bytes) + 1)
+        freed = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM ("
+            "SELECT vector FROM embeddings ORDER BY last_used LIMIT ?)",
+            (count,),
+        ).fetchone()
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (count,)
+        )
+        self._bytes -= freed[0]
+        self.evictions += freed[1]
+        logger.info("Evicted %d entries from embedding cache '%s'", freed[1], self.path)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self._bytes,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
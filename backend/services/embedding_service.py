@@ -1,14 +1,22 @@
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Tuple
 import hashlib
 import logging
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_core.documents import Document
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from langchain_core.embeddings import Embeddings
 
+from services.chunk_store import ChunkStore
+from services.embedding_cache import EMBEDDING_CACHE_PATH, EmbeddingCache, cache_key
+
 logger = logging.getLogger(__name__)
 
 EMBEDDING_MODEL = "BAAI/bge-base-en-v1.5"
+# "torch" (sentence-transformers, full precision) or "onnx" (int8-quantized ONNX Runtime).
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+
+# Padded tokens (batch size x longest sequence in the batch) allowed in one forward pass.
+EMBED_TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", "16384"))
+_MAX_TOKENS = 512
 
 _QUERY_INSTRUCTION = "Represent this sentence for searching relevant passages: "
 _PASSAGE_INSTRUCTION = "Represent this sentence for retrieving relevant passages: "
@@ -16,12 +24,23 @@ _PASSAGE_INSTRUCTION = "Represent this sentence for retrieving relevant passages
 
 class BGEEmbeddings(Embeddings):
 
-    def __init__(self):
-        self._model = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL,
-            model_kwargs={"device": "cpu"},
-            encode_kwargs={"normalize_embeddings": True},
-        )
+    def __init__(self, backend: str = EMBEDDING_BACKEND):
+        self.backend = backend
+        if backend == "onnx":
+            from services.onnx_embeddings import OnnxEmbeddings
+
+            self._model = OnnxEmbeddings(EMBEDDING_MODEL)
+        elif backend == "torch":
+            # Imported here: langchain_community is slow to import and the ONNX backend never needs it.
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+
+            self._model = HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL,
+                model_kwargs={"device": "cpu"},
+                encode_kwargs={"normalize_embeddings": True},
+            )
+        else:
+            raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (expected 'torch' or 'onnx')")
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         prefixed = [_PASSAGE_INSTRUCTION + t for t in texts]
@@ -31,10 +50,55 @@ class BGEEmbeddings(Embeddings):
         prefixed = _QUERY_INSTRUCTION + text
         return self._model.embed_query(prefixed)
 
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        prefixed = [_QUERY_INSTRUCTION + t for t in texts]
+        return self._model.embed_documents(prefixed)
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        """Tokens per passage as the model sees them (instruction included, truncated at 512)."""
+        # OnnxEmbeddings exposes its tokenizer directly; SentenceTransformer hangs off HuggingFaceEmbeddings.client.
+        tokenizer = getattr(self._model, "tokenizer", None) or getattr(getattr(self._model, "client", None), "tokenizer", None)
+        prefixed = [_PASSAGE_INSTRUCTION + t for t in texts]
+        if tokenizer is None:
+            return _estimate_token_lengths(prefixed)
+        encoded = tokenizer(prefixed, add_special_tokens=True, truncation=True, max_length=_MAX_TOKENS)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+def _estimate_token_lengths(texts: List[str]) -> List[int]:
+    # Roughly four characters per WordPiece token for English text and code.
+    return [min(len(t) // 4 + 2, _MAX_TOKENS) for t in texts]
+
+
+def token_budget_batches(lengths: List[int], token_budget: int = EMBED_TOKEN_BUDGET, max_batch: int = 100) -> List[List[int]]:
+    """Group input positions into length-sorted batches that fit a padded-token budget.
+
+    Positions are visited longest first, so each batch holds texts of similar
+    length and pads very little. A batch closes when adding the next text would
+    push ``len(batch) * longest`` past ``token_budget`` or reach ``max_batch``
+    texts; a single text longer than the budget still gets its own batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for i in order:
+        # Descending order: the first entry of the batch is its longest.
+        longest = lengths[current[0]] if current else lengths[i]
+        if current and ((len(current) + 1) * longest > token_budget or len(current) >= max_batch):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
 
 _embeddings: Optional[BGEEmbeddings] = None
 
 
+_cache: Optional[EmbeddingCache] = None
+
+
 def _model() -> BGEEmbeddings:
     global _embeddings
     if _embeddings is None:
@@ -42,22 +106,79 @@ def _model() -> BGEEmbeddings:
     return _embeddings
 
 
+def load_model() -> BGEEmbeddings:
+    """Load the embedding model now instead of on the first request (e.g. before forking workers)."""
+    return _model()
+
+
+def warm_up() -> None:
+    """Run a couple of throwaway forward passes so the first real query pays no one-off setup cost."""
+    # Two lengths, so tokenizer and kernels have seen both short and padded batches.
+    embed_queries(["warm up", "how is the embedding model warmed up before serving the first query?"])
+
+
+def _embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the shared on-disk embedding cache, or None if EMBEDDING_CACHE_PATH is empty."""
+    global _cache
+    if _cache is None and EMBEDDING_CACHE_PATH:
+        _cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _cache
+
+
+def cache_stats() -> Dict[str, float]:
+    """Hit/miss counters of the embedding cache for this process; empty if there is no cache yet.
+
+    A read never creates the cache file: it is only opened here if a run already wrote it.
+    """
+    if _cache is None and not (EMBEDDING_CACHE_PATH and os.path.exists(EMBEDDING_CACHE_PATH)):
+        return {}
+    cache = _embedding_cache()
+    return cache.stats() if cache is not None else {}
+
+
 def embed(texts: List[str], batch_size: int = 100) -> List[List[float]]:
     """Return embeddings for a list of texts using BAAI/bge-base-en-v1.5.
 
+    Vectors are looked up in the persistent embedding cache first; only texts
+    that were never embedded with this model and instruction prefix hit the model.
+    Those are batched by similar token length under EMBED_TOKEN_BUDGET padded
+    tokens, which keeps padding and peak memory low on long README chunks.
+
     Args:
         texts: List of strings to embed (passages/documents).
-        batch_size: Number of texts to embed per batch.
+        batch_size: Maximum number of texts per batch.
 
     Returns:
         List of embedding vectors (768-dim each) in the same order as inputs.
     """
+    cache = _embedding_cache()
+    if cache is None:
+        return _embed_uncached(texts, batch_size)
+
+    # Quantized vectors differ slightly from full precision ones, so each backend gets its own entries.
+    model_key = EMBEDDING_MODEL if EMBEDDING_BACKEND == "torch" else f"{EMBEDDING_MODEL}#{EMBEDDING_BACKEND}-int8"
+    keys = [cache_key(model_key, _PASSAGE_INSTRUCTION, t) for t in texts]
+    embeddings = cache.get_many(keys)
+    # Identical texts within one call share a single forward pass.
+    pending: Dict[bytes, str] = {}
+    for key, text, vector in zip(keys, texts, embeddings):
+        if vector is None:
+            pending.setdefault(key, text)
+    if pending:
+        fresh = dict(zip(pending, _embed_uncached(list(pending.values()), batch_size)))
+        cache.put_many(fresh.items())
+        embeddings = [v if v is not None else fresh[k] for k, v in zip(keys, embeddings)]
+    return embeddings
+
+
+def _embed_uncached(texts: List[str], batch_size: int) -> List[List[float]]:
     model = _model()
-    embeddings: List[List[float]] = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
-        vectors = model.embed_documents(batch)
-        embeddings.extend(vectors)
+    token_lengths = getattr(model, "token_lengths", _estimate_token_lengths)
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    for batch in token_budget_batches(token_lengths(texts), EMBED_TOKEN_BUDGET, batch_size):
+        vectors = model.embed_documents([texts[i] for i in batch])
+        for i, vector in zip(batch, vectors):
+            embeddings[i] = vector
     return embeddings
 
 
@@ -69,43 +190,94 @@ def embed_query(text: str) -> List[float]:
     return _model().embed_query(text)
 
 
-def _make_id(doc):
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """Return embeddings for several query strings in one forward pass.
+
+    Same vectors as calling ``embed_query`` on each text; used to batch
+    concurrent requests in the query services.
+    """
+    return _model().embed_queries(texts)
+
+
+def make_chunk_id(doc: Dict[str, Any]) -> str:
+    """Deterministic vector id for a chunk: the same repo, path and offset always map to the same id."""
     meta = doc.get("metadata", {})
+    repo = meta.get("repo_id", "")
     path = meta.get("path", "unknown_path")
     start = meta.get("start_index", 0)
-    return hashlib.sha1(f"{path}:{start}".encode()).hexdigest()
+    return hashlib.sha1(f"{repo}:{path}:{start}".encode()).hexdigest()
+
+
+def to_records(
+    documents: List[Dict[str, Any]],
+    vectors: List[List[float]],
+    id_fn: Optional[Callable[[Dict[str, Any]], str]] = None,
+    include_text: bool = True,
+) -> List[Tuple[str, List[float], Dict[str, Any]]]:
+    """Pair documents with their vectors as (id, values, metadata) upsert records.
+
+    The chunk text is stored under the ``text`` metadata key unless
+    ``include_text`` is False (the text then lives in the chunk store).
+    """
+    if id_fn is None:
+        id_fn = make_chunk_id
+    records = []
+    for doc, vector in zip(documents, vectors):
+        metadata = dict(doc.get("metadata", {}))
+        if include_text:
+            metadata["text"] = doc.get("page_content", "")
+        records.append((id_fn(doc), vector, metadata))
+    return records
 
 
 def embed_and_upsert(
     index,
     documents: List[Dict[str, Any]],
     id_fn: Optional[Callable[[Dict[str, Any]], str]] = None,
-    batch_size: int = 100
+    batch_size: int = 100,
+    text_store: Optional[ChunkStore] = None,
+    namespace: str = "",
+    upsert_workers: int = 4,
+    include_text: Optional[bool] = None,
 ) -> None:
-    """Embed a list of documents and upsert them into the given Pinecone index.
+    """Embed a list of documents and upsert them into the given vector index.
+
+    Batches are embedded in order while up to ``upsert_workers`` earlier
+    batches upload in the background. Ids come from ``id_fn`` (deterministic
+    ``make_chunk_id`` by default), so re-running after a failure overwrites
+    instead of duplicating.
 
     Args:
-        index: Pinecone Index object (e.g., result of client.Index(name)).
+        index: Any object with a Pinecone-style ``upsert(vectors=...)`` method
+            (a Pinecone Index or a ``vectorstore.base.VectorStore``).
         documents: List of dicts with 'page_content' and optional 'metadata'.
         id_fn: Optional function to generate an id for each document.
         batch_size: Number of documents to embed/upsert per batch.
+        text_store: Optional chunk store that receives the texts; the vectors
+            then carry only slim metadata unless ``include_text`` is set.
+        namespace: Namespace (partition) to write into; ingest uses the repo id.
+        upsert_workers: Upserts in flight while the next batch is embedded.
+        include_text: Whether the vectors carry the text in metadata (default:
+            only without a ``text_store``).
     """
-    if id_fn is None:
-        id_fn = _make_id
-
-    model = _model()
-    vectorstore = PineconeVectorStore(embedding=model, index=index)
-
-    texts = [d.get("page_content", "") for d in documents]
-    metadatas = [d.get("metadata", {}) for d in documents]
-
-    # BGEEmbeddings adds passage instruction automatically in embed_documents
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i : i + batch_size]
-        batch_metas = metadatas[i : i + batch_size]
-        batch_docs = [
-            Document(page_content=text, metadata=meta)
-            for text, meta in zip(batch_texts, batch_metas)
-        ]
-        vectorstore.add_documents(batch_docs)
-        logger.info("Upserted batch (docs %d-%d)", i, i + len(batch_docs) - 1)
+    if include_text is None:
+        include_text = text_store is None
+    pending: List[Future] = []
+    with ThreadPoolExecutor(max_workers=max(1, upsert_workers), thread_name_prefix="embed-upsert") as pool:
+        for i in range(0, len(documents), batch_size):
+            batch = documents[i : i + batch_size]
+            texts = [d.get("page_content", "") for d in batch]
+            # BGEEmbeddings adds passage instruction automatically in embed_documents
+            vectors = embed(texts, batch_size=batch_size)
+            records = to_records(batch, vectors, id_fn, include_text=include_text)
+            if text_store is not None:
+                text_store.put_many((r[0], d.get("page_content", "")) for r, d in zip(records, batch))
+            if len(pending) >= upsert_workers:
+                # Bounds memory: wait for the oldest upload before queueing another batch.
+                pending.pop(0).result()
+            pending.append(pool.submit(index.upsert, vectors=records, namespace=namespace))
+            logger.info("Queued upsert of batch (docs %d-%d)", i, i + len(batch) - 1)
+        for future in pending:
+            future.result()
+    if documents:
+        logger.info("Embedding cache: %s", cache_stats())
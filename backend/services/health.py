@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from services import embedding_service
+from vectorstore.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background checks of the embedding model (one short forward pass)
+# and of the vector store (one stats call on the service's existing client).
+HEALTH_MODEL_INTERVAL = float(os.getenv("HEALTH_MODEL_INTERVAL", "60"))
+HEALTH_STORE_INTERVAL = float(os.getenv("HEALTH_STORE_INTERVAL", "30"))
+# A check whose last result is older than this many intervals counts as failed (e.g. a hung call).
+HEALTH_STALE_INTERVALS = float(os.getenv("HEALTH_STALE_INTERVALS", "3"))
+
+
+class HealthMonitor:
+    """Run dependency checks on a background thread and serve their cached results.
+
+    Probes (``/livez``, ``/readyz``, ``/health``) only read ``status()``, so
+    their cost does not depend on how often an orchestrator polls them. Each
+    check is a callable that raises on failure and runs every ``interval``
+    seconds; ``start`` runs all of them once before returning, so the first
+    probe already sees real results.
+    """
+
+    def __init__(self, checks: Dict[str, Tuple[Callable[[], object], float]]):
+        self.checks = checks
+        self._results: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self, name: str, check: Callable[[], object]) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            check()
+        except Exception as exc:
+            error = str(exc) or type(exc).__name__
+            logger.warning("Health check '%s' failed: %s", name, error)
+        result = {"ok": error is None, "error": error, "checked_at": time.time(), "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+        with self._lock:
+            self._results[name] = result
+
+    def _loop(self) -> None:
+        now = time.monotonic()
+        due = {name: now + interval for name, (_, interval) in self.checks.items()}
+        while not self._stop.is_set():
+            name = min(due, key=due.get)
+            if self._stop.wait(max(0.0, due[name] - time.monotonic())):
+                return
+            check, interval = self.checks[name]
+            self._run(name, check)
+            due[name] = time.monotonic() + interval
+
+    def start(self) -> None:
+        for name, (check, _) in self.checks.items():
+            self._run(name, check)
+        if self.checks:
+            self._thread = threading.Thread(target=self._loop, name="health-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def alive(self) -> bool:
+        """False if the refresh thread has died, i.e. the cached results no longer move."""
+        return not self.checks or (self._thread is not None and self._thread.is_alive())
+
+    def status(self) -> Dict[str, object]:
+        now = time.time()
+        with self._lock:
+            results = {name: dict(result) for name, result in self._results.items()}
+        for name, result in results.items():
+            result["age_seconds"] = round(now - result.pop("checked_at"), 1)
+            if result["ok"] and result["age_seconds"] > HEALTH_STALE_INTERVALS * self.checks[name][1]:
+                result["ok"], result["error"] = False, "stale"
+        ok = len(results) == len(self.checks) and all(r["ok"] for r in results.values())
+        return {"ok": ok, "checks": results}
+
+
+def query_service_checks(index: VectorStore) -> Dict[str, Tuple[Callable[[], object], float]]:
+    """The checks both query services run: the embedding model and their already-open vector store."""
+    return {
+        "model": (lambda: embedding_service.embed_queries(["health check"]), HEALTH_MODEL_INTERVAL),
+        "vectorstore": (index.describe_index_stats, HEALTH_STORE_INTERVAL),
+    }
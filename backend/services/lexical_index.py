@@ -0,0 +1,277 @@
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from vectorstore.base import Namespaces, match_filter
+
+logger = logging.getLogger(__name__)
+
+# BM25 inverted index of chunk texts (one SQLite file per index). Empty disables lexical search.
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", os.path.join(".gitsense", "lexical"))
+# Reciprocal rank fusion constant: larger values flatten the gap between top and lower ranks.
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Identifiers, including snake_case and COBOL-style kebab-case names.
+_WORD = re.compile(r"[A-Za-z0-9]+(?:[_\-][A-Za-z0-9]+)*")
+# camelCase / PascalCase / ACRONYMWord / digit boundaries inside one identifier part.
+_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+_MAX_TOKEN = 64
+_SQL_VARS = 900
+
+_indexes: Dict[str, "LexicalIndex"] = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text: str, parts: bool = True) -> Iterator[str]:
+    """Lowercased terms of ``text`` with code-aware splitting.
+
+    Each identifier yields itself plus (unless ``parts`` is False) its
+    camelCase / snake_case / kebab-case parts, so ``useDisclosure`` matches
+    both an exact lookup and a query for "disclosure", and ``CARD-UPDATE``
+    matches "card update".
+    """
+    for match in _WORD.finditer(text):
+        word = match.group()
+        if len(word) > _MAX_TOKEN:
+            continue
+        yield word.lower()
+        if not parts:
+            continue
+        pieces = [p.lower() for piece in re.split(r"[_\-]", word) for p in _PART.findall(piece)]
+        if len(pieces) > 1:
+            yield from pieces
+
+
+def looks_like_identifier(token: str) -> bool:
+    """True for tokens shaped like code symbols rather than prose words."""
+    if not _IDENTIFIER.fullmatch(token) or len(token) < 3:
+        return False
+    return (
+        "_" in token
+        or "-" in token.strip("-")
+        or any(c.isdigit() for c in token)
+        or (token.isupper() and len(token) >= 4)
+        or any(a.islower() and b.isupper() for a, b in zip(token, token[1:]))
+    )
+
+
+def query_kind(query: str) -> str:
+    """Classify a query as ``"identifier"``, ``"mixed"`` or ``"natural"`` language."""
+    tokens = [t.strip("`'\"()[]{}.,:;") for t in query.split()]
+    tokens = [t for t in tokens if t]
+    identifiers = sum(looks_like_identifier(t) for t in tokens)
+    if not identifiers:
+        return "natural"
+    return "identifier" if identifiers == len(tokens) else "mixed"
+
+
+def rrf_fuse(rankings: Sequence[List[Dict[str, Any]]], top_k: int, k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of best-first match lists.
+
+    Each match scores ``sum(1 / (k + rank))`` over the lists it appears in; the
+    first list's copy of a match (with its metadata) is the one returned.
+    """
+    fused: Dict[str, float] = {}
+    first: Dict[str, Dict[str, Any]] = {}
+    for matches in rankings:
+        for rank, match in enumerate(matches, start=1):
+            fused[match["id"]] = fused.get(match["id"], 0.0) + 1.0 / (k + rank)
+            first.setdefault(match["id"], match)
+    best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [{**first[id_], "score": fused[id_]} for id_ in best]
+
+
+class LexicalIndex:
+    """On-disk BM25 inverted index over chunk texts.
+
+    Postings are ``(term, doc, tf)`` rows in a ``WITHOUT ROWID`` table keyed by
+    term, so a query reads only the postings of its own terms; the document
+    count and total length BM25 needs are kept in a ``meta`` table that writes
+    update. Documents keep their namespace (repo) and slim metadata so
+    searches honour the same ``namespace`` and ``filter`` arguments as the
+    vector stores. Writes are serialized; searches run concurrently on
+    per-thread read connections (WAL mode).
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                doc INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, namespace TEXT NOT NULL,
+                length INTEGER NOT NULL, metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """
+        )
+        if self._db.execute("SELECT COUNT(*) FROM meta").fetchone()[0] < 2:
+            # Indexes written before the meta table existed: count once here instead of on every search.
+            docs, length = self._db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+            self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [("docs", docs), ("length", length)])
+        self._db.commit()
+
+    def _adjust_totals(self, docs: int, length: int) -> None:
+        self._db.execute("UPDATE meta SET value = value + ? WHERE key = 'docs'", (docs,))
+        self._db.execute("UPDATE meta SET value = value + ? WHERE key = 'length'", (length,))
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "db", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._local.db = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def _delete_locked(self, ids: Sequence[str]) -> None:
+        for i in range(0, len(ids), _SQL_VARS):
+            chunk = list(ids[i : i + _SQL_VARS])
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db.execute(f"SELECT doc, length FROM docs WHERE id IN ({placeholders})", chunk).fetchall()
+            docs = [(d,) for d, _ in rows]
+            self._db.executemany("DELETE FROM postings WHERE doc = ?", docs)
+            self._db.executemany("DELETE FROM docs WHERE doc = ?", docs)
+            self._adjust_totals(-len(rows), -sum(length for _, length in rows))
+
+    def add(self, items: Iterable[Tuple[str, str, Dict[str, Any]]], namespace: str = "") -> None:
+        """Index ``(id, text, metadata)`` items, replacing any earlier version of the same ids."""
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            self._delete_locked([id_ for id_, _, _ in items])
+            added_length = 0
+            for id_, text, metadata in items:
+                terms = Counter(tokenize(text))
+                length = sum(terms.values())
+                added_length += length
+                cur = self._db.execute(
+                    "INSERT INTO docs (id, namespace, length, metadata) VALUES (?, ?, ?, ?)",
+                    (id_, namespace, length, json.dumps(metadata)),
+                )
+                self._db.executemany(
+                    "INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)",
+                    [(term, cur.lastrowid, tf) for term, tf in terms.items()],
+                )
+            self._adjust_totals(len(items), added_length)
+            self._db.commit()
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            self._delete_locked(list(ids))
+            self._db.commit()
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Return BM25 ``{"id", "score", "metadata"}`` matches, best first.
+
+        With ``exact`` (the identifier fast path) only the whole lowercased
+        words of the query are looked up; their camelCase / snake_case parts,
+        whose postings lists are much longer, are only tried if no whole word
+        is indexed.
+        """
+        if top_k <= 0:
+            return []
+        db = self._reader()
+        total, total_length = (v for (v,) in db.execute("SELECT value FROM meta WHERE key IN ('docs', 'length') ORDER BY key"))
+        if not total:
+            return []
+        avg_length = total_length / total
+        scores: Dict[int, float] = {}
+        if exact:
+            scores = self._score(db, set(tokenize(query, parts=False)), total, avg_length)
+        if not scores:
+            scores = self._score(db, set(tokenize(query)), total, avg_length)
+        namespaces = None if namespace is None else {namespace} if isinstance(namespace, str) else set(namespace)
+
+        matches = []
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        # Walk the ranking in pages so filters only load the metadata they need.
+        for start in range(0, len(ranked), _SQL_VARS):
+            page = ranked[start : start + _SQL_VARS]
+            placeholders = ",".join("?" * len(page))
+            rows = {
+                doc: (id_, ns, metadata)
+                for doc, id_, ns, metadata in db.execute(
+                    f"SELECT doc, id, namespace, metadata FROM docs WHERE doc IN ({placeholders})",
+                    [doc for doc, _ in page],
+                )
+            }
+            for doc, score in page:
+                if doc not in rows:
+                    # Deleted by a concurrent write since the postings were read.
+                    continue
+                id_, ns, metadata = rows[doc]
+                if namespaces is not None and ns not in namespaces:
+                    continue
+                metadata = json.loads(metadata)
+                if filter and not match_filter(metadata, filter):
+                    continue
+                matches.append({"id": id_, "score": score, "metadata": metadata})
+                if len(matches) == top_k:
+                    return matches
+        return matches
+
+    @staticmethod
+    def _score(db: sqlite3.Connection, terms: Iterable[str], total: int, avg_length: float) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = db.execute(
+                "SELECT p.doc, p.tf, d.length FROM postings p JOIN docs d ON d.doc = p.doc WHERE p.term = ?",
+                (term,),
+            ).fetchall()
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf, length in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self._db.close()
+
+
+def open_lexical_index(index_name: str) -> Optional[LexicalIndex]:
+    """Return the shared lexical index for ``index_name``, or None if LEXICAL_INDEX_DIR is empty."""
+    if not LEXICAL_INDEX_DIR:
+        return None
+    path = os.path.join(LEXICAL_INDEX_DIR, f"{index_name}.sqlite")
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = LexicalIndex(path)
+            _indexes[path] = index
+            logger.info("Opened lexical index at '%s'", path)
+    return index
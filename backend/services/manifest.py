@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INGEST_STATE_DIR = os.getenv("INGEST_STATE_DIR", os.path.join(".gitsense", "manifests"))
+# A running ingest commits its progress after this many upserted batches or seconds, whichever comes first.
+INGEST_CHECKPOINT_BATCHES = int(os.getenv("INGEST_CHECKPOINT_BATCHES", "20"))
+INGEST_CHECKPOINT_SECONDS = float(os.getenv("INGEST_CHECKPOINT_SECONDS", "60"))
+
+
+def _manifest_path(repo: str, index_name: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "__", f"{index_name}/{repo}")
+    return os.path.join(INGEST_STATE_DIR, f"{safe}.json")
+
+
+class RepoManifest:
+    """Per-repo record of each indexed file's blob SHA and the chunk ids it produced.
+
+    The manifest is what makes re-ingestion incremental: comparing it with the
+    current repository tree tells us which files to fetch and embed and which
+    vector ids have to be removed.
+    """
+
+    def __init__(self, repo: str, index_name: str, files: Dict[str, Dict] = None):
+        self.repo = repo
+        self.index_name = index_name
+        self.files: Dict[str, Dict] = files or {}
+
+    @classmethod
+    def load(cls, repo: str, index_name: str) -> "RepoManifest":
+        path = _manifest_path(repo, index_name)
+        if not os.path.exists(path):
+            return cls(repo, index_name)
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(repo, index_name, data.get("files", {}))
+
+    def diff(self, tree: Dict[str, str]) -> Tuple[List[str], List[str], List[str]]:
+        """Compare ``{path: blob_sha}`` with the manifest; return (added, modified, deleted) paths."""
+        added = [p for p in tree if p not in self.files]
+        modified = [p for p in tree if p in self.files and self.files[p]["sha"] != tree[p]]
+        deleted = [p for p in self.files if p not in tree]
+        return added, modified, deleted
+
+    def chunk_ids(self, path: str) -> List[str]:
+        return list(self.files.get(path, {}).get("chunk_ids", []))
+
+    def dup_of(self, path: str) -> List[str]:
+        """Canonical chunk ids (owned by other files) that this file's duplicate chunks point at."""
+        return list(self.files.get(path, {}).get("dup_of", []))
+
+    def duplicates(self, canonicals: Iterable[str]) -> Dict[str, List[str]]:
+        """Paths whose duplicate chunks point at each of ``canonicals``, across all runs."""
+        found: Dict[str, List[str]] = {canonical: [] for canonical in canonicals}
+        for path, entry in self.files.items():
+            for chunk_id in entry.get("dup_of", ()):
+                if chunk_id in found:
+                    found[chunk_id].append(path)
+        return found
+
+    def record(self, path: str, sha: str, chunk_ids: List[str], dup_of: Iterable[str] = ()) -> None:
+        entry = {"sha": sha, "chunk_ids": list(chunk_ids)}
+        dup_of = sorted(set(dup_of))
+        if dup_of:
+            entry["dup_of"] = dup_of
+        self.files[path] = entry
+
+    def adopt(self, path: str, chunk_id: str) -> None:
+        """Hand ``chunk_id`` over to ``path`` and force the file to be re-ingested next run.
+
+        Used when the file owning a canonical chunk changes while other files
+        still rely on it: the vector is kept, and re-ingesting ``path`` later
+        either re-creates it or removes it as stale.
+        """
+        entry = self.files[path]
+        if chunk_id not in entry["chunk_ids"]:
+            entry["chunk_ids"].append(chunk_id)
+        entry["sha"] = ""
+
+    def forget(self, path: str) -> None:
+        self.files.pop(path, None)
+
+    def save(self) -> None:
+        """Atomically write the manifest so a crash never leaves a half-written file."""
+        _write_json(_manifest_path(self.repo, self.index_name), {"repo": self.repo, "index_name": self.index_name, "files": self.files})
+        logger.info("Saved manifest for %s (%d files)", self.repo, len(self.files))
+
+
+def _write_json(path: str, data: Dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+class IngestCheckpoint:
+    """Progress of an unfinished ingest run, saved next to the repo's manifest.
+
+    While a run is in progress, files whose chunks have all been upserted are
+    committed to the manifest every few batches, so a restarted run diffs
+    them as unchanged and carries on with the rest. Chunk ids are
+    deterministic, so the partly upserted files it redoes are simply
+    overwritten. The checkpoint keeps what the manifest alone would lose: the
+    previous chunk ids of committed files that changed, whose stale vectors
+    are only deleted once the run finishes. It is removed when a run
+    completes, so its presence means the last run was interrupted.
+    """
+
+    def __init__(self, repo: str, index_name: str, previous: Dict[str, List[str]] = None, batches: int = 0, files: int = 0):
+        self.repo = repo
+        self.index_name = index_name
+        self.previous: Dict[str, List[str]] = previous or {}
+        self.batches = batches
+        self.files = files
+        self._pending_batches = 0
+        self._saved_at = time.monotonic()
+
+    @staticmethod
+    def _path(repo: str, index_name: str) -> str:
+        return _manifest_path(repo, index_name)[: -len(".json")] + ".checkpoint.json"
+
+    @classmethod
+    def load(cls, repo: str, index_name: str) -> Optional["IngestCheckpoint"]:
+        """The checkpoint of an interrupted run, or None if the last run finished."""
+        path = cls._path(repo, index_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(repo, index_name, data.get("previous", {}), data.get("batches", 0), data.get("files", 0))
+
+    def batch_done(self) -> None:
+        self.batches += 1
+        self._pending_batches += 1
+
+    def due(self) -> bool:
+        return self._pending_batches >= INGEST_CHECKPOINT_BATCHES or (
+            self._pending_batches > 0 and time.monotonic() - self._saved_at >= INGEST_CHECKPOINT_SECONDS
+        )
+
+    def commit(self, manifest: RepoManifest, files: int) -> None:
+        """Persist the checkpoint, then the manifest holding every finished file.
+
+        In this order a crash between the two writes only leaves extra
+        ``previous`` entries, which the next run handles like any modified file.
+        """
+        self.files = files
+        _write_json(
+            self._path(self.repo, self.index_name),
+            {"repo": self.repo, "index_name": self.index_name, "previous": self.previous, "batches": self.batches, "files": files},
+        )
+        manifest.save()
+        self._pending_batches = 0
+        self._saved_at = time.monotonic()
+
+    def clear(self) -> None:
+        try:
+            os.remove(self._path(self.repo, self.index_name))
+        except FileNotFoundError:
+            pass
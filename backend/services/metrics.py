@@ -0,0 +1,91 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+T = TypeVar("T")
+
+_QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_INGEST_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+QUERY_SECONDS = Histogram(
+    "gitsense_query_seconds", "End-to-end /query latency.", ["service"], buckets=_QUERY_BUCKETS
+)
+QUERY_STAGE_SECONDS = Histogram(
+    "gitsense_query_stage_seconds", "Latency of each /query stage.", ["service", "stage"], buckets=_QUERY_BUCKETS
+)
+QUERIES_TOTAL = Counter(
+    "gitsense_queries_total", "/query requests by outcome (ok, cache_hit, semantic_hit, lexical, error).", ["service", "outcome"]
+)
+STARTUP_SECONDS = Gauge(
+    "gitsense_startup_seconds", "Time spent in each startup stage; stage=total is import to ready.", ["service", "stage"]
+)
+FIRST_QUERY_SECONDS = Gauge("gitsense_first_query_seconds", "Latency of the first /query served by this process.", ["service"])
+SERVICE_READY = Gauge("gitsense_ready", "1 once the service has finished warming up.", ["service"])
+INGEST_STAGE_SECONDS = Histogram(
+    "gitsense_ingest_stage_seconds", "Time spent in each ingest stage per repository run.", ["stage"], buckets=_INGEST_BUCKETS
+)
+INGEST_FILES_TOTAL = Counter("gitsense_ingest_files_total", "Files processed by ingestion.")
+INGEST_CHUNKS_TOTAL = Counter("gitsense_ingest_chunks_total", "Chunks embedded and upserted by ingestion.")
+
+
+class StageTimer:
+    """Accumulates wall time per named stage for one request or ingest run.
+
+    Spans may overlap and come from several threads (the ingest pipeline
+    stages run concurrently), so per-stage totals can add up to more than the
+    elapsed time. With ``histogram`` set, every span is also observed there
+    with ``labels`` plus its stage name.
+    """
+
+    def __init__(self, histogram: Optional[Histogram] = None, **labels: str):
+        self._histogram = histogram
+        self._labels = labels
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if self._histogram is not None:
+            self._histogram.labels(stage=stage, **self._labels).observe(seconds)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def wrap(self, stage: str, fn: Callable[..., T]) -> Callable[..., T]:
+        """Return ``fn`` with every call timed as ``stage``."""
+
+        def timed(*args, **kwargs) -> T:
+            with self.span(stage):
+                return fn(*args, **kwargs)
+
+        return timed
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def elapsed_ms(self) -> int:
+        return int(round(self.elapsed() * 1000))
+
+    def breakdown_ms(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+
+    def breakdown_seconds(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+
+def metrics_response() -> Response:
+    """Prometheus text exposition of every metric registered in this process."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
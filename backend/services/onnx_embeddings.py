@@ -0,0 +1,176 @@
+"""ONNX Runtime backend for the BGE embedding model with dynamic int8 quantization.
+
+Selected with ``EMBEDDING_BACKEND=onnx``. The first use exports
+BAAI/bge-base-en-v1.5 to ONNX, quantizes its weights to int8 and caches the
+result in ``ONNX_MODEL_DIR``. Requires the optional ``onnxruntime`` and
+``onnx`` packages (plus ``torch``/``transformers`` for the one-off export).
+
+Check retrieval parity against the PyTorch backend before switching::
+
+    python -m services.onnx_embeddings --check-parity --corpus path/to/checkout
+"""
+import argparse
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(".gitsense", "onnx", "bge-base-en-v1.5-int8"))
+# 0 lets onnxruntime pick (one thread per physical core).
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+_MODEL_FILE = "model_int8.onnx"
+_MAX_LENGTH = 512
+_INPUTS = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def export_quantized_model(model_name: str, output_dir: str = ONNX_MODEL_DIR) -> str:
+    """Export ``model_name`` to ONNX, quantize weights to int8 and save it with its tokenizer."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["GitSense export sample"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in _INPUTS),
+            fp32_path,
+            input_names=_INPUTS,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in _INPUTS + ["last_hidden_state"]},
+            opset_version=14,
+        )
+    int8_path = os.path.join(output_dir, _MODEL_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(output_dir)
+    logger.info("Exported int8 ONNX model for %s to %s", model_name, output_dir)
+    return int8_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Drop-in replacement for the HuggingFaceEmbeddings the BGE wrapper uses.
+
+    Produces CLS-pooled, L2-normalized vectors like the sentence-transformers
+    config of bge-base-en-v1.5. Instruction prefixes are added by the caller.
+    """
+
+    def __init__(self, model_name: str, model_dir: str = ONNX_MODEL_DIR, intra_op_threads: int = ONNX_INTRA_OP_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, _MODEL_FILE)
+        if not os.path.exists(model_path):
+            export_quantized_model(model_name, model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Same newline handling as HuggingFaceEmbeddings so both backends see identical input.
+        encoded = self.tokenizer(
+            [t.replace("\n", " ") for t in texts],
+            padding=True,
+            truncation=True,
+            max_length=_MAX_LENGTH,
+            return_tensors="np",
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in _INPUTS if name in self._input_names}
+        hidden = self._session.run(["last_hidden_state"], feeds)[0]
+        cls = hidden[:, 0]
+        cls /= np.maximum(np.linalg.norm(cls, axis=1, keepdims=True), 1e-12)
+        return cls.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def recall_parity(
+    reference: Embeddings,
+    candidate: Embeddings,
+    corpus: Sequence[str],
+    queries: Sequence[str],
+    k: int = 10,
+) -> Dict[str, float]:
+    """Compare two embedding backends on the same retrieval task.
+
+    Returns recall@k of the candidate's top-k against the reference's top-k
+    (averaged over queries) and the mean cosine between paired corpus vectors.
+    """
+    ref_docs = np.asarray(reference.embed_documents(list(corpus)), dtype=np.float32)
+    cand_docs = np.asarray(candidate.embed_documents(list(corpus)), dtype=np.float32)
+    ref_q = np.asarray([reference.embed_query(q) for q in queries], dtype=np.float32)
+    cand_q = np.asarray([candidate.embed_query(q) for q in queries], dtype=np.float32)
+    k = min(k, len(corpus))
+
+    ref_top = np.argsort(-(ref_q @ ref_docs.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_q @ cand_docs.T), axis=1)[:, :k]
+    recall = np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)])
+    cosine = np.sum(ref_docs * cand_docs, axis=1) / (
+        np.linalg.norm(ref_docs, axis=1) * np.linalg.norm(cand_docs, axis=1) + 1e-12
+    )
+    return {f"recall@{k}": float(recall), "mean_cosine": float(np.mean(cosine)), "min_cosine": float(np.min(cosine))}
+
+
+_SAMPLE_QUERIES = [
+    "Which file defines the card data structure?",
+    "Where is customer information handled?",
+    "What code validates transactions?",
+    "How is the account balance updated?",
+    "Where are user credentials checked?",
+]
+
+
+def _corpus_from(path: str, limit: int, chunk_size: int = 500) -> List[str]:
+    chunks = []
+    for file in sorted(Path(path).rglob("*")):
+        if not file.is_file() or file.suffix not in {".md", ".txt", ".py", ".ts", ".tsx", ".js", ".cbl", ".cpy", ".jcl"}:
+            continue
+        try:
+            text = file.read_text(encoding="utf-8")
+        except UnicodeDecodeError:
+            continue
+        chunks.extend(text[i : i + chunk_size] for i in range(0, len(text), chunk_size))
+        if len(chunks) >= limit:
+            break
+    return chunks[:limit]
+
+
+if __name__ == "__main__":
+    from services.embedding_service import EMBEDDING_MODEL, BGEEmbeddings
+
+    parser = argparse.ArgumentParser(description="Export the int8 ONNX BGE model or check its parity.")
+    parser.add_argument("--export", action="store_true", help="(Re)export the quantized model")
+    parser.add_argument("--check-parity", action="store_true", help="Compare retrieval against the torch backend")
+    parser.add_argument("--corpus", default=".", help="Directory of source files to sample passages from")
+    parser.add_argument("--limit", type=int, default=2000, help="Maximum passages to embed")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.export:
+        export_quantized_model(EMBEDDING_MODEL)
+    if args.check_parity:
+        report = recall_parity(
+            BGEEmbeddings(backend="torch"),
+            BGEEmbeddings(backend="onnx"),
+            _corpus_from(args.corpus, args.limit),
+            _SAMPLE_QUERIES,
+            k=args.k,
+        )
+        print(report)
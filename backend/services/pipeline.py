@@ -0,0 +1,219 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-stage queue depth. Together with batch_size this bounds how many chunks are in flight.
+PIPELINE_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class PipelineAborted(RuntimeError):
+    """Raised inside a stage when another stage has already failed."""
+
+
+class _FileTracker:
+    """Counts outstanding chunks per file and reports files once all their chunks are upserted."""
+
+    def __init__(self, on_file_done: Optional[Callable[[str, List[str]], None]]):
+        self._on_file_done = on_file_done
+        self._pending: Dict[str, int] = {}
+        self._ids: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, path: str, chunk_ids: List[str]) -> None:
+        with self._lock:
+            self._pending[path] = len(chunk_ids)
+            self._ids[path] = chunk_ids
+        if not chunk_ids:
+            self._finish(path)
+
+    def upserted(self, paths: Iterable[str]) -> None:
+        finished = []
+        with self._lock:
+            for path in paths:
+                self._pending[path] -= 1
+                if self._pending[path] == 0:
+                    finished.append(path)
+        for path in finished:
+            self._finish(path)
+
+    def _finish(self, path: str) -> None:
+        with self._lock:
+            self._pending.pop(path, None)
+            chunk_ids = self._ids.pop(path, [])
+        if self._on_file_done is not None:
+            self._on_file_done(path, chunk_ids)
+
+
+def run_pipeline(
+    paths: Iterable[str],
+    fetch: Callable[[str], Any],
+    split: Callable[[str, Any], List[Dict[str, Any]]],
+    embed: Callable[[List[str]], List[List[float]]],
+    upsert: Callable[[List[Dict[str, Any]], List[List[float]]], None],
+    chunk_id: Callable[[Dict[str, Any]], str],
+    on_file_done: Optional[Callable[[str, List[str]], None]] = None,
+    dedup: Optional[Callable[[str, str, str], Optional[str]]] = None,
+    fetch_workers: int = 8,
+    embed_workers: int = 1,
+    upsert_workers: int = 1,
+    batch_size: int = 100,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+) -> Dict[str, int]:
+    """Stream files through fetch -> split -> embed -> upsert with bounded queues.
+
+    Each stage runs in its own thread (fetching uses ``fetch_workers`` threads)
+    and hands work to the next through a queue of at most ``queue_size`` items,
+    so slow stages apply backpressure upstream and memory stays bounded by
+    roughly ``queue_size * batch_size`` chunks regardless of repository size.
+    Embedding overlaps with network I/O on both sides, and with
+    ``upsert_workers`` > 1 several batches are uploaded at once, so upload time
+    is no longer the sum of every batch's round trip.
+
+    Args:
+        paths: Files to ingest; consumed lazily.
+        fetch: ``fetch(path)`` returns the file content, or a falsy value to skip it.
+        split: ``split(path, content)`` returns chunk dicts with 'page_content' and 'metadata'.
+        embed: Embeds a list of chunk texts.
+        upsert: ``upsert(chunks, vectors)`` writes one batch to the vector store.
+        chunk_id: Deterministic id for a chunk; reported to ``on_file_done``.
+        on_file_done: Called as ``(path, chunk_ids)`` once every chunk of a file is upserted.
+        dedup: ``dedup(chunk_id, path, text)`` returns the id of an earlier chunk
+            this one duplicates, or None. Duplicates are dropped before embedding
+            and left out of the ids reported to ``on_file_done``.
+        fetch_workers: Number of concurrent fetches.
+        embed_workers: Number of batches embedded concurrently; only useful when
+            ``embed`` hands work to a process pool.
+        upsert_workers: Number of batches upserted concurrently; ``upsert``
+            must then be safe to call from several threads.
+        batch_size: Chunks per embed/upsert batch.
+        queue_size: Maximum items buffered between two stages.
+
+    Returns:
+        Counters for files, chunks, duplicate chunks and batches processed.
+    """
+    fetched_q: queue.Queue = queue.Queue(maxsize=queue_size * fetch_workers)
+    batch_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    embedded_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    abort = threading.Event()
+    errors: List[BaseException] = []
+    stats = {"files": 0, "skipped_files": 0, "chunks": 0, "duplicate_chunks": 0, "batches": 0}
+    stats_lock = threading.Lock()
+    finished_embedders = 0
+    tracker = _FileTracker(on_file_done)
+    path_iter = iter(paths)
+    path_lock = threading.Lock()
+
+    def put(q: queue.Queue, item: Any) -> None:
+        while True:
+            if abort.is_set():
+                raise PipelineAborted()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(q: queue.Queue) -> Any:
+        while True:
+            if abort.is_set():
+                raise PipelineAborted()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def stage(fn: Callable[[], None]) -> Callable[[], None]:
+        def run() -> None:
+            try:
+                fn()
+            except PipelineAborted:
+                pass
+            except BaseException as exc:
+                logger.exception("Ingestion pipeline stage %s failed", fn.__name__)
+                errors.append(exc)
+                abort.set()
+        return run
+
+    def fetch_stage() -> None:
+        while True:
+            with path_lock:
+                path = next(path_iter, _DONE)
+            if path is _DONE:
+                put(fetched_q, _DONE)
+                return
+            put(fetched_q, (path, fetch(path)))
+
+    def split_stage() -> None:
+        finished_fetchers = 0
+        batch: List[Tuple[str, Dict[str, Any]]] = []
+        while finished_fetchers < fetch_workers:
+            item = get(fetched_q)
+            if item is _DONE:
+                finished_fetchers += 1
+                continue
+            path, content = item
+            chunks = split(path, content) if content else []
+            stats["files"] += 1
+            if not content:
+                stats["skipped_files"] += 1
+            ids = [chunk_id(c) for c in chunks]
+            if dedup is not None:
+                kept = [(i, c) for i, c in zip(ids, chunks) if dedup(i, path, c.get("page_content", "")) is None]
+                stats["duplicate_chunks"] += len(chunks) - len(kept)
+                ids, chunks = [i for i, _ in kept], [c for _, c in kept]
+            tracker.register(path, ids)
+            for chunk in chunks:
+                batch.append((path, chunk))
+                if len(batch) >= batch_size:
+                    put(batch_q, batch)
+                    batch = []
+        if batch:
+            put(batch_q, batch)
+        put(batch_q, _DONE)
+
+    def embed_stage() -> None:
+        while True:
+            batch = get(batch_q)
+            if batch is _DONE:
+                # Leave the marker for sibling embed workers, then tell the upserter we are done.
+                put(batch_q, _DONE)
+                put(embedded_q, _DONE)
+                return
+            put(embedded_q, (batch, embed([c.get("page_content", "") for _, c in batch])))
+
+    def upsert_stage() -> None:
+        nonlocal finished_embedders
+        while True:
+            item = get(embedded_q)
+            if item is _DONE:
+                with stats_lock:
+                    finished_embedders += 1
+                    done = finished_embedders >= embed_workers
+                if done:
+                    # Every embedder has finished; pass the marker on to stop sibling upserters.
+                    put(embedded_q, _DONE)
+                    return
+                continue
+            batch, vectors = item
+            upsert([c for _, c in batch], vectors)
+            with stats_lock:
+                stats["chunks"] += len(batch)
+                stats["batches"] += 1
+            tracker.upserted(path for path, _ in batch)
+
+    threads = [threading.Thread(target=stage(fetch_stage), name=f"ingest-fetch-{i}", daemon=True) for i in range(fetch_workers)]
+    threads.append(threading.Thread(target=stage(split_stage), name="ingest-split", daemon=True))
+    threads += [threading.Thread(target=stage(upsert_stage), name=f"ingest-upsert-{i}", daemon=True) for i in range(upsert_workers)]
+    threads += [threading.Thread(target=stage(embed_stage), name=f"ingest-embed-{i}", daemon=True) for i in range(embed_workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return stats
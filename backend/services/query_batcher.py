@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Largest number of queries embedded in one forward pass; 1 disables batching.
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+# How long the first query of a batch waits for company before the batch is run.
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+
+
+class QueryBatcher:
+    """Coalesce concurrent query embeddings into batched forward passes.
+
+    Callers ``await batcher.embed(text)``. The first pending query opens a batch
+    that closes after ``max_wait_ms`` or once ``max_batch`` queries joined; the
+    batch is embedded with one ``embed_many`` call in a worker thread and every
+    caller gets its own vector back. Queries arriving while a batch is running
+    queue up for the next one, so batches grow naturally under load.
+    """
+
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], List[List[float]]],
+        max_batch: int = QUERY_BATCH_MAX,
+        max_wait_ms: float = QUERY_BATCH_WAIT_MS,
+    ):
+        self._embed_many = embed_many
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            # First use, or the app is now served from a different event loop.
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        return self._queue
+
+    async def embed(self, text: str) -> List[float]:
+        if self.max_batch <= 1:
+            loop = asyncio.get_running_loop()
+            return (await loop.run_in_executor(None, self._embed_many, [text]))[0]
+        future = asyncio.get_running_loop().create_future()
+        await self._ensure_worker().put((text, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(None, self._embed_many, texts)
+            except Exception as exc:
+                logger.exception("Batched query embedding failed for %d queries", len(texts))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
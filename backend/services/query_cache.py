@@ -0,0 +1,233 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+# Cosine similarity above which an earlier query's results are reused; > 1 disables the semantic tier.
+QUERY_SEMANTIC_THRESHOLD = float(os.getenv("QUERY_SEMANTIC_THRESHOLD", "0.97"))
+QUERY_SEMANTIC_SIZE = int(os.getenv("QUERY_SEMANTIC_SIZE", "1024"))
+# Seconds between background generation checks once a service calls ``QueryCache.watch``.
+QUERY_CACHE_GENERATION_INTERVAL = float(os.getenv("QUERY_CACHE_GENERATION_INTERVAL", "2"))
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a query: case-folded with whitespace collapsed (BGE is uncased)."""
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+class LRUCache:
+    """Thread-safe LRU map with a per-entry time-to-live and hit/miss counters."""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SemanticCache:
+    """Reuse results of an earlier query whose embedding is within a cosine threshold.
+
+    Entries are kept in a fixed-size ring of L2-normalized vectors so a lookup
+    is a single matrix-vector product.
+    """
+
+    def __init__(self, threshold: float = QUERY_SEMANTIC_THRESHOLD, maxsize: int = QUERY_SEMANTIC_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Tuple[float, Hashable, Any]]] = [None] * maxsize
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.threshold <= 1.0
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def get(self, vector: Sequence[float], params: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            sims = self._vectors @ self._unit(vector)
+            for slot in np.argsort(-sims):
+                if sims[slot] < self.threshold:
+                    break
+                entry = self._entries[slot]
+                if entry is not None and entry[1] == params and entry[0] >= now:
+                    self.hits += 1
+                    return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, vector: Sequence[float], params: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        unit = self._unit(vector)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.maxsize, len(unit)), dtype=np.float32)
+            slot = self._next
+            self._next = (self._next + 1) % self.maxsize
+            self._vectors[slot] = unit
+            self._entries[slot] = (time.monotonic() + self.ttl, params, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._entries = [None] * self.maxsize
+            self._next = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": sum(e is not None for e in self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class QueryCache:
+    """Exact-match embedding and result caches backed by a semantic near-duplicate tier.
+
+    Result tiers are dropped whenever ``generation()`` changes, i.e. after an
+    ingest run wrote to the index. Query embeddings only depend on the model
+    and survive invalidation. ``generation()`` may block (it can ask the
+    vector store), so services call ``watch`` to poll it on a background
+    thread; until then every ``get_results`` checks it inline.
+    """
+
+    def __init__(self, generation: Callable[[], Any] = lambda: None):
+        self.embeddings = LRUCache()
+        self.results = LRUCache()
+        self.semantic = SemanticCache()
+        self._generation = generation
+        self._seen_generation = generation()
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def _check_generation(self) -> None:
+        current = self._generation()
+        with self._lock:
+            if current == self._seen_generation:
+                return
+            self._seen_generation = current
+            self.invalidations += 1
+        self.results.clear()
+        self.semantic.clear()
+
+    def _watch(self, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            try:
+                self._check_generation()
+            except Exception as exc:
+                logger.warning("Query cache generation check failed: %s", exc)
+
+    def watch(self, interval: float = QUERY_CACHE_GENERATION_INTERVAL) -> None:
+        """Check the generation every ``interval`` seconds in the background instead of per lookup."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        # A fresh event per watcher, so a stopped thread that has not woken up yet stays stopped.
+        self._stop = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, args=(interval, self._stop), name="query-cache-generation", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._watcher = None
+
+    def get_embedding(self, query: str) -> Optional[List[float]]:
+        return self.embeddings.get(normalize_query(query))
+
+    def put_embedding(self, query: str, vector: List[float]) -> None:
+        self.embeddings.put(normalize_query(query), vector)
+
+    def get_results(self, query: str, params: Hashable) -> Optional[Any]:
+        if self._watcher is None:
+            self._check_generation()
+        return self.results.get((normalize_query(query), params))
+
+    def get_similar_results(self, vector: Sequence[float], params: Hashable) -> Optional[Any]:
+        return self.semantic.get(vector, params)
+
+    def put_results(self, query: str, params: Hashable, vector: Optional[Sequence[float]], value: Any) -> None:
+        """Cache ``value`` for ``query``; without a ``vector`` it skips the semantic tier."""
+        self.results.put((normalize_query(query), params), value)
+        if vector is not None:
+            self.semantic.put(vector, params, value)
+
+    def clear(self) -> None:
+        self.embeddings.clear()
+        self.results.clear()
+        self.semantic.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+            "semantic": self.semantic.stats(),
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from services.query_cache import LRUCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Small cross-encoder that rescores (query, chunk) pairs; empty disables reranking.
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched per requested result, capped at RERANK_MAX_CANDIDATES.
+RERANK_OVERSAMPLE = int(os.getenv("RERANK_OVERSAMPLE", "4"))
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", "50"))
+# Time a request waits for the rescoring pass before falling back to vector order.
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RERANK_CACHE_TTL = float(os.getenv("RERANK_CACHE_TTL", "3600"))
+# Passages are cut to this many characters; the model truncates to 512 tokens anyway.
+_MAX_PASSAGE_CHARS = 2000
+
+Pair = Tuple[str, str]
+
+
+_cross_encoder = None
+_load_lock = threading.Lock()
+
+
+def load_model():
+    """Load the cross-encoder now instead of on the first rerank (e.g. before forking workers)."""
+    global _cross_encoder
+    with _load_lock:
+        if _cross_encoder is None:
+            # Deferred so services that never rerank do not pay for the import.
+            from sentence_transformers import CrossEncoder
+
+            _cross_encoder = CrossEncoder(RERANK_MODEL, device="cpu", max_length=512)
+            logger.info("Loaded reranker model %s", RERANK_MODEL)
+    return _cross_encoder
+
+
+def _cross_encoder_scores(pairs: List[Pair]) -> List[float]:
+    model = load_model()
+    return [float(s) for s in model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+
+class Reranker:
+    """Rescore query results with a cross-encoder under a per-request time budget.
+
+    Pair scores are cached by (normalized query, chunk id, text checksum), so
+    only unseen pairs reach the model, all in one batched call on a dedicated
+    thread. If that call does not finish within the budget the caller gets None
+    and keeps its own order; the call still completes in the background and
+    fills the cache, so a repeat of the query is reranked from memory.
+    """
+
+    def __init__(
+        self,
+        score_fn: Optional[Callable[[List[Pair]], List[float]]] = None,
+        cache_size: int = RERANK_CACHE_SIZE,
+        cache_ttl: float = RERANK_CACHE_TTL,
+    ):
+        self._score_fn = score_fn or _cross_encoder_scores
+        self.cache = LRUCache(cache_size, cache_ttl)
+        # One worker: the model runs one batch at a time, and a slow batch must not pile up threads.
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+    @staticmethod
+    def _key(query: str, id_: str, text: str) -> tuple:
+        return (query, id_, zlib.crc32(text.encode("utf-8")))
+
+    def _score_and_cache(self, query: str, pending: List[Tuple[tuple, str]]) -> List[float]:
+        try:
+            scores = self._score_fn([(query, text[:_MAX_PASSAGE_CHARS]) for _, text in pending])
+            for (key, _), score in zip(pending, scores):
+                self.cache.put(key, score)
+            return scores
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def scores(self, query: str, candidates: Sequence[Tuple[str, str]], budget_ms: float = RERANK_BUDGET_MS) -> Optional[List[float]]:
+        """Relevance scores for ``(id, text)`` candidates, or None if the budget ran out."""
+        deadline = time.perf_counter() + budget_ms / 1000
+        normalized = normalize_query(query)
+        keys = [self._key(normalized, id_, text) for id_, text in candidates]
+        found = [self.cache.get(key) for key in keys]
+        pending = [(key, text) for key, (_, text), score in zip(keys, candidates, found) if score is None]
+        if pending:
+            with self._lock:
+                # A batch still running past its budget plus one queued behind it is as much backlog as is useful.
+                if self._inflight >= 2:
+                    self.skipped += 1
+                    return None
+                self._inflight += 1
+            future = self._pool.submit(self._score_and_cache, query, pending)
+            try:
+                fresh = iter(future.result(timeout=max(0.0, deadline - time.perf_counter())))
+            except FutureTimeout:
+                with self._lock:
+                    self.timeouts += 1
+                logger.info("Reranking %d pairs exceeded the %.0f ms budget", len(pending), budget_ms)
+                return None
+            except Exception as exc:
+                logger.warning("Reranking failed, keeping vector order: %s", exc)
+                return None
+            found = [score if score is not None else next(fresh) for score in found]
+        return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            timeouts, skipped = self.timeouts, self.skipped
+        return {"cache": self.cache.stats(), "timeouts": timeouts, "skipped": skipped}
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+def candidate_count(top_k: int) -> int:
+    """Number of vector matches to fetch so reranking has something to choose from."""
+    return max(top_k, min(top_k * RERANK_OVERSAMPLE, RERANK_MAX_CANDIDATES))
@@ -1,12 +1,63 @@
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
+from services.chunk_store import open_chunk_store
 from services.embedding_service import embed_query
-from pinecone import Pinecone
+from vectorstore.base import VectorStore, build_filter
+from vectorstore.pinecone import INDEX_NAME, PineconeStore
+from vectorstore import store as vs_store
 
-def search_relevant_documents(query: str, top_k: int = 5, pinecone_client=None) -> List[Dict[str, Any]]:
-    query_embedding = embed_query(query)
-    query_results = pinecone_client.query(
-        vector=query_embedding,
+# One store per Pinecone Index object or index name, reused across searches like the query services' INDEX.
+_stores: Dict[Tuple[str, Any], VectorStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _store_for(pinecone_client, index_name: str) -> VectorStore:
+    """Use ``pinecone_client`` if it already is a VectorStore, else the cached store wrapping it (or ``index_name``)."""
+    if isinstance(pinecone_client, VectorStore):
+        return pinecone_client
+    if pinecone_client is None and vs_store.VECTOR_BACKEND == "local":
+        # open_store already shares local stores per path.
+        return vs_store.open_store(None, index_name)
+    # The store keeps a reference to the Index, so its id() is not reused while cached.
+    key = ("index", id(pinecone_client)) if pinecone_client is not None else ("name", index_name)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = PineconeStore(pinecone_client) if pinecone_client is not None else vs_store.open_store(None, index_name)
+            _stores[key] = store
+    return store
+
+
+def search_relevant_documents(
+    query: str,
+    top_k: int = 5,
+    pinecone_client=None,
+    index_name: str = INDEX_NAME,
+    repo: Union[str, Sequence[str], None] = None,
+    file_type: Union[str, Sequence[str], None] = None,
+    path_prefix: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Embed ``query`` and return the best matching chunks.
+
+    ``pinecone_client`` is a Pinecone Index (queried directly, as before) or
+    any VectorStore; when None, the configured backend's store for
+    ``index_name`` is opened once and reused. Ingest writes each repository
+    into its own namespace, so ``repo`` picks the namespaces to search (all
+    of them when None); ``file_type`` and ``path_prefix`` are pushed into the
+    search as a metadata filter, as in the query services. Each match carries
+    its chunk text under ``text``.
+    """
+    store = _store_for(pinecone_client, index_name)
+    query_results = store.query(
+        embed_query(query),
         top_k=top_k,
-        include_metadata=True
+        include_metadata=True,
+        namespace=repo,
+        filter=build_filter(file_type, path_prefix),
     )
-    return query_results["matches"]
\ No newline at end of file
+    matches = query_results["matches"]
+    chunk_store = open_chunk_store(index_name)
+    texts = chunk_store.get_many([m["id"] for m in matches]) if chunk_store is not None and matches else {}
+    for m in matches:
+        m["text"] = texts.get(m["id"]) or m.get("text") or (m.get("metadata") or {}).get("text")
+    return matches
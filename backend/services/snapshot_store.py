@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed copies of every ingested file. Empty disables snapshots.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(".gitsense", "snapshots"))
+# Number of memory-mapped files kept open for repeated reads.
+SNAPSHOT_CACHE_FILES = int(os.getenv("SNAPSHOT_CACHE_FILES", "256"))
+
+_SHA = re.compile(r"[0-9a-f]{40,64}")
+
+_stores: Dict[str, "SnapshotStore"] = {}
+_stores_lock = threading.Lock()
+
+
+def blob_sha(content: Union[str, bytes]) -> str:
+    """Git blob id of ``content`` — the same SHA GitHub reports for the file in the tree."""
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class SnapshotStore:
+    """Local, content-addressed store of file contents keyed by git blob SHA.
+
+    Ingest writes each file once (identical files across paths and repos share
+    one object); the query service reads whole files or character ranges via
+    ``mmap``, keeping the most recently used maps open in an LRU.
+    """
+
+    def __init__(self, root: str, cache_files: int = SNAPSHOT_CACHE_FILES):
+        self.root = root
+        self.cache_files = cache_files
+        self._lock = threading.Lock()
+        # sha -> (mmap, is_ascii); ASCII files can be sliced by byte offset without decoding.
+        self._open: "OrderedDict[str, Tuple[mmap.mmap, bool]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha[2:])
+
+    def put(self, content: str, sha: Optional[str] = None) -> str:
+        """Store ``content`` under ``sha`` (its blob SHA by default) unless it is already present."""
+        sha = sha or blob_sha(content)
+        path = self._path(sha)
+        if os.path.exists(path):
+            return sha
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(content.encode("utf-8"))
+        os.replace(tmp, path)
+        return sha
+
+    def _map(self, sha: str) -> Optional[Tuple[mmap.mmap, bool]]:
+        # Called with the lock held so a map is never closed by eviction while being read.
+        entry = self._open.get(sha)
+        if entry is not None:
+            self._open.move_to_end(sha)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        try:
+            with open(self._path(sha), "rb") as fh:
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Empty files cannot be memory-mapped.
+            return None
+        entry = (mapped, mapped[:].isascii())
+        self._open[sha] = entry
+        while len(self._open) > self.cache_files:
+            _, (old, _) = self._open.popitem(last=False)
+            old.close()
+        return entry
+
+    def read(self, sha: str, start: Optional[int] = None, end: Optional[int] = None) -> Optional[str]:
+        """Return the file's text, or the ``[start, end)`` character range of it; None if unknown."""
+        if not _SHA.fullmatch(sha):
+            return None
+        with self._lock:
+            entry = self._map(sha)
+            if entry is None:
+                return "" if os.path.exists(self._path(sha)) else None
+            mapped, is_ascii = entry
+            if is_ascii:
+                return mapped[start:end].decode("ascii")
+            data = mapped[:]
+        return data.decode("utf-8")[start:end]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "open_files": len(self._open)}
+
+    def close(self) -> None:
+        with self._lock:
+            for mapped, _ in self._open.values():
+                mapped.close()
+            self._open.clear()
+
+
+def open_snapshot_store() -> Optional[SnapshotStore]:
+    """Return the shared snapshot store, or None if SNAPSHOT_DIR is empty."""
+    if not SNAPSHOT_DIR:
+        return None
+    with _stores_lock:
+        store = _stores.get(SNAPSHOT_DIR)
+        if store is None:
+            store = SnapshotStore(SNAPSHOT_DIR)
+            _stores[SNAPSHOT_DIR] = store
+    return store
@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from services.metrics import FIRST_QUERY_SECONDS, SERVICE_READY, STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Load and exercise the models during startup instead of on the first request.
+QUERY_WARMUP = os.getenv("QUERY_WARMUP", "true").lower() not in ("0", "false", "no")
+
+# Measured from the first import of this module, which the query services do at the top.
+_IMPORTED_AT = time.perf_counter()
+
+
+class Warmup:
+    """Startup warm-up steps and readiness of one query service process.
+
+    ``run`` executes named steps (model load, a throwaway forward pass, opening
+    the index, ...) in order, records each one's duration in
+    ``gitsense_startup_seconds`` and only then marks the service ready. A step
+    that fails is logged and leaves the service not ready.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.ready = False
+        self.error: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self._first_query = True
+        self._lock = threading.Lock()
+        SERVICE_READY.labels(service=service).set(0)
+
+    def run(self, steps: Dict[str, Callable[[], object]]) -> bool:
+        for stage, step in steps.items():
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as exc:
+                logger.exception("%s warm-up step '%s' failed", self.service, stage)
+                self.error = f"{stage}: {exc}"
+                return False
+            self.stages[stage] = time.perf_counter() - start
+            STARTUP_SECONDS.labels(service=self.service, stage=stage).set(self.stages[stage])
+        self.stages["total"] = time.perf_counter() - _IMPORTED_AT
+        STARTUP_SECONDS.labels(service=self.service, stage="total").set(self.stages["total"])
+        self.ready = True
+        SERVICE_READY.labels(service=self.service).set(1)
+        logger.info(
+            "%s ready in %.2fs (%s)",
+            self.service,
+            self.stages["total"],
+            ", ".join(f"{k}={v:.2f}s" for k, v in self.stages.items() if k != "total"),
+        )
+        return True
+
+    def observe_query(self, seconds: float) -> None:
+        """Record the latency of the first query this process served."""
+        if not self._first_query:
+            return
+        with self._lock:
+            if not self._first_query:
+                return
+            self._first_query = False
+        FIRST_QUERY_SECONDS.labels(service=self.service).set(seconds)
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "startup_seconds": {k: round(v, 3) for k, v in self.stages.items()},
+        }
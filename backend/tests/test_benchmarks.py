@@ -0,0 +1,22 @@
+from benchmarks.run import percentiles, run_benchmarks, synthetic_repo
+
+
+def test_synthetic_repo_is_deterministic_with_vendored_copies():
+    repo = synthetic_repo(20, duplicate_ratio=0.25)
+    assert repo == synthetic_repo(20, duplicate_ratio=0.25)
+    assert len(repo) == 20
+    vendored = [p for p in repo if p.startswith("vendor/")]
+    assert len(vendored) == 5
+    assert all(repo[p] == repo[p.split("/", 2)[2]] for p in vendored)
+
+
+def test_benchmark_report_covers_every_stage():
+    report = run_benchmarks(files=12, lines_per_file=20, queries=5)
+    stages = report["stages"]
+    assert set(stages) == {"file_type_chunk", "embed", "embed_and_upsert", "load_and_chunk", "query"}
+    assert stages["embed"]["embeds_per_sec"] > 0
+    assert stages["load_and_chunk"]["duplicate_chunks"] > 0
+    assert stages["query"]["index_size"] == stages["load_and_chunk"]["chunks"]
+    assert stages["query"]["p50_ms"] <= stages["query"]["p99_ms"]
+    assert report["peak_rss_mb"] > 0
+    assert percentiles([1, 2, 3, 4])["p50_ms"] == 2.5
@@ -0,0 +1,52 @@
+from services.chunking_service import chunk_spans, chunk_text, file_type_chunk
+
+COBOL = (
+    "       IDENTIFICATION DIVISION.\n"
+    "       PROGRAM-ID. COCRDUPC.\n"
+    "MAIN-PARA.\n"
+    "           PERFORM READ-CARD.\n"
+    "           PERFORM UPDATE-CARD.\n"
+    "READ-CARD.\n"
+    "           READ CARD-FILE.\n"
+    "UPDATE-CARD.\n"
+    "           REWRITE CARD-RECORD.\n"
+)
+
+
+def test_spans_split_at_paragraphs_and_trim_whitespace():
+    spans = chunk_spans(COBOL, "cobol", overlap=0)
+    texts = [COBOL[s:e] for s, e in spans]
+    assert len(texts) == 4
+    assert texts[0].startswith("IDENTIFICATION DIVISION.")
+    assert texts[2] == "READ-CARD.\n           READ CARD-FILE."
+    assert all(t == t.strip() for t in texts)
+
+
+def test_overlap_length_is_constant_across_chunks():
+    text = "\n\n".join(("para%d " % i) * 20 for i in range(5))
+    no_overlap = chunk_spans(text, "text", overlap=0)
+    with_overlap = chunk_spans(text, "text", overlap=30)
+
+    assert with_overlap[0] == no_overlap[0]
+    for (prev_start, prev_end), (start, _), (piece_start, _) in zip(no_overlap, with_overlap[1:], no_overlap[1:]):
+        assert start == prev_end - 30
+        assert text[start:prev_end] == text[prev_end - 30 : prev_end]
+        assert piece_start > start
+    assert chunk_text({"text": text}, "text", 30)[1] == text[with_overlap[1][0] : with_overlap[1][1]]
+
+
+def test_file_type_chunk_offsets_feed_metadata():
+    docs = [
+        {"text": COBOL, "metadata": {"file_type": "cobol", "file_name": "COCRDUPC.cbl"}},
+        {"text": "ignored", "metadata": {"file_type": "unknown"}},
+    ]
+    chunks = file_type_chunk(docs, overlap=10)
+
+    assert len(chunks) == 4
+    for i, chunk in enumerate(chunks):
+        meta = chunk["metadata"]
+        assert meta["chunk_index"] == i
+        assert chunk["text"] == COBOL[meta["start_index"] : meta["end_index"]]
+        assert chunk["page_content"] == chunk["text"]
+        assert meta["file_name"] == "COCRDUPC.cbl"
+    assert dict(chunks[0])["text"] == chunks[0].text
@@ -0,0 +1,20 @@
+from services.dedup import Deduplicator
+
+BASE = " ".join(f"MOVE WS-FIELD-{i} TO OUT-FIELD-{i}." for i in range(40))
+
+
+def test_exact_and_near_duplicates_fold_into_first_chunk():
+    dedup = Deduplicator()
+    assert dedup.check("a", "src/a.cbl", BASE) is None
+    assert dedup.check("b", "vendor/a.cbl", "  " + BASE.replace(" ", "\n    ")) == "a"
+    assert dedup.check("c", "src/c.cbl", BASE.replace("WS-FIELD-7 ", "WS-FIELD-X ")) == "a"
+    assert dedup.check("d", "src/d.cbl", "PERFORM READ-CARD UNTIL END-OF-FILE. " * 3 + BASE[:200]) is None
+    assert dedup.exact_hits == 1 and dedup.near_hits == 1
+    assert dedup.references["src/c.cbl"] == {"a"}
+    assert dedup.duplicate_metadata() == {"a": {"duplicate_paths": ["vendor/a.cbl", "src/c.cbl"], "duplicate_count": 2}}
+
+
+def test_rechecking_the_same_chunk_is_not_a_duplicate():
+    dedup = Deduplicator()
+    assert dedup.check("a", "src/a.cbl", BASE) is None
+    assert dedup.check("a", "src/a.cbl", BASE) is None
@@ -0,0 +1,57 @@
+import pytest
+
+import services.embedding_service as emb
+from services.embedding_cache import EmbeddingCache, cache_key
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0, 0.5] for t in texts]
+
+
+def test_get_put_and_counters(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    k1 = cache_key("model", "prefix: ", "hello")
+    k2 = cache_key("model", "prefix: ", "world")
+    assert k1 != cache_key("other-model", "prefix: ", "hello")
+
+    assert cache.get_many([k1, k2]) == [None, None]
+    cache.put_many([(k1, [0.25, 0.5])])
+    assert cache.get_many([k1, k2]) == [[0.25, 0.5], None]
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 1)
+    assert stats["bytes"] == 8
+
+
+def test_lru_eviction(tmp_path):
+    # Room for four 4-float vectors.
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=64)
+    keys = [cache_key("m", "", str(i)) for i in range(5)]
+    cache.put_many([(keys[0], [0.0] * 4)])
+    for k in keys[1:4]:
+        cache.put_many([(k, [1.0] * 4)])
+    cache.get_many([keys[0]])  # key 0 is now the most recently used
+    cache.put_many([(keys[4], [2.0] * 4)])
+
+    assert cache.stats()["evictions"] >= 1
+    assert cache.stats()["bytes"] <= 64
+    assert cache.get_many([keys[0]])[0] is not None
+    assert cache.get_many([keys[1]])[0] is None
+
+
+def test_embed_only_runs_model_on_misses(tmp_path, monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(emb, "_cache", EmbeddingCache(str(tmp_path / "cache.sqlite")))
+    monkeypatch.setattr(emb, "_model", lambda: model)
+
+    first = emb.embed(["a", "bb", "a"])
+    assert model.calls == [["a", "bb"]]
+    second = emb.embed(["bb", "ccc", "a"])
+    assert model.calls[-1] == ["ccc"]
+    assert second[0] == first[1]
+    assert second[2] == pytest.approx(first[0])
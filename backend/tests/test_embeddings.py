@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import services.embedding_service as emb
+from services.onnx_embeddings import recall_parity
+
+
+class VectorTable:
+    """Embeddings stand-in that looks vectors up by text."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def embed_documents(self, texts):
+        return [self.table[t] for t in texts]
+
+    def embed_query(self, text):
+        return self.table[text]
+
+
+def test_recall_parity_identical_and_perturbed_backends():
+    rng = np.random.default_rng(0)
+    texts = [f"doc {i}" for i in range(40)] + ["q1", "q2", "q3"]
+    table = {t: rng.normal(size=16).tolist() for t in texts}
+    corpus, queries = texts[:40], texts[40:]
+
+    same = recall_parity(VectorTable(table), VectorTable(table), corpus, queries, k=5)
+    assert same["recall@5"] == 1.0
+    assert same["mean_cosine"] == pytest.approx(1.0)
+
+    noisy = {t: (np.asarray(v) + rng.normal(scale=0.5, size=16)).tolist() for t, v in table.items()}
+    drifted = recall_parity(VectorTable(table), VectorTable(noisy), corpus, queries, k=5)
+    assert drifted["recall@5"] < 1.0
+    assert drifted["min_cosine"] < 1.0
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        emb.BGEEmbeddings(backend="tpu")
+
+
+def test_token_budget_batches_group_similar_lengths():
+    lengths = [10, 500, 12, 480, 11, 9, 300]
+    batches = emb.token_budget_batches(lengths, token_budget=1000, max_batch=3)
+
+    assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 1000
+    assert batches[0] == [1, 3]
+    assert emb.token_budget_batches([900], token_budget=100) == [[0]]
+
+
+def test_embed_restores_input_order(monkeypatch):
+    class LengthModel:
+        def __init__(self):
+            self.batches = []
+
+        def embed_documents(self, texts):
+            self.batches.append(list(texts))
+            return [[float(len(t))] for t in texts]
+
+    model = LengthModel()
+    monkeypatch.setattr(emb, "_model", lambda: model)
+    monkeypatch.setattr(emb, "EMBEDDING_CACHE_PATH", "")
+    monkeypatch.setattr(emb, "_cache", None)
+    monkeypatch.setattr(emb, "EMBED_TOKEN_BUDGET", 200)
+    texts = ["x" * 400, "y", "z" * 40, "w" * 390, "v" * 5]
+
+    assert emb.embed(texts) == [[float(len(t))] for t in texts]
+    assert model.batches[0] == ["x" * 400]
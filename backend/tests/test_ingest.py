@@ -0,0 +1,509 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+import api.routes.ingest as ingest
+import services.chunk_store as chunk_store
+import services.embedding_service as emb
+import services.lexical_index as lexical_index
+import services.manifest as manifest
+import services.snapshot_store as snapshot_store
+import vectorstore.store as vs_store
+
+REPO_FILES = {}
+FETCHED = []
+
+
+class FakeLoader:
+    github_api_url = "https://api.github.com"
+    branch = "main"
+
+    def __init__(self, repo, access_token=None, file_filter=None):
+        self.repo = repo
+        self.file_filter = file_filter
+
+    def get_file_paths(self):
+        return [
+            {"path": p, "sha": hashlib.sha1(c.encode()).hexdigest(), "type": "blob"}
+            for p, c in REPO_FILES.items()
+            if self.file_filter(p)
+        ]
+
+    def get_file_content_by_path(self, path):
+        FETCHED.append(path)
+        return REPO_FILES[path]
+
+
+class FakeModel:
+    def embed_documents(self, texts):
+        rng = [np.random.default_rng(int(hashlib.md5(t.encode()).hexdigest()[:8], 16)) for t in texts]
+        return [r.normal(size=768).tolist() for r in rng]
+
+
+@pytest.fixture
+def local_env(tmp_path, monkeypatch):
+    REPO_FILES.clear()
+    FETCHED.clear()
+    monkeypatch.setattr(ingest, "GithubFileLoader", FakeLoader)
+    monkeypatch.setattr(emb, "_model", lambda: FakeModel())
+    monkeypatch.setattr(emb, "EMBEDDING_CACHE_PATH", "")
+    monkeypatch.setattr(manifest, "INGEST_STATE_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setattr(chunk_store, "CHUNK_STORE_DIR", str(tmp_path / "chunks"))
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setattr(snapshot_store, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    monkeypatch.setattr(vs_store, "VECTOR_BACKEND", "local")
+    monkeypatch.setattr(vs_store, "LOCAL_INDEX_DIR", str(tmp_path / "index"))
+    monkeypatch.setattr(vs_store, "INDEX_GENERATION_DIR", str(tmp_path / "generations"))
+    return vs_store.open_store(None, "test-index")
+
+
+def _paths(store):
+    resp = store.query([1.0] * 768, top_k=1000)
+    return sorted(m["metadata"]["path"] for m in resp["matches"])
+
+
+def test_reingest_only_touches_changed_files(local_env):
+    config = {"repo": "acme/widgets", "extensions": [".md", ".ts"]}
+    REPO_FILES.update({
+        "README.md": "# Widgets\n\nA library of widgets.",
+        "src/a.ts": "export const a = 1;",
+        "src/b.ts": "export const b = 2;",
+        "LICENSE.md": "MIT",
+    })
+    ingest.load_and_chunk(config, None, "test-index")
+    assert sorted(FETCHED) == ["README.md", "src/a.ts", "src/b.ts"]
+    assert _paths(local_env) == ["README.md", "src/a.ts", "src/b.ts"]
+    readme = next(m["metadata"] for m in local_env.query([1.0] * 768, top_k=10)["matches"] if m["metadata"]["path"] == "README.md")
+    snapshots = snapshot_store.open_snapshot_store()
+    assert snapshots.read(readme["sha"]) == REPO_FILES["README.md"]
+    assert snapshots.read(readme["sha"], readme["start_index"], readme["end_index"]) == REPO_FILES["README.md"]
+
+    FETCHED.clear()
+    ingest.load_and_chunk(config, None, "test-index")
+    assert FETCHED == []
+
+    REPO_FILES["src/a.ts"] = "export const a = 42;"
+    del REPO_FILES["src/b.ts"]
+    REPO_FILES["src/c.ts"] = "export const c = 3;"
+    ingest.load_and_chunk(config, None, "test-index")
+    assert sorted(FETCHED) == ["src/a.ts", "src/c.ts"]
+    assert _paths(local_env) == ["README.md", "src/a.ts", "src/c.ts"]
+    a = [m for m in local_env.query([1.0] * 768, top_k=10)["matches"] if m["metadata"]["path"] == "src/a.ts"]
+    # Texts live in the chunk store; vector metadata stays slim.
+    assert all("text" not in m["metadata"] for m in a)
+    texts = chunk_store.open_chunk_store("test-index").get_many([m["id"] for m in a])
+    assert list(texts.values()) == ["export const a = 42;"]
+    removed = [emb.make_chunk_id({"metadata": {"repo_id": "acme/widgets", "path": "src/b.ts", "start_index": 0}})]
+    assert chunk_store.open_chunk_store("test-index").get_many(removed) == {}
+    # The lexical index follows the same adds and deletes.
+    lexical = lexical_index.open_lexical_index("test-index")
+    assert sorted(m["metadata"]["path"] for m in lexical.search("const", namespace="acme/widgets")) == ["src/a.ts", "src/c.ts"]
+    assert lexical.search("const", namespace="other/repo") == []
+
+
+def test_pinecone_vectors_keep_text_in_metadata_unless_slim(local_env, monkeypatch):
+    # Another host reading the shared Pinecone index has no copy of the local chunk store.
+    monkeypatch.setattr(vs_store, "VECTOR_BACKEND", "pinecone")
+    monkeypatch.setattr(vs_store, "open_store", lambda client, name: local_env)
+    monkeypatch.setattr(local_env, "close", lambda: None)
+    config = {"repo": "acme/widgets", "extensions": [".ts"]}
+    REPO_FILES.update({"src/a.ts": "export const a = 1;", "src/b.ts": "export const b = 2;"})
+    ingest.load_and_chunk(config, None, "test-index")
+    metadata = {m["metadata"]["path"]: m["metadata"] for m in local_env.query([1.0] * 768, top_k=10)["matches"]}
+    assert metadata["src/a.ts"]["text"] == "export const a = 1;"
+
+    monkeypatch.setattr(vs_store, "PINECONE_SLIM_METADATA", True)
+    REPO_FILES["src/b.ts"] = "export const b = 3;"
+    ingest.load_and_chunk(config, None, "test-index")
+    matches = {m["metadata"]["path"]: m for m in local_env.query([1.0] * 768, top_k=10)["matches"]}
+    assert "text" not in matches["src/b.ts"]["metadata"]
+    assert chunk_store.open_chunk_store("test-index").get_many([matches["src/b.ts"]["id"]]) == {matches["src/b.ts"]["id"]: "export const b = 3;"}
+
+
+def test_duplicate_chunks_share_one_vector(local_env):
+    config = {"repo": "acme/widgets", "extensions": [".ts"]}
+    body = "export function parseWidget(input) { return input.split(',').map(Number).filter(Boolean); }"
+    REPO_FILES.update({
+        "src/parse.ts": body,
+        "vendor/parse.ts": body,
+        "src/other.ts": "export const unrelated = 'something else entirely';",
+    })
+    stats = ingest.load_and_chunk(config, None, "test-index")
+    assert stats["duplicate_chunks"] == 1
+    assert {"list_files", "fetch", "split", "dedup", "embed", "upsert", "total"} <= set(stats["stage_seconds"])
+    matches = local_env.query([1.0] * 768, top_k=10)["matches"]
+    assert len(matches) == 2
+    canonical = next(m for m in matches if m["metadata"]["path"].endswith("parse.ts"))
+    copy = "vendor/parse.ts" if canonical["metadata"]["path"] == "src/parse.ts" else "src/parse.ts"
+    assert canonical["metadata"]["duplicate_paths"] == [copy]
+
+    # Deleting the canonical file keeps the vector until the copy has been re-ingested.
+    del REPO_FILES[canonical["metadata"]["path"]]
+    ingest.load_and_chunk(config, None, "test-index")
+    assert canonical["id"] in {m["id"] for m in local_env.query([1.0] * 768, top_k=10)["matches"]}
+
+    FETCHED.clear()
+    ingest.load_and_chunk(config, None, "test-index")
+    assert FETCHED == [copy]
+    assert _paths(local_env) == sorted([copy, "src/other.ts"])
+
+
+def test_duplicate_paths_accumulate_across_incremental_runs(local_env, monkeypatch):
+    import time
+
+    config = {"repo": "acme/widgets", "extensions": [".ts"]}
+    body = "export function parseWidget(input) { return input.split(',').map(Number).filter(Boolean); }"
+    REPO_FILES.update({"src/parse.ts": body, "vendor/parse.ts": body})
+    ingest.load_and_chunk(config, None, "test-index")
+    canonical = local_env.query([1.0] * 768, top_k=10)["matches"][0]
+    owner = canonical["metadata"]["path"]
+    copy = "vendor/parse.ts" if owner == "src/parse.ts" else "src/parse.ts"
+
+    def duplicate_paths():
+        metadata = next(m["metadata"] for m in local_env.query([1.0] * 768, top_k=10)["matches"] if m["id"] == canonical["id"])
+        return sorted(metadata["duplicate_paths"]), metadata["duplicate_count"]
+
+    # The canonical file is re-ingested next to a new copy; the copy from the first run is kept.
+    fetch = FakeLoader.get_file_content_by_path
+
+    def owner_first(self, path):
+        if path != owner:
+            time.sleep(0.2)
+        return fetch(self, path)
+
+    monkeypatch.setattr(FakeLoader, "get_file_content_by_path", owner_first)
+    REPO_FILES[owner] = body + "\n"
+    REPO_FILES["lib/parse.ts"] = body
+    ingest.load_and_chunk(config, None, "test-index")
+    assert duplicate_paths() == (sorted([copy, "lib/parse.ts"]), 2)
+
+    # A copy that changes is dropped from the list even though the canonical was not re-ingested.
+    REPO_FILES[copy] = "export const vendored = 'now something different entirely';"
+    ingest.load_and_chunk(config, None, "test-index")
+    assert duplicate_paths() == (["lib/parse.ts"], 1)
+
+
+def test_local_checkout_and_tarball_share_github_rules(local_env, tmp_path):
+    import tarfile
+
+    from services.snapshot_store import blob_sha
+
+    checkout = tmp_path / "widgets"
+    files = {
+        "README.md": "# Widgets\n\nA library of widgets.",
+        "src/a.ts": "export const a = 1;",
+        "docs/guide.md": "# Guide\n\nUse widgets.",
+        "LICENSE.md": "MIT",
+        "src/logo.png": "not text",
+        ".git/config": "[core]",
+    }
+    for path, content in files.items():
+        (checkout / path).parent.mkdir(parents=True, exist_ok=True)
+        (checkout / path).write_text(content)
+
+    config = {"repo": "acme/widgets", "path": str(checkout), "extensions": [".md", ".ts"]}
+    stats = ingest.load_and_chunk(config, None, "test-index")
+    assert stats["files"] == 3 and FETCHED == []
+    matches = local_env.query([1.0] * 768, top_k=10)["matches"]
+    importance = {m["metadata"]["path"]: m["metadata"]["importance"] for m in matches}
+    assert importance == {"README.md": 1.2, "docs/guide.md": 1.1, "src/a.ts": 1.0}
+    saved = manifest.RepoManifest.load("acme/widgets", "test-index")
+    assert saved.files["src/a.ts"]["sha"] == blob_sha(files["src/a.ts"])
+
+    tarball = tmp_path / "widgets.tar.gz"
+    with tarfile.open(tarball, "w:gz") as tar:
+        tar.add(checkout, arcname="acme-widgets-1a2b3c")
+    ingest.load_and_chunk({**config, "path": str(tarball)}, None, "tar-index")
+    tar_store = vs_store.open_store(None, "tar-index")
+    assert sorted(m["id"] for m in tar_store.query([1.0] * 768, top_k=10)["matches"]) == sorted(m["id"] for m in matches)
+
+
+def test_chunk_ids_are_deterministic():
+    doc = {"metadata": {"repo_id": "acme/widgets", "path": "src/a.ts", "start_index": 500}}
+    assert emb.make_chunk_id(doc) == emb.make_chunk_id(dict(doc))
+    other_repo = {"metadata": {**doc["metadata"], "repo_id": "acme/gadgets"}}
+    assert emb.make_chunk_id(doc) != emb.make_chunk_id(other_repo)
+
+
+def test_pipeline_reports_files_and_propagates_errors():
+    from services.pipeline import run_pipeline
+
+    done = {}
+    stats = run_pipeline(
+        [f"f{i}" for i in range(25)],
+        fetch=lambda p: "" if p == "f3" else p * 3,
+        split=lambda p, c: [{"page_content": c[i : i + 2], "metadata": {"path": p, "start_index": i}} for i in range(0, len(c), 2)],
+        embed=lambda texts: [[0.0] for _ in texts],
+        upsert=lambda chunks, vectors: None,
+        chunk_id=lambda c: f"{c['metadata']['path']}:{c['metadata']['start_index']}",
+        on_file_done=lambda p, ids: done.setdefault(p, ids),
+        fetch_workers=3,
+        batch_size=7,
+        queue_size=1,
+    )
+    assert len(done) == 25 and done["f3"] == []
+    assert done["f12"] == ["f12:0", "f12:2", "f12:4", "f12:6", "f12:8"]
+    assert stats["skipped_files"] == 1
+
+    def broken_embed(texts):
+        raise RuntimeError("model crashed")
+
+    with pytest.raises(RuntimeError, match="model crashed"):
+        run_pipeline(["a", "b"], fetch=str, split=lambda p, c: [{"page_content": c}], embed=broken_embed,
+                     upsert=lambda chunks, vectors: None, chunk_id=lambda c: c["page_content"])
+
+
+def test_scheduler_isolates_failing_repos(monkeypatch):
+    from api.routes import scheduler
+
+    def fake_load_and_chunk(repo_config, client, index_name, **kwargs):
+        if repo_config["repo"] == "acme/broken":
+            raise RuntimeError("rate limited")
+        kwargs["progress"](1, 1)
+        return {"files": 1, "skipped_files": 0, "chunks": 3, "batches": 1}
+
+    monkeypatch.setattr(ingest, "load_and_chunk", fake_load_and_chunk)
+    results = scheduler.run_ingestion(
+        [{"repo": "acme/a"}, {"repo": "acme/broken"}, {"repo": "acme/b"}], None, "test-index", processes=1
+    )
+    assert [r["repo"] for r in results] == ["acme/a", "acme/broken", "acme/b"]
+    assert [r["status"] for r in results] == ["ok", "failed", "ok"]
+    assert results[1]["error"] == "rate limited"
+    assert results[2]["chunks"] == 3
+
+
+def _fake_ingest_ok(repo_config, client, index_name, **kwargs):
+    return {"files": 1, "skipped_files": 0, "chunks": 2, "batches": 1}
+
+
+def test_scheduler_names_path_only_configs_like_ingest(monkeypatch):
+    from api.routes import scheduler
+
+    monkeypatch.setattr(ingest, "load_and_chunk", _fake_ingest_ok)
+    results = scheduler.run_ingestion([{"path": "/src/checkouts/widgets/"}, {"repo": "acme/b"}], None, "test-index", processes=1)
+    assert [(r["repo"], r["status"]) for r in results] == [("widgets", "ok"), ("acme/b", "ok")]
+
+
+def test_scheduler_reports_malformed_configs_as_failed(monkeypatch):
+    from api.routes import scheduler
+
+    monkeypatch.setattr(ingest, "load_and_chunk", _fake_ingest_ok)
+    results = scheduler.run_ingestion([{"extensions": [".ts"]}, {"repo": "acme/b"}], None, "test-index", processes=1)
+    assert [(r["repo"], r["status"]) for r in results] == [("<unnamed>", "failed"), ("acme/b", "ok")]
+    assert results[0]["error"] == "'path'"
+
+
+def test_concurrent_upserts_split_by_payload_and_retry_throttling(monkeypatch):
+    import threading
+    import time
+
+    import vectorstore.pinecone as vp
+    from services.pipeline import run_pipeline
+
+    class Throttled(Exception):
+        status = 429
+        headers = {"Retry-After": "0"}
+
+    class FakeIndex:
+        def __init__(self):
+            self.requests, self.active, self.peak = [], 0, 0
+            self.lock = threading.Lock()
+            self.throttle = 2
+
+        def upsert(self, vectors, namespace=""):
+            with self.lock:
+                if self.throttle:
+                    self.throttle -= 1
+                    raise Throttled("too many requests")
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            time.sleep(0.02)
+            with self.lock:
+                self.active -= 1
+                self.requests.append([r[0] for r in vectors])
+            return {"upserted_count": len(vectors)}
+
+    monkeypatch.setattr(vp, "PINECONE_RETRY_BASE_SECONDS", 0.001)
+    index = FakeIndex()
+    records = [(f"id-{i:02d}", [0.0] * 768, {"path": f"src/{i:02d}.ts"}) for i in range(40)]
+    per_record = vp._record_bytes(records[0])
+    assert [len(b) for b in vp.payload_batches(records, max_bytes=per_record * 10)] == [10, 10, 10, 10]
+    assert vp.payload_batches(records, max_bytes=10**9, max_vectors=15)[0] == records[:15]
+
+    # One call is split into four requests that run three at a time; the two throttled ones are retried.
+    store = vp.PineconeStore(index, upsert_workers=3, max_request_bytes=per_record * 10)
+    assert store.upsert(records)["upserted_count"] == 40
+    assert sorted(len(r) for r in index.requests) == [10, 10, 10, 10]
+    assert index.throttle == 0 and index.peak > 1
+    index.requests.clear()
+
+    def upsert(chunks, vectors):
+        ids = [c["metadata"]["id"] for c in chunks]
+        assert store.upsert([r for r in records if r[0] in ids])["upserted_count"] == len(ids)
+
+    done = {}
+    stats = run_pipeline(
+        [f"f{i}" for i in range(4)],
+        fetch=lambda p: p,
+        split=lambda p, c: [{"page_content": c, "metadata": {"id": f"id-{int(p[1:]) * 10 + j:02d}"}} for j in range(10)],
+        embed=lambda texts: [[0.0] for _ in texts],
+        upsert=upsert,
+        chunk_id=lambda c: c["metadata"]["id"],
+        on_file_done=lambda p, ids: done.setdefault(p, ids),
+        batch_size=5,
+        upsert_workers=3,
+    )
+    assert stats["chunks"] == 40 and len(done) == 4
+    assert sorted(i for r in index.requests for i in r) == sorted(r[0] for r in records)
+
+    class Rejected(Exception):
+        status = 400
+
+    def reject(vectors, namespace=""):
+        raise Rejected("bad request")
+
+    monkeypatch.setattr(index, "upsert", reject)
+    with pytest.raises(Rejected):
+        store.upsert(records[:3])
+
+
+def test_interrupted_ingest_resumes_from_checkpoint(local_env, monkeypatch):
+    import functools
+
+    from services.pipeline import run_pipeline
+    from vectorstore.local import LocalVectorStore
+
+    monkeypatch.setattr(ingest, "run_pipeline", functools.partial(run_pipeline, batch_size=1))
+    monkeypatch.setattr(ingest, "INGEST_UPSERT_WORKERS", 1)
+    monkeypatch.setattr(manifest, "INGEST_CHECKPOINT_BATCHES", 1)
+    config = {"repo": "acme/widgets", "extensions": [".ts"]}
+    long_body = "\n".join(f"export const value{i} = {i};" for i in range(60))
+    REPO_FILES.update({f"src/f{i}.ts": f"export const f{i} = {i};" for i in range(6)})
+    REPO_FILES["src/long.ts"] = long_body
+    ingest.load_and_chunk(config, None, "test-index")
+    long_ids = manifest.RepoManifest.load("acme/widgets", "test-index").chunk_ids("src/long.ts")
+    assert len(long_ids) > 1
+
+    # The long file shrinks to one chunk, and the vector store fails partway through the next run.
+    REPO_FILES["src/long.ts"] = "export const short = 1;"
+    for i in range(6):
+        REPO_FILES[f"src/f{i}.ts"] += " // v2"
+    original = LocalVectorStore.upsert
+    calls = []
+
+    def flaky_upsert(self, vectors, namespace=""):
+        calls.append(1)
+        if len(calls) == 4:
+            raise ConnectionError("store went away")
+        return original(self, vectors, namespace=namespace)
+
+    monkeypatch.setattr(LocalVectorStore, "upsert", flaky_upsert)
+    with pytest.raises(ConnectionError):
+        ingest.load_and_chunk(config, None, "test-index")
+    checkpoint = manifest.IngestCheckpoint.load("acme/widgets", "test-index")
+    assert checkpoint is not None and checkpoint.files == 3 and checkpoint.batches == 3
+
+    # The restart only fetches what the failed run had not finished, and still removes the stale chunks.
+    FETCHED.clear()
+    stats = ingest.load_and_chunk(config, None, "test-index")
+    assert len(FETCHED) == 4 and stats["resumed_files"] == 3
+    assert manifest.IngestCheckpoint.load("acme/widgets", "test-index") is None
+    ids = {m["id"] for m in local_env.query([1.0] * 768, top_k=100)["matches"]}
+    assert len(ids) == 7
+    assert not set(long_ids[1:]) & ids
+
+
+def test_concurrent_ingests_share_one_pinecone_store(local_env, monkeypatch):
+    import threading
+
+    import vectorstore.pinecone as vp
+
+    class FakeIndex:
+        def __init__(self):
+            self.upserts = []
+
+        def upsert(self, vectors, namespace=""):
+            self.upserts.append(namespace)
+            return {"upserted_count": len(vectors)}
+
+        def update(self, **kwargs):
+            pass
+
+        def delete(self, **kwargs):
+            pass
+
+    opened, closed = [], []
+
+    class TrackedStore(vp.PineconeStore):
+        def close(self):
+            closed.append(self)
+            super().close()
+
+    def open_pinecone(client, name):
+        opened.append(TrackedStore(FakeIndex(), upsert_workers=2))
+        return opened[-1]
+
+    monkeypatch.setattr(vs_store, "VECTOR_BACKEND", "pinecone")
+    monkeypatch.setattr(vs_store, "open_store", open_pinecone)
+    # Both runs are mid-ingest (store open) when either fetches, so they overlap.
+    both_running = threading.Barrier(2, timeout=5)
+    fetch = FakeLoader.get_file_content_by_path
+
+    def overlapping_fetch(self, path):
+        both_running.wait()
+        return fetch(self, path)
+
+    monkeypatch.setattr(FakeLoader, "get_file_content_by_path", overlapping_fetch)
+    REPO_FILES.update({"src/a.ts": "export const a = 1;"})
+    runs = [
+        threading.Thread(target=ingest.load_and_chunk, args=({"repo": repo, "extensions": [".ts"]}, None, "shared-index"))
+        for repo in ("acme/widgets", "acme/gadgets")
+    ]
+    for run in runs:
+        run.start()
+    for run in runs:
+        run.join()
+    # One store, hence one upsert pool of PINECONE_UPSERT_WORKERS, closed once the last run finished.
+    assert len(opened) == 1 and closed == opened
+    assert sorted(opened[0].index.upserts) == ["acme/gadgets", "acme/widgets"]
+    assert vs_store._shared_stores == {}
+
+
+def test_search_service_scopes_to_repo_namespaces(local_env, monkeypatch):
+    import services.search_service as search_service
+
+    monkeypatch.setattr(search_service, "embed_query", lambda text: [1.0] * 768)
+    REPO_FILES.update({"README.md": "# Widgets", "src/a.ts": "export const a = 1;"})
+    ingest.load_and_chunk({"repo": "acme/widgets", "extensions": [".md", ".ts"]}, None, "test-index")
+    REPO_FILES.clear()
+    REPO_FILES["src/b.ts"] = "export const b = 2;"
+    ingest.load_and_chunk({"repo": "acme/gadgets", "extensions": [".ts"]}, None, "test-index")
+
+    everything = search_service.search_relevant_documents("widgets", top_k=10, index_name="test-index")
+    assert sorted(m["metadata"]["path"] for m in everything) == ["README.md", "src/a.ts", "src/b.ts"]
+    scoped = search_service.search_relevant_documents("widgets", top_k=10, index_name="test-index", repo="acme/widgets", path_prefix="src")
+    assert [(m["metadata"]["path"], m["text"]) for m in scoped] == [("src/a.ts", "export const a = 1;")]
+    # A VectorStore is used as given.
+    assert search_service.search_relevant_documents("widgets", top_k=10, pinecone_client=local_env, index_name="test-index", repo="acme/gadgets")[0]["metadata"]["path"] == "src/b.ts"
+
+
+def test_search_service_accepts_a_pinecone_index(local_env, monkeypatch):
+    import services.search_service as search_service
+
+    class FakeIndex:
+        def __init__(self):
+            self.queries = []
+
+        def query(self, vector, top_k=10, include_metadata=True, **kwargs):
+            self.queries.append(kwargs)
+            return {"matches": [{"id": "doc-1", "score": 0.9, "metadata": {"path": "x", "text": "hello"}}]}
+
+    monkeypatch.setattr(search_service, "embed_query", lambda text: [1.0] * 768)
+    index = FakeIndex()
+    for _ in range(2):
+        matches = search_service.search_relevant_documents("widgets", pinecone_client=index, repo="acme/widgets", file_type="ts")
+        assert [(m["id"], m["text"]) for m in matches] == [("doc-1", "hello")]
+    assert index.queries[0] == {"namespace": "acme/widgets", "filter": {"file_type": {"$in": ["ts"]}}}
+    # The Index is wrapped once, so its thread pools are reused rather than created per search.
+    assert search_service._stores[("index", id(index))].index is index
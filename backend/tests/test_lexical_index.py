@@ -0,0 +1,88 @@
+from services.lexical_index import LexicalIndex, looks_like_identifier, query_kind, rrf_fuse, tokenize
+from vectorstore.base import build_filter
+
+
+def test_tokenize_splits_code_identifiers():
+    assert list(tokenize("useDisclosure")) == ["usedisclosure", "use", "disclosure"]
+    assert list(tokenize("parse_HTTPResponse")) == ["parse_httpresponse", "parse", "http", "response"]
+    assert list(tokenize("MOVE CARD-UPDATE.")) == ["move", "card-update", "card", "update"]
+    assert list(tokenize("COCRDUPC")) == ["cocrdupc"]
+
+
+def test_query_kind():
+    assert looks_like_identifier("useDisclosure")
+    assert looks_like_identifier("COCRDUPC")
+    assert looks_like_identifier("card_update")
+    assert not looks_like_identifier("widgets")
+    assert query_kind("`COCRDUPC`") == "identifier"
+    assert query_kind("how does useDisclosure work") == "mixed"
+    assert query_kind("how are cards updated") == "natural"
+
+
+def test_bm25_ranking_namespaces_and_filters(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lex.sqlite"))
+    index.add(
+        [
+            ("c1", "PROGRAM-ID. COCRDUPC. MOVE CARD-NUM TO WS-CARD.", {"path": "app/cbl/COCRDUPC.cbl", "dirs": ["app", "app/cbl"], "file_type": "code"}),
+            ("c2", "CALL 'COCRDUPC' USING WS-CARD. Card update screen.", {"path": "app/cbl/COMEN01C.cbl", "dirs": ["app", "app/cbl"], "file_type": "code"}),
+            ("d1", "Card update documentation for the online programs.", {"path": "docs/cards.md", "dirs": ["docs"], "file_type": "doc"}),
+        ],
+        namespace="aws/carddemo",
+    )
+    index.add([("u1", "const { isOpen } = useDisclosure();", {"path": "src/Modal.tsx", "dirs": ["src"], "file_type": "code"})], namespace="acme/ui")
+
+    assert {m["id"] for m in index.search("COCRDUPC")} == {"c1", "c2"}
+    assert [m["id"] for m in index.search("useDisclosure")] == ["u1"]
+    assert [m["id"] for m in index.search("card update", namespace="acme/ui")] == []
+    assert [m["id"] for m in index.search("card update", filter=build_filter(file_type="doc"))] == ["d1"]
+    assert {m["id"] for m in index.search("card", filter=build_filter(path_prefix="app/cbl"))} == {"c1", "c2"}
+
+    # Re-adding an id replaces its postings; deletes remove them.
+    index.add([("c1", "nothing relevant here", {"path": "app/cbl/COCRDUPC.cbl"})], namespace="aws/carddemo")
+    assert [m["id"] for m in index.search("COCRDUPC")] == ["c2"]
+    index.delete(["c2"])
+    assert index.search("COCRDUPC") == []
+
+
+def test_rrf_fuse_rewards_agreement():
+    dense = [{"id": "a", "score": 0.9}, {"id": "b", "score": 0.8}, {"id": "c", "score": 0.7}]
+    lexical = [{"id": "c", "score": 12.0}, {"id": "d", "score": 3.0}]
+    fused = rrf_fuse([dense, lexical], top_k=3)
+    assert [m["id"] for m in fused] == ["c", "a", "b"]
+    assert fused[0]["score"] == 1 / 63 + 1 / 61
+
+
+def test_exact_lookup_and_incremental_totals(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "lex.sqlite")
+    index = LexicalIndex(path)
+    index.add(
+        [
+            ("hook", "const { isOpen } = useDisclosure();", {}),
+            ("prose", "Use the disclosure widget to show and hide content.", {}),
+            ("other", "function useToggle() { return useState(false); }", {}),
+        ]
+    )
+    # The exact token skips the "use" / "disclosure" parts; an unknown identifier falls back to them.
+    assert [m["id"] for m in index.search("useDisclosure", exact=True)] == ["hook"]
+    assert {m["id"] for m in index.search("useDisclosure")} == {"hook", "prose", "other"}
+    assert {m["id"] for m in index.search("useDisclosureState", exact=True)} == {"hook", "prose", "other"}
+
+    def totals():
+        docs = sqlite3.connect(path).execute("SELECT COUNT(*), SUM(length) FROM docs").fetchone()
+        meta = dict(sqlite3.connect(path).execute("SELECT key, value FROM meta"))
+        return docs, (meta["docs"], meta["length"])
+
+    index.add([("hook", "useDisclosure()", {})])
+    index.delete(["other", "missing"])
+    docs, meta = totals()
+    assert docs == meta and meta[0] == 2
+
+    # An index written before the meta table existed gets its totals computed once on open.
+    index.close()
+    with sqlite3.connect(path) as db:
+        db.execute("DROP TABLE meta")
+    reopened = LexicalIndex(path)
+    assert totals()[1] == docs
+    assert [m["id"] for m in reopened.search("disclosure")][0] in {"hook", "prose"}
@@ -0,0 +1,206 @@
+import os
+
+import numpy as np
+import pytest
+
+from vectorstore.local import LocalVectorStore
+
+
+def _random_vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def test_upsert_and_exact_query(tmp_path):
+    store = LocalVectorStore(str(tmp_path / "idx"), dimension=16)
+    vectors = _random_vectors(50)
+    store.upsert((f"doc-{i}", v.tolist(), {"path": f"f{i}.md"}) for i, v in enumerate(vectors))
+
+    resp = store.query(vectors[7].tolist(), top_k=3)
+    assert len(resp["matches"]) == 3
+    top = resp["matches"][0]
+    assert top["id"] == "doc-7"
+    assert top["score"] == pytest.approx(1.0, abs=1e-5)
+    assert top["metadata"] == {"path": "f7.md"}
+    assert store.describe_index_stats()["total_vector_count"] == 50
+
+
+def test_overwrite_delete_and_reopen(tmp_path):
+    path = str(tmp_path / "idx")
+    store = LocalVectorStore(path, dimension=16)
+    vectors = _random_vectors(3)
+    store.upsert([("a", vectors[0], {"v": 1}), ("b", vectors[1], {}), ("c", vectors[2], {})])
+    store.upsert([("a", vectors[2], {"v": 2})])
+    store.delete(["b", "missing"])
+    store.close()
+
+    reopened = LocalVectorStore(path, dimension=16)
+    assert reopened.describe_index_stats()["total_vector_count"] == 2
+    ids = [m["id"] for m in reopened.query(vectors[2], top_k=5)["matches"]]
+    assert sorted(ids) == ["a", "c"]
+    assert reopened.query(vectors[2], top_k=1)["matches"][0]["metadata"] in ({"v": 2}, {})
+
+
+def test_dimension_mismatch(tmp_path):
+    path = str(tmp_path / "idx")
+    store = LocalVectorStore(path, dimension=16)
+    with pytest.raises(ValueError):
+        store.upsert([("a", [0.1] * 8, {})])
+    store.close()
+    with pytest.raises(ValueError):
+        LocalVectorStore(path, dimension=32)
+
+
+def test_ivf_matches_exact_search(tmp_path):
+    # Clustered data, like real embeddings, rather than isotropic noise.
+    centers = _random_vectors(30, dim=32, seed=1)
+    vectors = centers[np.arange(3000) % 30] + 0.3 * _random_vectors(3000, dim=32, seed=4)
+    exact = LocalVectorStore(str(tmp_path / "exact"), dimension=32)
+    ann = LocalVectorStore(str(tmp_path / "ann"), dimension=32, ann_threshold=1000, nprobe=24)
+    records = [(str(i), v, {}) for i, v in enumerate(vectors)]
+    exact.upsert(records)
+    ann.upsert(records)
+    assert ann.maybe_build_ann()
+    # Rows appended after the build are still scanned exactly.
+    extra = _random_vectors(1, dim=32, seed=2)[0]
+    ann.upsert([("extra", extra, {})])
+    assert ann.query(extra, top_k=1)["matches"][0]["id"] == "extra"
+
+    queries = vectors[::150] + 0.1 * _random_vectors(20, dim=32, seed=3)
+    recall = []
+    for q in queries:
+        truth = {m["id"] for m in exact.query(q, top_k=10, include_metadata=False)["matches"]}
+        found = {m["id"] for m in ann.query(q, top_k=10, include_metadata=False)["matches"]} - {"extra"}
+        recall.append(len(truth & found) / 10)
+    assert np.mean(recall) >= 0.9
+
+
+def test_namespaces_and_metadata_filters(tmp_path):
+    from vectorstore.base import build_filter
+
+    path = str(tmp_path / "idx")
+    store = LocalVectorStore(path, dimension=16)
+    vectors = _random_vectors(6)
+    store.upsert(
+        [
+            ("a1", vectors[0], {"path": "src/api/a.py", "dirs": ["src", "src/api"], "file_type": "code"}),
+            ("a2", vectors[1], {"path": "docs/a.md", "dirs": ["docs"], "file_type": "doc"}),
+            ("a3", vectors[2], {"path": "README.md", "dirs": [], "file_type": "readme"}),
+        ],
+        namespace="org/a",
+    )
+    store.upsert([("b1", vectors[3], {"path": "src/b.py", "dirs": ["src"], "file_type": "code"})], namespace="org/b")
+
+    def ids(**kwargs):
+        return sorted(m["id"] for m in store.query(vectors[0], top_k=10, **kwargs)["matches"])
+
+    assert ids() == ["a1", "a2", "a3", "b1"]
+    assert ids(namespace="org/b") == ["b1"]
+    assert ids(namespace=["org/a", "missing"]) == ["a1", "a2", "a3"]
+    assert ids(filter=build_filter(file_type="code")) == ["a1", "b1"]
+    assert ids(filter=build_filter(file_type=["doc", "readme"])) == ["a2", "a3"]
+    assert ids(filter=build_filter(path_prefix="src/api/")) == ["a1"]
+    assert ids(filter=build_filter(path_prefix="README.md")) == ["a3"]
+    assert ids(namespace="org/a", filter=build_filter(file_type="code", path_prefix="src")) == ["a1"]
+    assert ids(filter={"file_type": {"$nin": ["code"]}}) == ["a2", "a3"]
+    with pytest.raises(ValueError):
+        store.query(vectors[0], filter={"file_type": {"$gt": 1}})
+
+    # Deletes only touch the named namespace; counts survive a reopen.
+    store.delete(["b1"], namespace="org/a")
+    store.delete(["a2"], namespace="org/a")
+    store.close()
+    reopened = LocalVectorStore(path, dimension=16)
+    assert reopened.describe_index_stats()["namespaces"] == {"org/a": {"vector_count": 2}, "org/b": {"vector_count": 1}}
+    assert sorted(m["id"] for m in reopened.query(vectors[0], namespace="org/b")["matches"]) == ["b1"]
+
+
+def test_compressed_codes_with_full_precision_rescoring(tmp_path):
+    from vectorstore.compression import evaluate
+
+    centers = _random_vectors(20, dim=64, seed=5)
+    vectors = centers[np.arange(2000) % 20] + 0.4 * _random_vectors(2000, dim=64, seed=6)
+    exact = LocalVectorStore(str(tmp_path / "exact"), dimension=64)
+    path = str(tmp_path / "pq")
+    compressed = LocalVectorStore(path, dimension=64, compression="pca32-pq8", rescore_factor=8)
+    records = [(str(i), v, {}) for i, v in enumerate(vectors)]
+    exact.upsert(records)
+    compressed.upsert(records)
+    compressed.maybe_build_ann()
+    assert compressed.describe_index_stats()["compression"] == "pca32-pq8"
+
+    # Rows written after the fit are encoded with the same codec; scores are exact after rescoring.
+    extra = _random_vectors(1, dim=64, seed=7)[0]
+    compressed.upsert([("extra", extra, {})])
+    top = compressed.query(extra, top_k=1)["matches"][0]
+    assert top["id"] == "extra" and top["score"] == pytest.approx(1.0, abs=1e-5)
+
+    queries = vectors[::100] + 0.1 * _random_vectors(20, dim=64, seed=8)
+    compressed.close()
+    reopened = LocalVectorStore(path, dimension=64, compression="pca32-pq8", rescore_factor=8)
+    recall = []
+    for q in queries:
+        truth = {m["id"] for m in exact.query(q, top_k=10, include_metadata=False)["matches"]}
+        found = {m["id"] for m in reopened.query(q, top_k=10, include_metadata=False)["matches"]}
+        recall.append(len(truth & found) / 10)
+    assert np.mean(recall) >= 0.9
+
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    report = evaluate(unit, unit[::200], ["int8", "pca32-pq8"], k=10)
+    assert [r["compression"] for r in report] == [4.0, 32.0]
+    assert report[0]["recall@10_rescored"] >= 0.9
+
+
+def test_compressed_codes_are_persisted_not_reencoded_on_open(tmp_path, monkeypatch):
+    from vectorstore.compression import VectorCodec
+
+    path = str(tmp_path / "idx")
+    vectors = _random_vectors(300, dim=32, seed=9)
+    store = LocalVectorStore(path, dimension=32, compression="int8")
+    store.upsert([(str(i), v, {}) for i, v in enumerate(vectors)])
+    store.compress()
+    store.upsert([("late", vectors[0] * -1, {})])
+    expected = [store.query(v, top_k=5, include_metadata=False)["matches"] for v in vectors[:5]]
+    codes = np.array(store._codes[: store._count])
+    store.close()
+
+    def no_encode(self, x):
+        raise AssertionError("codes were re-encoded on open")
+
+    monkeypatch.setattr(VectorCodec, "encode", no_encode)
+    reopened = LocalVectorStore(path, dimension=32, compression="int8")
+    assert np.array_equal(np.asarray(reopened._codes[: reopened._count]), codes)
+    assert [reopened.query(v, top_k=5, include_metadata=False)["matches"] for v in vectors[:5]] == expected
+    monkeypatch.undo()
+
+    # A refit switches to a new codes file and removes the old one.
+    reopened.compress("int8")
+    assert sorted(f for f in os.listdir(path) if f.startswith(("codec", "codes"))) == ["codec-2.npz", "codes-2.u8"]
+
+
+def test_generation_sees_writes_from_another_process(tmp_path):
+    path = str(tmp_path / "idx")
+    vectors = _random_vectors(3)
+    reader = LocalVectorStore(path, dimension=16, reload_interval=0)
+    writer = LocalVectorStore(path, dimension=16)
+    seen = [reader.generation()]
+    writer.upsert([("a", vectors[0], {"path": "a.py"}), ("b", vectors[1], {})])
+    seen.append(reader.generation())
+    writer.update_metadata("a", {"duplicate_paths": ["b.py"]})
+    seen.append(reader.generation())
+    writer.delete(["b"])
+    seen.append(reader.generation())
+    assert len(set(seen)) == 4
+    assert reader.generation() == seen[-1] == writer.generation()
+
+
+def test_query_many_matches_single_queries(tmp_path):
+    store = LocalVectorStore(str(tmp_path / "idx"), dimension=16)
+    vectors = _random_vectors(200)
+    store.upsert((str(i), v, {"n": i}) for i, v in enumerate(vectors))
+    queries = _random_vectors(5, seed=9)
+    batched = store.query_many(queries, top_k=4)
+    for resp, q in zip(batched, queries):
+        single = store.query(q, top_k=4)["matches"]
+        assert [m["id"] for m in resp["matches"]] == [m["id"] for m in single]
+        assert [m["score"] for m in resp["matches"]] == pytest.approx([m["score"] for m in single], abs=1e-5)
+    assert store.query_many([], top_k=4) == []
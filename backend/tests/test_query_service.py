@@ -1,3 +1,5 @@
+import time
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -5,11 +7,16 @@ from fastapi.testclient import TestClient
 class FakeIndex:
     def __init__(self):
         self.queries = []
+        self.scopes = []
 
-    def query(self, vector, top_k=10, include_metadata=True):
+    def query(self, vector, top_k=10, include_metadata=True, namespace=None, filter=None):
         self.queries.append((vector, top_k, include_metadata))
+        self.scopes.append((namespace, filter))
         return {"matches": [{"id": "doc-1", "score": 0.95, "metadata": {"path": "x"}, "text": "hello"}]}
 
+    def describe_index_stats(self):
+        return {"total_vector_count": 1, "dimension": 768, "metric": "cosine", "namespaces": {}}
+
 
 class FakeClient:
     def Index(self, name):
@@ -20,12 +27,23 @@ class FakeClient:
 
 
 @pytest.fixture(autouse=True)
-def patch_env(monkeypatch):
+def patch_env(monkeypatch, tmp_path):
+    import services.chunk_store as chunk_store
     import services.embedding_service as emb
+    import services.lexical_index as lexical_index
     import vectorstore.pinecone as vp
+    import vectorstore.store as vs_store
+
+    monkeypatch.setattr(chunk_store, "CHUNK_STORE_DIR", str(tmp_path / "chunks"))
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setattr(vs_store, "INDEX_GENERATION_DIR", str(tmp_path / "generations"))
+    monkeypatch.setattr(emb, "EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite"))
 
     # Replace embed_query with a simple deterministic function
     monkeypatch.setattr(emb, "embed_query", lambda text: [0.1] * 768)
+    monkeypatch.setattr(emb, "embed_queries", lambda texts: [[0.1] * 768 for _ in texts])
+    monkeypatch.setattr(emb, "load_model", lambda: None)
+    monkeypatch.setattr(emb, "warm_up", lambda: None)
 
     # Replace init_pinecone to return a fake client
     monkeypatch.setattr(vp, "init_pinecone", lambda api_key=None: FakeClient())
@@ -34,8 +52,8 @@ def patch_env(monkeypatch):
 def test_query_endpoint():
     from api.query_service import app
 
-    client = TestClient(app)
-    resp = client.post("/query", json={"query": "test query", "top_k": 5})
+    with TestClient(app) as client:
+        resp = client.post("/query", json={"query": "test query", "top_k": 5})
 
     assert resp.status_code == 200
     data = resp.json()
@@ -46,11 +64,437 @@ def test_query_endpoint():
     assert r["metadata"]["path"] == "x"
 
 
+def test_null_or_zero_top_k_is_rejected():
+    from api.query_service import app
+
+    with TestClient(app) as client:
+        for top_k in (None, 0):
+            assert client.post("/query", json={"query": "useDisclosure", "top_k": top_k}).status_code == 422
+            batch = {"queries": [{"query": "where is useDisclosure defined", "top_k": top_k}]}
+            assert client.post("/query/batch", json=batch).status_code == 422
+        assert client.post("/query", json={"query": "useDisclosure"}).status_code == 200
+
+
 def test_health_ok():
     from api.query_service import app
 
-    client = TestClient(app)
-    resp = client.get("/health")
+    with TestClient(app) as client:
+        resp = client.get("/health")
     assert resp.status_code == 200
     data = resp.json()
     assert data["status"] == "ok"
+
+
+def test_query_batcher_coalesces_concurrent_queries():
+    import asyncio
+    from services.query_batcher import QueryBatcher
+
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    async def run():
+        batcher = QueryBatcher(embed_many, max_batch=8, max_wait_ms=20)
+        results = await asyncio.gather(*(batcher.embed("q" * i) for i in range(1, 13)))
+        await batcher.close()
+        return results
+
+    results = asyncio.run(run())
+    assert results == [[float(i)] for i in range(1, 13)]
+    assert sorted(len(c) for c in calls) == [4, 8]
+
+
+def test_repeated_query_served_from_cache():
+    import os
+
+    from api import query_service
+    from services import embedding_service
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        for text in ("cached query", "  Cached   QUERY "):
+            resp = client.post("/query", json={"query": text, "top_k": 3})
+            assert resp.status_code == 200
+        assert len(query_service.INDEX.index.queries) == 1
+        stats = client.get("/cache/stats").json()
+        assert stats["query"]["results"]["hits"] >= 1
+        # Reading the stats does not create an embedding cache file.
+        assert stats["embedding"] == {}
+        assert not os.path.exists(embedding_service.EMBEDDING_CACHE_PATH)
+
+
+def test_repo_and_metadata_filters_pushed_to_index():
+    from api import query_service
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        body = {"query": "scoped query", "repo": "org/a", "file_type": "code", "path_prefix": "src/"}
+        assert client.post("/query", json=body).status_code == 200
+        # A different scope must not be answered from the cache.
+        assert client.post("/query", json={**body, "repo": "org/b"}).status_code == 200
+    scopes = query_service.INDEX.index.scopes
+    assert scopes[0] == (
+        "org/a",
+        {"$and": [{"file_type": {"$in": ["code"]}}, {"$or": [{"dirs": {"$in": ["src"]}}, {"path": {"$eq": "src"}}]}]},
+    )
+    assert [s[0] for s in scopes] == ["org/a", "org/b"]
+
+
+def test_identifier_query_skips_embedding_and_mixed_query_fuses(monkeypatch):
+    from api import query_service
+    import services.embedding_service as emb
+
+    embedded = []
+    monkeypatch.setattr(emb, "embed_queries", lambda texts: embedded.extend(texts) or [[0.1] * 768 for _ in texts])
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        # Startup health checks embed once; only count what the queries embed.
+        embedded.clear()
+        query_service.CHUNK_STORE.put_many([("lex-1", "function useDisclosure() {}")])
+        query_service.LEXICAL.add([("lex-1", "function useDisclosure() {}", {"path": "src/hooks.ts"})], namespace="acme/ui")
+
+        data = client.post("/query", json={"query": "useDisclosure", "include_timings": True}).json()
+        assert [r["id"] for r in data["results"]] == ["lex-1"]
+        assert data["results"][0]["text"] == "function useDisclosure() {}"
+        assert "embed" not in data["timings_ms"] and embedded == []
+
+        data = client.post("/query", json={"query": "where is useDisclosure defined"}).json()
+        assert {r["id"] for r in data["results"]} == {"lex-1", "doc-1"}
+        assert embedded == ["where is useDisclosure defined"]
+
+
+def test_scnd_reranks_oversampled_candidates_and_falls_back(monkeypatch):
+    from api import query_service_scnd as scnd
+    from services.reranker import Reranker, candidate_count
+
+    matches = [
+        {"id": "low", "score": 0.9, "metadata": {"importance": 1.0}},
+        {"id": "readme", "score": 0.8, "metadata": {"importance": 1.2}},
+        {"id": "best", "score": 0.5, "metadata": {}},
+    ]
+    requested = []
+
+    def query(vector, top_k=10, include_metadata=True, **kwargs):
+        requested.append(top_k)
+        return {"matches": matches}
+
+    texts = {"low": "unrelated", "readme": "somewhat about cards", "best": "how cards are updated in detail"}
+    monkeypatch.setattr(scnd, "RERANKER", Reranker(score_fn=lambda pairs: [float(len(t)) for _, t in pairs]))
+    with TestClient(scnd.app) as client:
+        scnd.QUERY_CACHE.clear()
+        monkeypatch.setattr(scnd.INDEX.index, "query", query)
+        scnd.CHUNK_STORE.put_many(texts.items())
+
+        data = client.post("/query", json={"query": "how are cards updated", "top_k": 2, "snippet_chars": 4}).json()
+        assert requested == [8]
+        assert [r["id"] for r in data["results"]] == ["best", "readme"]
+        assert data["results"][0]["text"] == "how…"
+
+        # Without reranking, results follow importance-weighted vector order.
+        data = client.post("/query", json={"query": "how are cards updated", "top_k": 3, "rerank": False}).json()
+        assert [r["id"] for r in data["results"]] == ["readme", "low", "best"]
+
+        # The rerank path sizes its candidate pool from top_k, so null is rejected up front.
+        requested.clear()
+        for body in ({"query": "how are cards updated", "top_k": None}, {"query": "how are cards updated", "top_k": None, "rerank": False}):
+            assert client.post("/query", json=body).status_code == 422
+        assert requested == []
+        data = client.post("/query", json={"query": "how are cards updated"}).json()
+        assert requested == [candidate_count(5)] and len(data["results"]) == 3
+
+
+def test_batch_endpoint_embeds_once_and_keeps_order(monkeypatch):
+    from api import query_service
+    import services.embedding_service as emb
+
+    calls = []
+    monkeypatch.setattr(emb, "embed_queries", lambda texts: calls.append(list(texts)) or [[0.1] * 768 for _ in texts])
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        client.post("/query", json={"query": "already cached", "top_k": 3})
+        calls.clear()
+        body = {
+            "queries": [
+                {"query": "first question", "top_k": 3},
+                {"query": ""},
+                {"query": "already cached", "top_k": 3},
+                {"query": "second question", "top_k": 1, "repo": "org/a"},
+            ]
+        }
+        resp = client.post("/query/batch", json=body)
+    assert resp.status_code == 200
+    items = resp.json()["responses"]
+    assert [i["error"] for i in items] == [None, "query is required", None, None]
+    assert [r["id"] for r in items[0]["results"]] == ["doc-1"]
+    assert items[1]["results"] is None
+    assert items[2]["results"][0]["id"] == "doc-1"
+    assert calls == [["first question", "second question"]]
+    assert ("org/a", None) in query_service.INDEX.index.scopes
+
+
+def test_batch_endpoint_reports_per_item_search_errors(monkeypatch):
+    from api import query_service
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+
+        def query(vector, top_k=10, include_metadata=True, namespace=None, filter=None):
+            if namespace == "broken":
+                raise RuntimeError("index unavailable")
+            return {"matches": [{"id": "doc-1", "score": 0.9, "metadata": {}}]}
+
+        monkeypatch.setattr(query_service.INDEX.index, "query", query)
+        resp = client.post("/query/batch", json={"queries": [{"query": "ok one"}, {"query": "bad one", "repo": "broken"}]})
+    items = resp.json()["responses"]
+    assert items[0]["results"][0]["id"] == "doc-1" and items[0]["error"] is None
+    assert items[1] == {"results": None, "error": "vector query failed"}
+
+
+def test_query_cache_semantic_tier_and_invalidation():
+    from services.query_cache import QueryCache
+
+    generation = {"value": 1}
+    cache = QueryCache(lambda: generation["value"])
+    cache.put_results("where are cards validated", (5, True), [1.0, 0.0, 0.0], ["r1"])
+
+    assert cache.get_results("Where are  cards validated", (5, True)) == ["r1"]
+    assert cache.get_results("where are cards validated", (10, True)) is None
+    assert cache.get_similar_results([0.99, 0.01, 0.0], (5, True)) == ["r1"]
+    assert cache.get_similar_results([0.0, 1.0, 0.0], (5, True)) is None
+
+    generation["value"] = 2
+    assert cache.get_results("where are cards validated", (5, True)) is None
+    assert cache.get_similar_results([1.0, 0.0, 0.0], (5, True)) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_query_cache_generation_comes_from_the_store(monkeypatch):
+    from services.query_cache import QueryCache
+    from vectorstore import store as vs_store
+    from vectorstore.pinecone import PineconeStore
+
+    class CountingIndex(FakeIndex):
+        def __init__(self):
+            super().__init__()
+            self.counts = {"org/a": 10}
+
+        def describe_index_stats(self):
+            return {"namespaces": {ns: {"vector_count": n} for ns, n in self.counts.items()}}
+
+        def delete(self, ids, namespace=""):
+            pass
+
+    # No marker file: ingest ran on another host.
+    monkeypatch.setattr(vs_store, "INDEX_GENERATION_DIR", "/nonexistent")
+    index = CountingIndex()
+    store = PineconeStore(index, namespace_ttl=0)
+    cache = QueryCache(lambda: vs_store.index_generation("idx", store))
+    cache.put_results("q", (5,), None, ["r1"])
+    assert cache.get_results("q", (5,)) == ["r1"]
+    index.counts["org/b"] = 3
+    assert cache.get_results("q", (5,)) is None
+    cache.put_results("q", (5,), None, ["r2"])
+    # Writes made through this store invalidate without waiting for the stats.
+    store.delete(["x"], namespace="org/a")
+    assert cache.get_results("q", (5,)) is None
+
+
+def test_watched_generation_is_checked_off_the_request_path():
+    from services.query_cache import QueryCache
+
+    calls = {"n": 0, "value": 1}
+
+    def generation():
+        calls["n"] += 1
+        return calls["value"]
+
+    cache = QueryCache(generation)
+    cache.watch(interval=0.01)
+    try:
+        before = calls["n"]
+        cache.put_results("q", (5,), None, ["r1"])
+        calls["value"] = 2
+        deadline = time.monotonic() + 2
+        while cache.stats()["invalidations"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.stats()["invalidations"] == 1 and calls["n"] > before
+        cache.put_results("q", (5,), None, ["r2"])
+        # Lookups never call generation() while it is watched.
+        cache._generation = lambda: 1 / 0
+        assert cache.get_results("q", (5,)) == ["r2"]
+    finally:
+        cache.stop()
+
+
+def test_failed_namespace_refresh_is_throttled():
+    from vectorstore.pinecone import PineconeStore
+
+    class Outage(FakeIndex):
+        calls = 0
+
+        def describe_index_stats(self):
+            Outage.calls += 1
+            raise ConnectionError("pinecone unavailable")
+
+    store = PineconeStore(Outage(), namespace_ttl=60)
+    for _ in range(5):
+        with pytest.raises(ConnectionError):
+            store.query([0.1] * 768, top_k=5)
+        store.generation()
+    assert Outage.calls == 1
+
+
+def test_query_timings_and_metrics():
+    from api import query_service
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        plain = client.post("/query", json={"query": "timed query"}).json()
+        # The fake embedding is constant, so drop the semantic tier's entry first.
+        query_service.QUERY_CACHE.clear()
+        timed = client.post("/query", json={"query": "another timed query", "include_timings": True}).json()
+        metrics = client.get("/metrics")
+
+    assert plain["query_time_ms"] >= 0 and plain["timings_ms"] is None
+    assert {"cache", "embed", "search", "normalize"} <= set(timed["timings_ms"])
+    assert metrics.status_code == 200
+    assert 'gitsense_query_stage_seconds_count{service="query",stage="search"}' in metrics.text
+    assert 'gitsense_queries_total{outcome="ok",service="query"}' in metrics.text
+
+
+def test_results_hydrated_from_chunk_store_with_snippets():
+    from api import query_service
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        query_service.CHUNK_STORE.put_many([("doc-1", "PERFORM VALIDATE-CARD UNTIL DONE.")])
+        full = client.post("/query", json={"query": "hydrate"}).json()["results"][0]
+        short = client.post("/query", json={"query": "hydrate", "snippet_chars": 7}).json()["results"][0]
+
+    assert full["text"] == "PERFORM VALIDATE-CARD UNTIL DONE."
+    assert short["text"] == "PERFORM…"
+
+
+def test_readyz_reports_warm_up_and_first_query(monkeypatch):
+    from api import query_service
+    import services.embedding_service as emb
+    from services.metrics import FIRST_QUERY_SECONDS, STARTUP_SECONDS
+    from services.warmup import Warmup
+
+    steps = []
+    monkeypatch.setattr(emb, "load_model", lambda: steps.append("model"))
+    monkeypatch.setattr(emb, "warm_up", lambda: steps.append("embed"))
+    monkeypatch.setattr(query_service, "WARMUP", Warmup("query"))
+    with TestClient(query_service.app) as client:
+        resp = client.get("/readyz")
+        assert resp.status_code == 200
+        assert steps == ["model", "embed"]
+        assert {"model", "embed", "index", "total"} <= set(resp.json()["startup_seconds"])
+        assert STARTUP_SECONDS.labels(service="query", stage="embed")._value.get() >= 0
+
+        client.post("/query", json={"query": "first query"})
+        first = FIRST_QUERY_SECONDS.labels(service="query")._value.get()
+        assert first > 0
+        client.post("/query", json={"query": "second query"})
+        assert FIRST_QUERY_SECONDS.labels(service="query")._value.get() == first
+
+    def broken():
+        raise RuntimeError("model download failed")
+
+    monkeypatch.setattr(emb, "warm_up", broken)
+    monkeypatch.setattr(query_service, "WARMUP", Warmup("query"))
+    with TestClient(query_service.app) as client:
+        resp = client.get("/readyz")
+    assert resp.status_code == 503
+    assert resp.json()["error"] == "embed: model download failed"
+
+
+def test_probes_serve_cached_health_checks(monkeypatch):
+    from api import query_service
+    import services.embedding_service as emb
+    import services.health as health
+
+    calls = []
+    monkeypatch.setattr(emb, "embed_queries", lambda texts: calls.append(texts) or [[0.1] * 768 for _ in texts])
+    monkeypatch.setattr(health, "HEALTH_STORE_INTERVAL", 0.05)
+    with TestClient(query_service.app) as client:
+        for _ in range(5):
+            assert client.get("/livez").status_code == 200
+            assert client.get("/readyz").status_code == 200
+            assert client.get("/health").json() == {"status": "ok", "messages": []}
+        # Probes never run the model; only the monitor's one startup check did.
+        assert calls == [["health check"]]
+
+        def down():
+            raise ConnectionError("store unreachable")
+
+        monkeypatch.setattr(query_service.INDEX.index, "describe_index_stats", down)
+        deadline = time.time() + 2
+        while client.get("/readyz").status_code == 200 and time.time() < deadline:
+            time.sleep(0.02)
+        resp = client.get("/readyz")
+        assert resp.status_code == 503
+        assert resp.json()["checks"]["vectorstore"]["error"] == "store unreachable"
+        assert client.get("/health").json()["messages"] == ["vectorstore_error: store unreachable"]
+        assert client.get("/livez").status_code == 200
+
+
+def test_unscoped_pinecone_queries_cost_one_request_per_repo_up_to_a_cap(monkeypatch):
+    from api import query_service
+    from vectorstore.base import QueryScopeError
+    from vectorstore.pinecone import PineconeStore
+
+    class ManyRepos(FakeIndex):
+        def __init__(self, repos):
+            super().__init__()
+            self.repos = repos
+            self.stats_calls = 0
+
+        def describe_index_stats(self):
+            self.stats_calls += 1
+            return {"namespaces": {f"org/repo-{i}": {"vector_count": 1} for i in range(self.repos)}}
+
+    index = ManyRepos(40)
+    store = PineconeStore(index, max_namespaces=64)
+    for _ in range(3):
+        store.query([0.1] * 768, top_k=5)
+    # One request per namespace, and the namespace list is fetched once per TTL, not per query.
+    assert len(index.queries) == 3 * 40 and index.stats_calls == 1
+    assert len(store.query([0.1] * 768, top_k=5, namespace="org/repo-1")["matches"]) == 1
+    assert len(index.queries) == 3 * 40 + 1
+
+    index = ManyRepos(500)
+    store = PineconeStore(index, max_namespaces=64)
+    with pytest.raises(QueryScopeError, match="500 repositories"):
+        store.query([0.1] * 768, top_k=5)
+    assert index.queries == []
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        monkeypatch.setattr(query_service, "INDEX", store)
+        resp = client.post("/query", json={"query": "how are widgets rendered"})
+        assert resp.status_code == 400 and "narrow it with repo" in resp.json()["detail"]
+        assert client.post("/query", json={"query": "how are widgets rendered", "repo": "org/repo-7"}).status_code == 200
+
+
+def test_lexical_failure_falls_back_to_vector_results(monkeypatch):
+    import sqlite3
+
+    from api import query_service
+
+    def broken(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    with TestClient(query_service.app) as client:
+        query_service.QUERY_CACHE.clear()
+        monkeypatch.setattr(query_service.LEXICAL, "search", broken)
+        for query in ("useDisclosure", "where is useDisclosure defined"):
+            resp = client.post("/query", json={"query": query})
+            assert resp.status_code == 200
+            assert [r["id"] for r in resp.json()["results"]] == ["doc-1"]
+        # The degraded answers were not cached.
+        resp = client.post("/query/batch", json={"queries": [{"query": "useDisclosure"}]})
+        assert [r["id"] for r in resp.json()["responses"][0]["results"]] == ["doc-1"]
+        assert query_service.QUERY_CACHE.stats()["results"]["size"] == 0
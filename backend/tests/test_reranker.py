@@ -0,0 +1,51 @@
+import threading
+
+from services.reranker import Reranker, candidate_count
+
+
+def test_scores_one_batch_and_caches_pairs():
+    batches = []
+
+    def score(pairs):
+        batches.append(pairs)
+        return [float(len(text)) for _, text in pairs]
+
+    reranker = Reranker(score_fn=score)
+    assert reranker.scores("Find  Cards", [("a", "xx"), ("b", "xxxx")]) == [2.0, 4.0]
+    # Same pairs (query normalized), plus one new one: only the new pair reaches the model.
+    assert reranker.scores("find cards", [("b", "xxxx"), ("c", "x"), ("a", "xx")]) == [4.0, 1.0, 2.0]
+    assert batches == [[("Find  Cards", "xx"), ("Find  Cards", "xxxx")], [("find cards", "x")]]
+    # Changed text under the same id is rescored.
+    reranker.scores("find cards", [("a", "changed")])
+    assert len(batches) == 3
+
+
+def test_budget_timeout_falls_back_and_fills_cache_later():
+    release = threading.Event()
+    done = threading.Event()
+
+    def slow(pairs):
+        release.wait(5)
+        done.set()
+        return [1.0] * len(pairs)
+
+    reranker = Reranker(score_fn=slow)
+    assert reranker.scores("q", [("a", "t")], budget_ms=10) is None
+    assert reranker.stats()["timeouts"] == 1
+    release.set()
+    done.wait(5)
+    reranker._pool.submit(lambda: None).result(5)
+    assert reranker.scores("q", [("a", "t")], budget_ms=0) == [1.0]
+
+
+def test_model_errors_fall_back():
+    def broken(pairs):
+        raise RuntimeError("no model")
+
+    assert Reranker(score_fn=broken).scores("q", [("a", "t")]) is None
+
+
+def test_candidate_count():
+    assert candidate_count(5) == 20
+    assert candidate_count(40) == 50
+    assert candidate_count(80) == 80
@@ -0,0 +1,23 @@
+from services.snapshot_store import SnapshotStore, blob_sha
+
+
+def test_blob_sha_matches_git():
+    # `printf 'hello\n' | git hash-object --stdin`
+    assert blob_sha("hello\n") == "ce013625030ba8dba906f756967f9e9ca394464a"
+
+
+def test_reads_files_and_ranges_through_lru(tmp_path):
+    store = SnapshotStore(str(tmp_path), cache_files=1)
+    ascii_sha = store.put("IDENTIFICATION DIVISION.\nPROGRAM-ID. COCRDUPC.\n")
+    text = "# Café ☕\nMenü und Preise\n"
+    unicode_sha = store.put(text)
+    assert store.put(text) == unicode_sha
+
+    assert store.read(ascii_sha, 25, 36) == "PROGRAM-ID."
+    assert store.read(unicode_sha) == text
+    assert store.read(unicode_sha, 2, 6) == text[2:6]
+    assert store.read(ascii_sha, 0, 14) == "IDENTIFICATION"
+    assert store.read("0" * 40) is None
+    assert store.read("../" + ascii_sha) is None
+    assert store.stats()["open_files"] == 1
+    assert store.stats()["misses"] == 4
@@ -0,0 +1,157 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# (id, values, metadata) — the same tuple shape Pinecone's Index.upsert accepts.
+VectorRecord = Tuple[str, Sequence[float], Dict[str, Any]]
+# A single namespace, several of them, or None for every namespace in the index.
+Namespaces = Union[str, Sequence[str], None]
+
+
+class QueryScopeError(ValueError):
+    """A query spans more namespaces than the backend will search in one request; scope it by repo."""
+
+
+class VectorStore(ABC):
+    """Minimal Index-like interface shared by every vector backend.
+
+    The method names and response shapes deliberately mirror the Pinecone
+    ``Index`` object so the query services and ingest code can treat a remote
+    index and the embedded local index the same way.
+
+    Vectors are partitioned into namespaces (ingest uses one per repo_id).
+    Writes target a single namespace, ``""`` by default. Queries may name one
+    namespace, several, or None for all of them, and take a Pinecone-style
+    metadata ``filter`` (``$eq``, ``$ne``, ``$in``, ``$nin``, ``$and``, ``$or``).
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: Iterable[VectorRecord], namespace: str = "") -> Dict[str, int]:
+        """Insert or overwrite vectors. Returns ``{"upserted_count": n}``."""
+
+    @abstractmethod
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Return ``{"matches": [{"id", "score", "metadata"}, ...]}`` best first."""
+
+    def query_many(
+        self,
+        vectors: Sequence[Sequence[float]],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Run several queries with the same options; one response per vector, in order."""
+        return [self.query(v, top_k=top_k, include_metadata=include_metadata, namespace=namespace, filter=filter) for v in vectors]
+
+    @abstractmethod
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        """Remove vectors by id. Unknown ids are ignored."""
+
+    @abstractmethod
+    def update_metadata(self, id: str, set_metadata: Dict[str, Any], namespace: str = "") -> None:
+        """Merge ``set_metadata`` into the metadata of an existing vector (Pinecone's ``update``)."""
+
+    @abstractmethod
+    def describe_index_stats(self) -> Dict[str, Any]:
+        """Return ``total_vector_count``, ``dimension``, ``metric``, ``vector_type`` and per-namespace counts."""
+
+    def generation(self) -> Any:
+        """Opaque token that changes when the stored vectors or metadata change; None if unknown."""
+        return None
+
+    def maybe_build_ann(self) -> bool:
+        """Build or refresh an approximate index after bulk writes. Returns True if one was built."""
+        return False
+
+    def close(self) -> None:
+        """Release any resources held by the store."""
+
+
+def normalize_matches(response: Any) -> List[Dict[str, Any]]:
+    """Turn a dict- or object-shaped query response into a list of match dicts."""
+    if isinstance(response, dict):
+        raw = response.get("matches", []) or []
+    else:
+        raw = getattr(response, "matches", []) or []
+
+    matches = []
+    for m in raw:
+        if isinstance(m, dict):
+            matches.append(m)
+        else:
+            matches.append(
+                {
+                    "id": getattr(m, "id", ""),
+                    "score": getattr(m, "score", 0.0),
+                    "metadata": getattr(m, "metadata", None) or {},
+                }
+            )
+    return matches
+
+
+def build_filter(
+    file_type: Union[str, Sequence[str], None] = None,
+    path_prefix: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Metadata filter for the query API's ``file_type`` and ``path_prefix`` options.
+
+    Pinecone has no prefix operator, so ingest stores every ancestor directory
+    of a chunk's file under ``dirs``; a prefix matches a directory or a path.
+    """
+    clauses = []
+    if file_type:
+        types = [file_type] if isinstance(file_type, str) else list(file_type)
+        clauses.append({"file_type": {"$in": types}})
+    prefix = (path_prefix or "").strip("/")
+    if prefix:
+        clauses.append({"$or": [{"dirs": {"$in": [prefix]}}, {"path": {"$eq": prefix}}]})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def path_dirs(path: str) -> List[str]:
+    """Ancestor directories of ``path``: ``"a/b/c.py"`` -> ``["a", "a/b"]``."""
+    parts = path.strip("/").split("/")[:-1]
+    return ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+
+def merge_matches(results: Iterable[List[Dict[str, Any]]], top_k: int, higher_is_better: bool = True) -> List[Dict[str, Any]]:
+    """Merge per-namespace match lists into one best-first top-k list."""
+    merged = [m for matches in results for m in matches]
+    merged.sort(key=lambda m: m.get("score") or 0.0, reverse=higher_is_better)
+    return merged[:top_k]
+
+
+def match_filter(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    """Evaluate a Pinecone-style metadata filter in Python; list fields match element-wise."""
+    for key, cond in filter.items():
+        if key == "$and":
+            if not all(match_filter(metadata, sub) for sub in cond):
+                return False
+            continue
+        if key == "$or":
+            if not any(match_filter(metadata, sub) for sub in cond):
+                return False
+            continue
+        value = metadata.get(key)
+        values = value if isinstance(value, list) else [] if value is None else [value]
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, operand in cond.items():
+            if op in ("$eq", "$ne"):
+                hit = operand in values
+            elif op in ("$in", "$nin"):
+                hit = any(v in operand for v in values)
+            else:
+                raise ValueError(f"Unsupported filter operator '{op}'")
+            if hit != (op in ("$eq", "$in")):
+                return False
+    return True
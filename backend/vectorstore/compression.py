@@ -0,0 +1,251 @@
+"""Compressed vector codes for the local store, and their memory/recall evaluation.
+
+A codec is described by a spec string: an optional reduction stage followed
+by a quantizer, e.g. ``pca256-int8``, ``truncate384-int8``, ``pq96`` or
+``pca256-pq64``.
+
+* ``pcaN`` projects onto the top N principal components of a sample;
+  ``truncateN`` keeps the first N dimensions (Matryoshka-style, for models
+  trained to front-load information).
+* ``int8`` scalar-quantizes each remaining dimension to one byte;
+  ``pqM`` product-quantizes into M one-byte codes (256 centroids per subspace).
+
+Codes only rank candidates: :class:`vectorstore.local.LocalVectorStore`
+rescores the best of them against the full-precision vectors on disk.
+``python -m vectorstore.compression`` reports the trade-off on a local index::
+
+    python -m vectorstore.compression .gitsense/index/gitsense-index --specs int8 pca256-int8 pq96
+"""
+import argparse
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+_SPEC = re.compile(r"^(?:(pca|truncate)(\d+)-)?(int8|pq(\d+))$")
+_PQ_CENTROIDS = 256
+_BLOCK = 65536
+
+
+def parse_spec(spec: str) -> Dict[str, Any]:
+    """Split a codec spec into ``reduction``, ``dims``, ``quantizer`` and ``subvectors``."""
+    match = _SPEC.match(spec.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid compression spec '{spec}' (expected e.g. 'int8', 'pca256-int8' or 'pq96')")
+    reduction, dims, quantizer, subvectors = match.groups()
+    return {
+        "reduction": reduction,
+        "dims": int(dims) if dims else None,
+        "quantizer": "pq" if subvectors else quantizer,
+        "subvectors": int(subvectors) if subvectors else None,
+    }
+
+
+def _kmeans(sample: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Plain Lloyd's k-means under L2 distance."""
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        dists = (sample**2).sum(1)[:, None] - 2 * sample @ centroids.T + (centroids**2).sum(1)[None, :]
+        assign = np.argmin(dists, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class VectorCodec:
+    """Fitted reduction + quantization of float32 vectors into compact byte codes.
+
+    Scores computed from codes match the store's convention (higher is better)
+    only up to a per-query constant, which is all candidate ranking needs.
+    """
+
+    def __init__(self, spec: str, metric: str, arrays: Dict[str, np.ndarray]):
+        self.spec = spec
+        self.metric = metric
+        self.arrays = arrays
+        parsed = parse_spec(spec)
+        self.quantizer = parsed["quantizer"]
+
+    @classmethod
+    def fit(cls, sample: np.ndarray, spec: str, metric: str = "cosine", iterations: int = 10, seed: int = 0) -> "VectorCodec":
+        parsed = parse_spec(spec)
+        sample = np.asarray(sample, dtype=np.float32)
+        dim = sample.shape[1]
+        dims = min(parsed["dims"] or dim, dim)
+        mean = np.zeros(dim, dtype=np.float32)
+        if parsed["reduction"] == "pca":
+            mean = sample.mean(axis=0)
+            # Right singular vectors of the centred sample are the principal axes.
+            _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+            basis = vt[:dims].T.astype(np.float32)
+        else:
+            basis = np.eye(dim, dims, dtype=np.float32)
+        arrays = {"mean": mean, "basis": basis}
+        reduced = (sample - mean) @ basis
+
+        if parsed["quantizer"] == "int8":
+            lo, hi = np.percentile(reduced, [0.1, 99.9], axis=0)
+            arrays["lo"] = lo.astype(np.float32)
+            arrays["scale"] = (np.maximum(hi - lo, 1e-6) / 255).astype(np.float32)
+        else:
+            m = parsed["subvectors"]
+            if dims % m:
+                raise ValueError(f"pq{m} needs a dimension divisible by {m}, got {dims}")
+            if len(sample) < _PQ_CENTROIDS:
+                raise ValueError(f"Product quantization needs at least {_PQ_CENTROIDS} sample vectors")
+            rng = np.random.default_rng(seed)
+            sub = dims // m
+            arrays["codebooks"] = np.stack(
+                [_kmeans(reduced[:, j * sub : (j + 1) * sub], _PQ_CENTROIDS, iterations, rng) for j in range(m)]
+            ).astype(np.float32)
+        return cls(spec, metric, arrays)
+
+    @property
+    def bytes_per_vector(self) -> int:
+        if self.quantizer == "int8":
+            return int(self.arrays["basis"].shape[1])
+        return int(self.arrays["codebooks"].shape[0])
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        return (np.asarray(vectors, dtype=np.float32) - self.arrays["mean"]) @ self.arrays["basis"]
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Byte codes for ``vectors`` (rows of the store's prepared vectors)."""
+        out = []
+        for start in range(0, len(vectors), _BLOCK):
+            reduced = self.project(vectors[start : start + _BLOCK])
+            if self.quantizer == "int8":
+                codes = np.rint((reduced - self.arrays["lo"]) / self.arrays["scale"])
+                out.append(np.clip(codes, 0, 255).astype(np.uint8))
+            else:
+                books = self.arrays["codebooks"]
+                m, _, sub = books.shape
+                codes = np.empty((len(reduced), m), dtype=np.uint8)
+                for j in range(m):
+                    part = reduced[:, j * sub : (j + 1) * sub]
+                    dists = -2 * part @ books[j].T + (books[j] ** 2).sum(1)[None, :]
+                    codes[:, j] = np.argmin(dists, axis=1)
+                out.append(codes)
+        if not out:
+            return np.empty((0, self.bytes_per_vector), dtype=np.uint8)
+        return np.concatenate(out)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate similarity of each query against each code row; higher is better."""
+        queries = np.asarray(queries, dtype=np.float32)
+        euclidean = self.metric == "euclidean"
+        # Inner products keep the query uncentred: q.x = q.mean + q.(x - mean), and q.mean is constant per query.
+        reduced = (queries - self.arrays["mean"] if euclidean else queries) @ self.arrays["basis"]
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK):
+            block = codes[start : start + _BLOCK]
+            if self.quantizer == "int8":
+                decoded = block.astype(np.float32) * self.arrays["scale"] + self.arrays["lo"]
+                sims = reduced @ decoded.T
+                if euclidean:
+                    sims = 2 * sims - np.einsum("ij,ij->i", decoded, decoded)[None, :]
+                out[:, start : start + len(block)] = sims
+                continue
+            books = self.arrays["codebooks"]
+            m, _, sub = books.shape
+            index = block.astype(np.intp)
+            for i, part in enumerate(reduced.reshape(len(reduced), m, sub)):
+                # Asymmetric distance computation: an (m x 256) lookup table per query.
+                table = np.einsum("ms,mcs->mc", part, books)
+                if euclidean:
+                    table = 2 * table - (books**2).sum(-1)
+                out[i, start : start + len(block)] = table[np.arange(m)[None, :], index].sum(-1)
+        return out
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, spec=np.array(self.spec), metric=np.array(self.metric), **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorCodec":
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in data.files if k not in ("spec", "metric")}
+            return cls(str(data["spec"]), str(data["metric"]), arrays)
+
+
+def evaluate(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    specs: Sequence[str],
+    metric: str = "cosine",
+    k: int = 10,
+    rescore_factor: int = 4,
+    sample_size: int = 65536,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Memory and recall@k of each codec spec against exact full-precision search.
+
+    ``recall`` ranks by codes alone; ``recall_rescored`` rescoring the top
+    ``k * rescore_factor`` candidates at full precision, as the local store does.
+    """
+
+    def exact(q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        block = vectors if rows is None else vectors[rows]
+        sims = q @ block.T
+        if metric == "euclidean":
+            sims = 2 * sims - np.einsum("ij,ij->i", block, block)[None, :]
+        return sims
+
+    truth = np.argsort(-exact(queries), axis=1)[:, :k]
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False))]
+    full_bytes = vectors.shape[1] * 4
+    report = []
+    for spec in specs:
+        codec = VectorCodec.fit(sample, spec, metric=metric, seed=seed)
+        codes = codec.encode(vectors)
+        approx = codec.scores(queries, codes)
+        depth = min(k * rescore_factor, len(vectors))
+        recall, rescored = [], []
+        for i, q in enumerate(queries):
+            top = np.argsort(-approx[i])[:depth]
+            expected = set(truth[i].tolist())
+            recall.append(len(expected & set(top[:k].tolist())) / k)
+            refined = top[np.argsort(-exact(q[None, :], top)[0])[:k]]
+            rescored.append(len(expected & set(refined.tolist())) / k)
+        report.append(
+            {
+                "spec": spec,
+                "bytes_per_vector": codec.bytes_per_vector,
+                "compression": round(full_bytes / codec.bytes_per_vector, 1),
+                f"recall@{k}": round(float(np.mean(recall)), 4),
+                f"recall@{k}_rescored": round(float(np.mean(rescored)), 4),
+            }
+        )
+    return report
+
+
+if __name__ == "__main__":
+    from vectorstore.local import LocalVectorStore
+    from vectorstore.pinecone import METRIC, VECTOR_DIM
+
+    parser = argparse.ArgumentParser(description="Report memory and recall of vector compression settings on a local index.")
+    parser.add_argument("path", help="Directory of a local vector index")
+    parser.add_argument("--specs", nargs="+", default=["int8", "pca384-int8", "pca256-int8", "pq96", "pca256-pq64"])
+    parser.add_argument("--queries", type=int, default=200, help="Stored vectors (plus noise) used as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    store = LocalVectorStore(args.path, dimension=VECTOR_DIM, metric=METRIC)
+    vectors = store.live_vectors()
+    rng = np.random.default_rng(1)
+    picks = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = picks + 0.05 * rng.standard_normal(picks.shape, dtype=np.float32) / np.sqrt(picks.shape[1])
+    if METRIC == "cosine":
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    result = evaluate(vectors, queries, args.specs, metric=METRIC, k=args.k, rescore_factor=args.rescore_factor)
+    print(json.dumps({"vectors": len(vectors), "full_bytes_per_vector": vectors.shape[1] * 4, "specs": result}, indent=2))
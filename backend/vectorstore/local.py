@@ -0,0 +1,652 @@
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vectorstore.base import Namespaces, VectorRecord, VectorStore
+from vectorstore.compression import VectorCodec
+
+logger = logging.getLogger(__name__)
+
+# Switch from exact scans to the IVF index once the store holds this many vectors.
+LOCAL_ANN_THRESHOLD = int(os.getenv("LOCAL_ANN_THRESHOLD", "200000"))
+# Number of IVF lists scanned per query; higher trades latency for recall.
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "16"))
+# How often (seconds) a reader checks whether another process has written to the store.
+LOCAL_RELOAD_INTERVAL = float(os.getenv("LOCAL_RELOAD_INTERVAL", "5"))
+# Optional in-memory vector codes, e.g. "pca256-int8" or "pq96" (see vectorstore.compression); empty keeps float32 only.
+LOCAL_COMPRESSION = os.getenv("LOCAL_COMPRESSION", "")
+# With compression, this many candidates per requested result are rescored at full precision.
+LOCAL_RESCORE_FACTOR = int(os.getenv("LOCAL_RESCORE_FACTOR", "4"))
+
+_VECTORS_FILE = "vectors.f32"
+_ROWS_DB = "rows.sqlite"
+_IVF_FILES = ("ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy")
+# Fitted codec and its uint8 codes (one row per vector row), versioned so a refit never mixes the two.
+_CODEC_FILE = "codec-{}.npz"
+_CODES_FILE = "codes-{}.u8"
+# Written by stores that re-encoded every vector on open instead of persisting codes.
+_LEGACY_CODEC_FILE = "codec.npz"
+# Codecs are fitted once the store holds this many live vectors.
+_COMPRESS_MIN_ROWS = 1024
+_INITIAL_CAPACITY = 1024
+_SCAN_BLOCK = 65536
+# Rebuild the IVF index once this fraction of rows was added or changed since the last build.
+_IVF_STALE_FRACTION = 0.1
+# Row masks of recently used metadata filters, dropped on every write.
+_FILTER_CACHE_SIZE = 64
+_FIELD = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+class _IVF:
+    """Inverted-file index: rows grouped by their nearest coarse centroid."""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, built_count: int):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.built_count = built_count
+
+    def candidates(self, probe: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.order[self.offsets[c] : self.offsets[c + 1]] for c in probe])
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector index backed by a memory-mapped float32 matrix.
+
+    Vectors live in ``vectors.f32`` (one row per id, L2-normalized for the
+    cosine metric) and ids/metadata in a small SQLite table next to it.
+    Small stores are searched exactly with blocked matrix products; once the
+    store reaches ``ann_threshold`` vectors an IVF index is built by the writer
+    (see :meth:`maybe_build_ann`) and queries only scan the ``nprobe`` closest
+    lists plus any rows appended since the last build.
+
+    Namespaces and metadata filters become a boolean row mask; when the mask
+    selects fewer than ``ann_threshold`` rows they are scanned exactly rather
+    than through the IVF lists, so selective filters keep full recall. Ids are
+    unique across namespaces (upserting an id into another namespace moves it).
+
+    With ``compression`` set, a codec fitted on a sample of the stored vectors
+    (see :meth:`compress`) keeps compact byte codes of every row in memory.
+    Scans and IVF probes rank rows by their codes, and only the best
+    ``top_k * rescore_factor`` candidates are rescored against the float32 rows
+    on disk, so the memory-mapped matrix no longer needs to stay resident.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int = 768,
+        metric: str = "cosine",
+        ann_threshold: int = LOCAL_ANN_THRESHOLD,
+        nprobe: int = LOCAL_IVF_NPROBE,
+        reload_interval: float = LOCAL_RELOAD_INTERVAL,
+        compression: str = LOCAL_COMPRESSION,
+        rescore_factor: int = LOCAL_RESCORE_FACTOR,
+    ):
+        if metric not in ("cosine", "dotproduct", "euclidean"):
+            raise ValueError(f"Unsupported metric '{metric}'")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.reload_interval = reload_interval
+        self.compression = compression
+        self.rescore_factor = rescore_factor
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(path, _ROWS_DB), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, metadata TEXT NOT NULL, alive INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(rows)")}
+        if "namespace" not in columns:
+            self._db.execute("ALTER TABLE rows ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+        self._db.commit()
+        self._check_info()
+
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._ivf: Optional[_IVF] = None
+        self._codec: Optional[VectorCodec] = None
+        self._codec_version: Optional[str] = None
+        self._codes: Optional[np.memmap] = None
+        self._load()
+
+    def _check_info(self) -> None:
+        info = self._info()
+        if "dimension" not in info:
+            self._set_info(dimension=self.dimension, metric=self.metric)
+            self._db.commit()
+            return
+        if int(info["dimension"]) != self.dimension or info["metric"] != self.metric:
+            raise ValueError(
+                f"Local index at '{self.path}' was created with dimension={info['dimension']} "
+                f"metric={info['metric']}, not dimension={self.dimension} metric={self.metric}"
+            )
+
+    def _info(self) -> Dict[str, str]:
+        return dict(self._db.execute("SELECT key, value FROM info").fetchall())
+
+    def _set_info(self, **values: Any) -> None:
+        self._db.executemany(
+            "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+            [(k, str(v)) for k, v in values.items()],
+        )
+
+    def _bump_generation(self) -> None:
+        """Count a write in the info table, inside the caller's transaction."""
+        self._db.execute(
+            "INSERT INTO info (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        self._generation = self._info()["generation"]
+
+    def _load(self) -> None:
+        """(Re)read ids, tombstones, the vector file and the IVF index from disk."""
+        rows = self._db.execute("SELECT row, id, alive, namespace FROM rows ORDER BY row").fetchall()
+        count = rows[-1][0] + 1 if rows else 0
+        self._ids: List[Optional[str]] = [None] * count
+        self._row_of: Dict[str, int] = {}
+        self._count = count
+        self._open_vectors(max(count, _INITIAL_CAPACITY))
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._ns_codes: Dict[str, int] = {}
+        self._ns_of = np.zeros(self._capacity, dtype=np.int32)
+        for row, id_, alive, namespace in rows:
+            self._ids[row] = id_
+            self._row_of[id_] = row
+            self._alive[row] = bool(alive)
+            self._ns_of[row] = self._ns_code(namespace)
+        self._filter_masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._ivf = self._load_ivf()
+        self._load_codec()
+        self._generation = self._info().get("generation", "0")
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self._last_reload_check = time.monotonic()
+
+    def _maybe_reload(self) -> None:
+        """Pick up writes committed by another process (e.g. a separate ingest run)."""
+        now = time.monotonic()
+        if now - self._last_reload_check < self.reload_interval:
+            return
+        self._last_reload_check = now
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            logger.info("Local index '%s' changed on disk; reloading", self.path)
+            self._load()
+
+    def _open_vectors(self, capacity: int) -> None:
+        file_path = os.path.join(self.path, _VECTORS_FILE)
+        row_bytes = self.dimension * np.dtype(np.float32).itemsize
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        if size < capacity * row_bytes:
+            with open(file_path, "ab") as fh:
+                fh.truncate(capacity * row_bytes)
+            size = capacity * row_bytes
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._capacity = size // row_bytes
+        self._vectors = np.memmap(file_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dimension))
+
+    def _ensure_capacity(self, needed: int) -> None:
+        if needed <= self._capacity:
+            return
+        self._open_vectors(max(needed, self._capacity * 2))
+        alive = np.zeros(self._capacity, dtype=bool)
+        alive[: len(self._alive)] = self._alive
+        self._alive = alive
+        ns_of = np.zeros(self._capacity, dtype=np.int32)
+        ns_of[: len(self._ns_of)] = self._ns_of
+        self._ns_of = ns_of
+        if self._codes is not None:
+            self._open_codes(self._capacity)
+
+    def _ns_code(self, namespace: str) -> int:
+        return self._ns_codes.setdefault(namespace, len(self._ns_codes))
+
+    def _prepare(self, values: Any) -> np.ndarray:
+        mat = np.asarray(values, dtype=np.float32)
+        if mat.ndim == 1:
+            mat = mat.reshape(1, -1)
+        if mat.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of dimension {self.dimension}, got {mat.shape[1]}")
+        if self.metric == "cosine":
+            norms = np.linalg.norm(mat, axis=1, keepdims=True)
+            mat = mat / np.where(norms == 0, 1.0, norms)
+        return mat
+
+    def upsert(self, vectors: Iterable[VectorRecord], namespace: str = "") -> Dict[str, int]:
+        ids, values, metadatas = [], [], []
+        for record in vectors:
+            if isinstance(record, dict):
+                record = (record["id"], record["values"], record.get("metadata") or {})
+            id_, vals, meta = (tuple(record) + ({},))[:3]
+            ids.append(str(id_))
+            values.append(vals)
+            metadatas.append(meta or {})
+        if not ids:
+            return {"upserted_count": 0}
+        mat = self._prepare(values)
+
+        with self._lock:
+            rows = []
+            changed = 0
+            for id_ in ids:
+                row = self._row_of.get(id_)
+                if row is None:
+                    row = self._count
+                    self._count += 1
+                    self._row_of[id_] = row
+                    self._ids.append(id_)
+                elif self._ivf is not None and row < self._ivf.built_count:
+                    changed += 1
+                rows.append(row)
+            self._ensure_capacity(self._count)
+            self._vectors[rows] = mat
+            self._vectors.flush()
+            if self._codec is not None:
+                # Codes are written before the rows commit, like the vectors, so every committed row has them.
+                self._codes[rows] = self._codec.encode(mat)
+                self._codes.flush()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, metadata, alive, namespace) VALUES (?, ?, ?, 1, ?)",
+                [(row, id_, json.dumps(meta), namespace) for row, id_, meta in zip(rows, ids, metadatas)],
+            )
+            if changed:
+                stale = int(self._info().get("ivf_changed", "0")) + changed
+                self._set_info(ivf_changed=stale)
+            self._bump_generation()
+            self._db.commit()
+            self._alive[rows] = True
+            self._ns_of[rows] = self._ns_code(namespace)
+            self._filter_masks.clear()
+        return {"upserted_count": len(ids)}
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        with self._lock:
+            code = self._ns_codes.get(namespace)
+            rows = [self._row_of[i] for i in ids if i in self._row_of and self._ns_of[self._row_of[i]] == code]
+            if not rows:
+                return
+            self._db.executemany("UPDATE rows SET alive = 0 WHERE row = ?", [(r,) for r in rows])
+            self._bump_generation()
+            self._db.commit()
+            self._alive[rows] = False
+
+    def update_metadata(self, id: str, set_metadata: Dict[str, Any], namespace: str = "") -> None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT metadata FROM rows WHERE id = ? AND namespace = ? AND alive = 1", (id, namespace)
+            ).fetchone()
+            if row is None:
+                return
+            metadata = {**json.loads(row[0]), **set_metadata}
+            self._db.execute("UPDATE rows SET metadata = ? WHERE id = ?", (json.dumps(metadata), id))
+            self._bump_generation()
+            self._db.commit()
+            self._filter_masks.clear()
+
+    def _filter_sql(self, filter: Dict[str, Any], params: List[Any]) -> str:
+        """Translate a Pinecone-style metadata filter into a WHERE clause over ``rows.metadata``."""
+        clauses = []
+        for key, cond in filter.items():
+            if key in ("$and", "$or"):
+                parts = [self._filter_sql(sub, params) for sub in cond]
+                clauses.append("(" + f" {key[1:].upper()} ".join(parts or ["1"]) + ")")
+                continue
+            if not _FIELD.match(key):
+                raise ValueError(f"Unsupported metadata field '{key}'")
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            for op, value in cond.items():
+                values = list(value) if op in ("$in", "$nin") else [value]
+                if op not in ("$eq", "$ne", "$in", "$nin"):
+                    raise ValueError(f"Unsupported filter operator '{op}'")
+                # json_each walks list fields element-wise and yields scalars as themselves.
+                exists = (
+                    f"EXISTS (SELECT 1 FROM json_each(rows.metadata, ?) "
+                    f"WHERE json_each.value IN ({','.join('?' * len(values)) or 'NULL'}))"
+                )
+                params.append(f'$."{key}"')
+                params.extend(values)
+                clauses.append(f"NOT {exists}" if op in ("$ne", "$nin") else exists)
+        return "(" + " AND ".join(clauses or ["1"]) + ")"
+
+    def _row_mask(self, namespace: Namespaces, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Rows allowed by ``namespace`` and ``filter``, or None when every row is."""
+        mask = None
+        if namespace is not None:
+            names = [namespace] if isinstance(namespace, str) else list(namespace)
+            codes = [self._ns_codes[n] for n in names if n in self._ns_codes]
+            mask = np.isin(self._ns_of[: self._count], codes)
+        if filter:
+            key = json.dumps(filter, sort_keys=True)
+            cached = self._filter_masks.get(key)
+            if cached is None:
+                params: List[Any] = []
+                where = self._filter_sql(filter, params)
+                rows = [r for (r,) in self._db.execute(f"SELECT row FROM rows WHERE alive = 1 AND {where}", params)]
+                cached = np.zeros(self._count, dtype=bool)
+                cached[rows] = True
+                self._filter_masks[key] = cached
+                while len(self._filter_masks) > _FILTER_CACHE_SIZE:
+                    self._filter_masks.popitem(last=False)
+            else:
+                self._filter_masks.move_to_end(key)
+            mask = cached if mask is None else mask & cached
+        return mask
+
+    def _scores(self, queries: np.ndarray, block: np.ndarray) -> np.ndarray:
+        """Similarity of each query against each row; higher is always better."""
+        sims = queries @ block.T
+        if self.metric == "euclidean":
+            sims = 2 * sims - np.einsum("ij,ij->i", block, block)[None, :] - np.einsum("ij,ij->i", queries, queries)[:, None]
+        return sims
+
+    def _kmeans(self, sample: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+        centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(self._scores(sample, centroids), axis=1)
+            counts = np.bincount(assign, minlength=k)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            if empty.any():
+                centroids[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+            if self.metric == "cosine":
+                centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return centroids
+
+    def build_ann(self, nlist: Optional[int] = None, sample_size: int = 65536, iterations: int = 10, seed: int = 0) -> None:
+        """Train the IVF coarse quantizer on a sample of live rows and persist it."""
+        with self._lock:
+            count = self._count
+            live = np.flatnonzero(self._alive[:count])
+            if len(live) == 0:
+                return
+            nlist = nlist or max(1, min(int(4 * math.sqrt(len(live))), 65536))
+            nlist = min(nlist, len(live), sample_size)
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))
+            centroids = self._kmeans(np.array(self._vectors[sample_rows]), nlist, iterations, rng)
+
+            assign = np.empty(count, dtype=np.int32)
+            for start in range(0, count, _SCAN_BLOCK):
+                block = self._vectors[start : start + _SCAN_BLOCK]
+                assign[start : start + len(block)] = np.argmax(self._scores(block, centroids), axis=1)
+            order = np.argsort(assign, kind="stable").astype(np.int64)
+            offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+
+            for name, arr in zip(_IVF_FILES, (centroids, order, offsets)):
+                tmp = os.path.join(self.path, name + ".tmp")
+                with open(tmp, "wb") as fh:
+                    np.save(fh, arr)
+                os.replace(tmp, os.path.join(self.path, name))
+            self._set_info(ivf_built_count=count, ivf_changed=0)
+            self._db.commit()
+            self._ivf = _IVF(centroids, order, offsets, count)
+            logger.info("Built IVF index for '%s' (%d vectors, %d lists)", self.path, count, nlist)
+
+    def _open_codes(self, capacity: int) -> None:
+        """Memory-map the current codec's codes file with room for ``capacity`` rows."""
+        file_path = os.path.join(self.path, _CODES_FILE.format(self._codec_version))
+        row_bytes = self._codec.bytes_per_vector
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        if size < capacity * row_bytes:
+            with open(file_path, "ab") as fh:
+                fh.truncate(capacity * row_bytes)
+        if self._codes is not None:
+            self._codes.flush()
+        self._codes = np.memmap(file_path, dtype=np.uint8, mode="r+", shape=(capacity, row_bytes))
+
+    def _load_codec(self) -> None:
+        version = self._info().get("codec_version")
+        if version is None:
+            self._codec, self._codec_version, self._codes = None, None, None
+            legacy = os.path.join(self.path, _LEGACY_CODEC_FILE)
+            if os.path.exists(legacy):
+                # One-off migration: encode with the saved codec and persist the codes.
+                self._install_codec(VectorCodec.load(legacy))
+                os.remove(legacy)
+            return
+        if version == self._codec_version and self._codes is not None:
+            self._open_codes(self._capacity)
+            return
+        self._codec = VectorCodec.load(os.path.join(self.path, _CODEC_FILE.format(version)))
+        self._codec_version, self._codes = version, None
+        self._open_codes(self._capacity)
+
+    def _install_codec(self, codec: VectorCodec) -> None:
+        """Encode every row with ``codec`` into a new codes file, then switch the store over to it."""
+        previous = self._codec_version
+        version = str(int(previous or 0) + 1)
+        codes_path = os.path.join(self.path, _CODES_FILE.format(version))
+        codes = np.memmap(codes_path, dtype=np.uint8, mode="w+", shape=(self._capacity, codec.bytes_per_vector))
+        for start in range(0, self._count, _SCAN_BLOCK):
+            stop = min(start + _SCAN_BLOCK, self._count)
+            codes[start:stop] = codec.encode(self._vectors[start:stop])
+        codes.flush()
+        codec.save(os.path.join(self.path, _CODEC_FILE.format(version)))
+        # The info row is the switch: readers only ever see a codec together with its complete codes.
+        self._set_info(codec_spec=codec.spec, codec_version=version)
+        self._db.commit()
+        self._codec, self._codec_version, self._codes = codec, version, codes
+        if previous is not None:
+            for name in (_CODEC_FILE, _CODES_FILE):
+                try:
+                    os.remove(os.path.join(self.path, name.format(previous)))
+                except FileNotFoundError:
+                    pass
+
+    def compress(self, spec: Optional[str] = None, sample_size: int = 65536, seed: int = 0) -> None:
+        """Fit a codec (``spec`` or the store's ``compression``) on live rows and encode every row."""
+        spec = spec or self.compression
+        with self._lock:
+            live = np.flatnonzero(self._alive[: self._count])
+            if len(live) == 0:
+                return
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))
+            codec = VectorCodec.fit(np.array(self._vectors[sample]), spec, metric=self.metric, seed=seed)
+            self._install_codec(codec)
+            logger.info(
+                "Compressed '%s' with %s: %d -> %d bytes per vector",
+                self.path, spec, self.dimension * 4, codec.bytes_per_vector,
+            )
+
+    def maybe_compress(self) -> bool:
+        """Fit the configured codec once there is enough data, or refit after ``compression`` changed."""
+        if not self.compression:
+            return False
+        with self._lock:
+            if self._codec is not None and self._codec.spec == self.compression:
+                return False
+            if int(self._alive[: self._count].sum()) < _COMPRESS_MIN_ROWS:
+                return False
+            self.compress()
+            return True
+
+    def live_vectors(self) -> np.ndarray:
+        """Copy of every live full-precision vector (for offline evaluation)."""
+        with self._lock:
+            return np.array(self._vectors[np.flatnonzero(self._alive[: self._count])])
+
+    def maybe_build_ann(self) -> bool:
+        """Build or refresh the IVF index when the store is large enough and it is stale.
+
+        Also fits the configured compression codec once enough vectors exist.
+        """
+        self.maybe_compress()
+        with self._lock:
+            live = int(self._alive[: self._count].sum())
+            if live < self.ann_threshold:
+                return False
+            if self._ivf is not None:
+                info = self._info()
+                pending = (self._count - self._ivf.built_count) + int(info.get("ivf_changed", "0"))
+                if pending <= _IVF_STALE_FRACTION * self._ivf.built_count:
+                    return False
+            self.build_ann()
+            return True
+
+    def _load_ivf(self) -> Optional[_IVF]:
+        built = self._info().get("ivf_built_count")
+        paths = [os.path.join(self.path, name) for name in _IVF_FILES]
+        if built is None or not all(os.path.exists(p) for p in paths):
+            return None
+        centroids, order, offsets = (np.load(p) for p in paths)
+        return _IVF(centroids, order, offsets, int(built))
+
+    @staticmethod
+    def _top(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            scores, rows = scores[keep], rows[keep]
+        order = np.argsort(-scores, kind="stable")
+        return scores[order], rows[order]
+
+    def _search(
+        self, queries: np.ndarray, top_k: int, namespace: Namespaces = None, filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return (scores, rows) best-first for each query row."""
+        with self._lock:
+            self._maybe_reload()
+            count, vectors, ivf = self._count, self._vectors, self._ivf
+            codec, codes = self._codec, self._codes
+            mask = self._row_mask(namespace, filter)
+            alive = self._alive[:count] if mask is None else self._alive[:count] & mask
+        if count == 0 or top_k <= 0:
+            return [(np.empty(0, np.float32), np.empty(0, np.int64)) for _ in range(len(queries))]
+
+        if ivf is not None and mask is not None and int(alive.sum()) < self.ann_threshold:
+            # Selective filter: an exact scan of the allowed rows beats probing lists that may hold none of them.
+            ivf = None
+
+        # With codes, rank by them and keep a deeper candidate list for full-precision rescoring.
+        depth = top_k * max(self.rescore_factor, 1) if codec is not None else top_k
+
+        def scores_of(q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+            if codec is not None:
+                return codec.scores(q, codes[rows])
+            return self._scores(q, vectors[rows])
+
+        def rescore(q: np.ndarray, found: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+            if codec is None:
+                return found
+            rows = np.sort(found[1])
+            return self._top(self._scores(q[None, :], vectors[rows])[0], rows, top_k)
+
+        if ivf is not None:
+            probe = np.argsort(-self._scores(queries, ivf.centroids), axis=1)[:, : self.nprobe]
+            tail = np.arange(ivf.built_count, count)
+            results = []
+            for q, lists in zip(queries, probe):
+                cand = np.concatenate([ivf.candidates(lists), tail])
+                cand = np.sort(cand[alive[cand]])
+                scores = scores_of(q[None, :], cand)[0]
+                results.append(rescore(q, self._top(scores, cand, depth)))
+            return results
+
+        best = [(np.empty(0, np.float32), np.empty(0, np.int64)) for _ in range(len(queries))]
+        for start in range(0, count, _SCAN_BLOCK):
+            stop = min(start + _SCAN_BLOCK, count)
+            block_alive = alive[start:stop]
+            if not block_alive.any():
+                continue
+            block_rows = np.arange(start, stop)[block_alive]
+            scores = scores_of(queries, block_rows)
+            for i in range(len(queries)):
+                merged_scores = np.concatenate([best[i][0], scores[i]])
+                merged_rows = np.concatenate([best[i][1], block_rows])
+                best[i] = self._top(merged_scores, merged_rows, depth)
+        return [rescore(q, found) for q, found in zip(queries, best)]
+
+    def _matches(self, scores: np.ndarray, rows: np.ndarray, include_metadata: bool) -> List[Dict[str, Any]]:
+        metadata: Dict[int, Dict[str, Any]] = {}
+        if include_metadata and len(rows):
+            placeholders = ",".join("?" * len(rows))
+            with self._lock:
+                fetched = self._db.execute(
+                    f"SELECT row, metadata FROM rows WHERE row IN ({placeholders})", [int(r) for r in rows]
+                ).fetchall()
+            metadata = {row: json.loads(meta) for row, meta in fetched}
+        matches = []
+        for score, row in zip(scores, rows):
+            score = float(score)
+            if self.metric == "euclidean":
+                score = math.sqrt(max(-score, 0.0))
+            match = {"id": self._ids[int(row)], "score": score}
+            if include_metadata:
+                match["metadata"] = metadata.get(int(row), {})
+            matches.append(match)
+        return matches
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        scores, rows = self._search(self._prepare(vector), top_k, namespace, filter)[0]
+        return {"matches": self._matches(scores, rows, include_metadata)}
+
+    def query_many(
+        self,
+        vectors: Sequence[Sequence[float]],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Score all queries against each block of rows in one matrix product."""
+        if len(vectors) == 0:
+            return []
+        found = self._search(self._prepare(vectors), top_k, namespace, filter)
+        return [{"matches": self._matches(scores, rows, include_metadata)} for scores, rows in found]
+
+    def generation(self) -> str:
+        """Count of committed writes, kept in the store so writers in other processes bump it too."""
+        with self._lock:
+            self._maybe_reload()
+            return self._generation
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_reload()
+            alive = self._alive[: self._count]
+            total = int(alive.sum())
+            per_code = np.bincount(self._ns_of[: self._count][alive], minlength=len(self._ns_codes))
+            namespaces = {ns: {"vector_count": int(per_code[code])} for ns, code in self._ns_codes.items() if per_code[code]}
+        return {
+            "total_vector_count": total,
+            "dimension": self.dimension,
+            "metric": self.metric,
+            "vector_type": "dense",
+            "namespaces": namespaces,
+            "compression": self._codec.spec if self._codec is not None else None,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            if self._codes is not None:
+                self._codes.flush()
+            self._db.close()
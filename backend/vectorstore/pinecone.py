@@ -1,10 +1,17 @@
-from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
+import json
 import logging
 import os
-from typing import List, Tuple, Dict, Any
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Tuple, Dict, Any, Iterable, Optional, Sequence
 
 from services.embedding_service import embed_and_upsert
+from vectorstore.base import Namespaces, QueryScopeError, VectorRecord, VectorStore, merge_matches, normalize_matches
+
+if TYPE_CHECKING:
+    from pinecone import Pinecone
 
 
 load_dotenv()
@@ -17,21 +24,41 @@ PINECONE_REGION = os.getenv("PINECONE_REGION", "us-east-1")
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "gitsense-index")
 VECTOR_DIM = int(os.getenv("VECTOR_DIM", "768"))
 METRIC = os.getenv("PINECONE_METRIC", "cosine")
+# Upsert requests in flight per store, and the size one request may reach.
+# Pinecone rejects requests over 2 MB or 1000 vectors; the byte limit leaves headroom for our size estimate.
+PINECONE_UPSERT_WORKERS = int(os.getenv("PINECONE_UPSERT_WORKERS", "4"))
+PINECONE_UPSERT_MAX_BYTES = int(os.getenv("PINECONE_UPSERT_MAX_BYTES", str(1536 * 1024)))
+PINECONE_UPSERT_MAX_VECTORS = 1000
+# Attempts per request when Pinecone throttles (429) or is briefly unavailable (5xx, connection errors).
+PINECONE_MAX_RETRIES = int(os.getenv("PINECONE_MAX_RETRIES", "5"))
+PINECONE_RETRY_BASE_SECONDS = float(os.getenv("PINECONE_RETRY_BASE_SECONDS", "0.5"))
+
+# Pinecone searches one namespace (repo) per request, so an unscoped query costs one request per
+# repo: latency grows with ceil(namespaces / fan-out threads) round trips. Queries over more
+# namespaces than this are rejected instead of silently getting slower; callers must pass repo.
+PINECONE_MAX_QUERY_NAMESPACES = int(os.getenv("PINECONE_MAX_QUERY_NAMESPACES", "64"))
+
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
-def init_pinecone(api_key: str = None) -> Pinecone:
+def init_pinecone(api_key: str = None) -> "Pinecone":
     """Return a Pinecone client instance after validating credentials."""
     api_key = api_key or PINECONE_API_KEY
     if not api_key:
         raise RuntimeError("PINECONE_API_KEY is not set in environment")
 
+    # Imported on first use so the local backend never loads the SDK.
+    from pinecone import Pinecone
+
     pc = Pinecone(api_key=api_key)
     logger.info("Created Pinecone client")
     return pc
 
 
-def ensure_index(client: Pinecone, name: str = INDEX_NAME, dimension: int = VECTOR_DIM, metric: str = METRIC, region: str = PINECONE_REGION) -> None:
+def ensure_index(client: "Pinecone", name: str = INDEX_NAME, dimension: int = VECTOR_DIM, metric: str = METRIC, region: str = PINECONE_REGION) -> None:
     """Create the index if it doesn't already exist. Gracefully ignore 'already exists' errors."""
     # client.delete_index(name)
+    from pinecone import ServerlessSpec
+
     try:
         client.create_index(
             name,
@@ -49,7 +76,242 @@ def ensure_index(client: Pinecone, name: str = INDEX_NAME, dimension: int = VECT
             logger.exception("Failed to create index '%s'", name)
             raise
 
-def index_chunked_documents(client: Pinecone, index_name: str, chunked_docs: List[Dict[str, Any]], batch_size: int = 100) -> None:
+
+def _record_bytes(record: VectorRecord) -> int:
+    """Approximate JSON size of one upsert record: ~12 characters per float plus id and metadata."""
+    id_, values, metadata = record
+    return 12 * len(values) + len(id_) + len(json.dumps(metadata or {}, default=str)) + 48
+
+
+def payload_batches(
+    records: Sequence[VectorRecord],
+    max_bytes: int = PINECONE_UPSERT_MAX_BYTES,
+    max_vectors: int = PINECONE_UPSERT_MAX_VECTORS,
+) -> List[List[VectorRecord]]:
+    """Split records into consecutive upsert requests under ``max_bytes`` and ``max_vectors`` each.
+
+    Large metadata (long paths, duplicate path lists) shrinks a batch instead of
+    failing the request; a single record over the limit still gets its own batch.
+    """
+    batches: List[List[VectorRecord]] = []
+    batch: List[VectorRecord] = []
+    size = 0
+    for record in records:
+        n = _record_bytes(record)
+        if batch and (size + n > max_bytes or len(batch) >= max_vectors):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(record)
+        size += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds to wait if ``exc`` is throttling or a transient failure, else None."""
+    status = getattr(exc, "status", None) or getattr(exc, "status_code", None)
+    if status in _RETRYABLE_STATUS:
+        headers = getattr(exc, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError, AttributeError):
+            return 0.0
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return 0.0
+    return None
+
+
+def with_retries(fn, *args, retries: Optional[int] = None, base_delay: Optional[float] = None, **kwargs):
+    """Call ``fn``, retrying throttled and transient failures with jittered exponential backoff.
+
+    Only safe for idempotent calls; upserts qualify because chunk ids are deterministic.
+    """
+    retries = PINECONE_MAX_RETRIES if retries is None else retries
+    base_delay = PINECONE_RETRY_BASE_SECONDS if base_delay is None else base_delay
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as exc:
+            wait = _retry_after(exc)
+            if wait is None or attempt == retries:
+                raise
+            delay = max(wait, random.uniform(0, base_delay * 2**attempt))
+            logger.warning("Pinecone request failed (%s); retry %d/%d in %.2fs", exc, attempt + 1, retries, delay)
+            time.sleep(delay)
+
+
+class PineconeStore(VectorStore):
+    """VectorStore adapter around a Pinecone ``Index`` that returns plain dict matches.
+
+    Pinecone queries one namespace per request, so queries over several (or
+    all) namespaces are fanned out in parallel and merged by score. That costs
+    one request per namespace, so a query may span at most ``max_namespaces``
+    of them and raises QueryScopeError beyond that. Upserts are
+    split into requests by payload size and sent ``upsert_workers`` at a time,
+    each retried with backoff when Pinecone throttles.
+    """
+
+    def __init__(
+        self,
+        index,
+        metric: str = METRIC,
+        namespace_ttl: float = 30.0,
+        max_fanout: int = 8,
+        upsert_workers: int = PINECONE_UPSERT_WORKERS,
+        max_request_bytes: int = PINECONE_UPSERT_MAX_BYTES,
+        max_namespaces: int = PINECONE_MAX_QUERY_NAMESPACES,
+    ):
+        self.index = index
+        self.metric = metric
+        self.namespace_ttl = namespace_ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_fanout, thread_name_prefix="pinecone-fanout")
+        # Separate pool for query_many so its queries can still fan out without waiting on themselves.
+        self._batch_pool = ThreadPoolExecutor(max_workers=max_fanout, thread_name_prefix="pinecone-batch")
+        # Shared by every upsert call on this store; concurrent ingests share one store per index
+        # (vectorstore.store.shared_store), so together they stay within the bound.
+        self._upsert_pool = ThreadPoolExecutor(max_workers=max(1, upsert_workers), thread_name_prefix="pinecone-upsert")
+        self.max_request_bytes = max_request_bytes
+        self.max_namespaces = max_namespaces
+        self._namespaces: List[str] = []
+        self._namespace_counts: Tuple[Tuple[str, int], ...] = ()
+        self._namespaces_at = float("-inf")
+        self._namespaces_error: Optional[Exception] = None
+        self._writes = 0
+
+    def _upsert_one(self, batch: List[VectorRecord], namespace: str) -> int:
+        resp = with_retries(self.index.upsert, vectors=batch, namespace=namespace)
+        if isinstance(resp, dict):
+            return int(resp.get("upserted_count", 0))
+        return int(getattr(resp, "upserted_count", 0) or 0)
+
+    def upsert(self, vectors: Iterable[VectorRecord], namespace: str = "") -> Dict[str, int]:
+        self._writes += 1
+        futures = [self._upsert_pool.submit(self._upsert_one, batch, namespace) for batch in payload_batches(list(vectors), self.max_request_bytes)]
+        # Every request is waited for before a failure is raised, so nothing is still writing behind the caller.
+        errors = [f.exception() for f in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return {"upserted_count": sum(f.result() for f in futures)}
+
+    def _refresh_namespaces(self) -> None:
+        # Listing namespaces costs a round trip, so the list is refreshed at most every namespace_ttl
+        # seconds. Failed attempts count too: during an outage the stale list is used (or, before the
+        # first success, the last error re-raised) instead of every query retrying the stats call.
+        now = time.monotonic()
+        if now - self._namespaces_at <= self.namespace_ttl:
+            if self._namespaces_error is not None and not self._namespaces:
+                raise self._namespaces_error
+            return
+        self._namespaces_at = now
+        try:
+            namespaces = self.describe_index_stats().get("namespaces") or {}
+        except Exception as exc:
+            self._namespaces_error = exc
+            if not self._namespaces:
+                raise
+            logger.warning("Could not refresh Pinecone namespaces, using the last list: %s", exc)
+            return
+        self._namespaces_error = None
+        self._namespaces = sorted(namespaces) or [""]
+        self._namespace_counts = tuple(
+            (ns, int((stats or {}).get("vector_count", 0))) for ns, stats in sorted(namespaces.items())
+        )
+
+    def _all_namespaces(self) -> List[str]:
+        self._refresh_namespaces()
+        return self._namespaces
+
+    def generation(self) -> Any:
+        """Per-namespace vector counts plus this store's own writes, refreshed every ``namespace_ttl`` seconds.
+
+        Pinecone keeps no change counter, so writes from another host are only
+        seen once they change some namespace's vector count; an overwrite or a
+        metadata update that leaves every count as it was goes unnoticed.
+        """
+        try:
+            self._refresh_namespaces()
+        except Exception as exc:
+            logger.warning("Could not refresh index stats for the generation check: %s", exc)
+        return (self._writes, self._namespace_counts)
+
+    def _query_one(self, vector: List[float], top_k: int, include_metadata: bool, namespace: str, filter: Optional[Dict[str, Any]]):
+        kwargs: Dict[str, Any] = {}
+        if namespace:
+            kwargs["namespace"] = namespace
+        if filter:
+            kwargs["filter"] = filter
+        resp = self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, **kwargs)
+        return normalize_matches(resp)
+
+    def query(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        vector = list(vector)
+        if namespace is None:
+            namespaces = self._all_namespaces()
+        elif isinstance(namespace, str):
+            namespaces = [namespace]
+        else:
+            namespaces = list(namespace)
+        if len(namespaces) > self.max_namespaces:
+            raise QueryScopeError(
+                f"query spans {len(namespaces)} repositories (at most {self.max_namespaces} per query); narrow it with repo"
+            )
+        if len(namespaces) == 1:
+            return {"matches": self._query_one(vector, top_k, include_metadata, namespaces[0], filter)}
+        results = self._pool.map(lambda ns: self._query_one(vector, top_k, include_metadata, ns, filter), namespaces)
+        # Pinecone reports euclidean results as distances, so smaller is better there.
+        return {"matches": merge_matches(results, top_k, higher_is_better=self.metric != "euclidean")}
+
+    def query_many(
+        self,
+        vectors: Sequence[Sequence[float]],
+        top_k: int = 10,
+        include_metadata: bool = True,
+        namespace: Namespaces = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Issue the queries as parallel index calls; responses come back in input order."""
+        return list(
+            self._batch_pool.map(
+                lambda v: self.query(v, top_k=top_k, include_metadata=include_metadata, namespace=namespace, filter=filter),
+                vectors,
+            )
+        )
+
+    def delete(self, ids: List[str], namespace: str = "") -> None:
+        self._writes += 1
+        # Pinecone accepts at most 1000 ids per delete request.
+        for i in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[i : i + 1000], namespace=namespace)
+
+    def update_metadata(self, id: str, set_metadata: Dict[str, Any], namespace: str = "") -> None:
+        self._writes += 1
+        self.index.update(id=id, set_metadata=set_metadata, namespace=namespace)
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        raw = self.index.describe_index_stats()
+        if isinstance(raw, dict):
+            return raw
+        return raw.to_dict()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+        self._batch_pool.shutdown(wait=False)
+        self._upsert_pool.shutdown(wait=False)
+
+
+def index_chunked_documents(client: "Pinecone", index_name: str, chunked_docs: List[Dict[str, Any]], batch_size: int = 100) -> None:
     """Wrapper that delegates embedding and upsert to services.embedding_service.embed_and_upsert."""
-    idx = client.Index(index_name)
-    embed_and_upsert(idx, chunked_docs, batch_size=batch_size)
\ No newline at end of file
+    idx = PineconeStore(client.Index(index_name))
+    try:
+        embed_and_upsert(idx, chunked_docs, batch_size=batch_size)
+    finally:
+        idx.close()
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.chunk_store import open_chunk_store
+from services.embedding_service import embed_and_upsert
+from vectorstore import pinecone as vs_pinecone
+from vectorstore.base import VectorStore
+from vectorstore.local import LocalVectorStore
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# "pinecone" (remote, default) or "local" (embedded memory-mapped index).
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(".gitsense", "index"))
+# Ingest also bumps a per-index marker file here after writing. It only reaches query services that
+# share this filesystem; the store's own generation (see index_generation) covers the rest.
+INDEX_GENERATION_DIR = os.getenv("INDEX_GENERATION_DIR", os.path.join(".gitsense", "generations"))
+
+# Pinecone vectors also keep their chunk text in metadata, because the chunk store is a local file
+# that other readers of the shared index may not have. Set to 1 once every reader hydrates texts.
+PINECONE_SLIM_METADATA = os.getenv("PINECONE_SLIM_METADATA", "0") != "0"
+
+_local_stores: Dict[str, LocalVectorStore] = {}
+_local_lock = threading.Lock()
+# name -> [store, users] for shared_store
+_shared_stores: Dict[str, List[Any]] = {}
+_shared_lock = threading.Lock()
+
+
+def init_client() -> Optional[Any]:
+    """Return a Pinecone client for the pinecone backend, or None for the local backend."""
+    if VECTOR_BACKEND == "local":
+        return None
+    return vs_pinecone.init_pinecone()
+
+
+def open_store(client=None, name: str = vs_pinecone.INDEX_NAME) -> VectorStore:
+    """Open the configured vector backend for ``name``.
+
+    Local stores are cached per path so the ingest code and the query service
+    share one memory map when they run in the same process.
+    """
+    if VECTOR_BACKEND == "local":
+        path = os.path.join(LOCAL_INDEX_DIR, name)
+        with _local_lock:
+            store = _local_stores.get(path)
+            if store is None:
+                store = LocalVectorStore(path, dimension=vs_pinecone.VECTOR_DIM, metric=vs_pinecone.METRIC)
+                _local_stores[path] = store
+                logger.info("Opened local vector index at '%s'", path)
+        return store
+    if VECTOR_BACKEND != "pinecone":
+        raise ValueError(f"Unknown VECTOR_BACKEND '{VECTOR_BACKEND}' (expected 'pinecone' or 'local')")
+
+    client = client or vs_pinecone.init_pinecone()
+    return vs_pinecone.PineconeStore(client.Index(name))
+
+
+@contextmanager
+def shared_store(client=None, name: str = vs_pinecone.INDEX_NAME) -> Iterator[VectorStore]:
+    """Open ``name`` once for all concurrent users, e.g. the ingest runs of several repos.
+
+    A PineconeStore bounds its in-flight upserts per store, so sharing one keeps
+    concurrent ingests together within PINECONE_UPSERT_WORKERS; the last user
+    to leave closes it and its thread pools. Local stores are already shared by
+    ``open_store`` and stay open.
+    """
+    with _shared_lock:
+        entry = _shared_stores.get(name)
+        if entry is None:
+            entry = _shared_stores[name] = [open_store(client, name), 0]
+        entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        with _shared_lock:
+            entry[1] -= 1
+            last = entry[1] == 0
+            if last:
+                del _shared_stores[name]
+        if last and VECTOR_BACKEND != "local":
+            entry[0].close()
+
+
+def index_chunked_documents(client, index_name: str, chunked_docs: List[Dict[str, Any]], batch_size: int = 100) -> None:
+    """Embed and upsert chunked documents into whichever backend is configured."""
+    text_store = open_chunk_store(index_name)
+    with shared_store(client, index_name) as store:
+        embed_and_upsert(
+            store, chunked_docs, batch_size=batch_size, text_store=text_store, include_text=text_in_metadata(text_store)
+        )
+        store.maybe_build_ann()
+    bump_generation(index_name)
+
+
+def text_in_metadata(chunk_store) -> bool:
+    """Whether upserted vectors carry their chunk text under ``metadata["text"]``."""
+    if chunk_store is None:
+        return True
+    return VECTOR_BACKEND == "pinecone" and not PINECONE_SLIM_METADATA
+
+
+def _generation_path(name: str) -> str:
+    return os.path.join(INDEX_GENERATION_DIR, name)
+
+
+def bump_generation(name: str = vs_pinecone.INDEX_NAME) -> None:
+    """Record that the contents of index ``name`` changed."""
+    os.makedirs(INDEX_GENERATION_DIR, exist_ok=True)
+    path = _generation_path(name)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        fh.write(str(time.time_ns()))
+    os.replace(tmp, path)
+
+
+def index_generation(name: str = vs_pinecone.INDEX_NAME, store: Optional[VectorStore] = None) -> Tuple[Any, Optional[str]]:
+    """Opaque token that changes when index ``name`` is written to.
+
+    Combines ``store.generation()``, which the store derives from its own
+    contents and so sees writes from any host, with the marker file that
+    ``bump_generation`` rewrites, which is immediate but only shared with
+    processes on the same filesystem.
+    """
+    try:
+        with open(_generation_path(name)) as fh:
+            marker = fh.read()
+    except FileNotFoundError:
+        marker = None
+    return (store.generation() if store is not None else None, marker)
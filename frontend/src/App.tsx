@@ -41,7 +41,7 @@ function mapApiResultToSearchResult(result: {
     path,
     similarity: result.score ?? 0,
     preview: result.text ?? '',
-    page_content: meta.text as string,
+    page_content: (meta.text as string | undefined) ?? result.text ?? '',
     language: meta.language as string | undefined,
     lines: meta.lines as number | undefined,
     repo,